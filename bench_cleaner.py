@@ -0,0 +1,165 @@
+import argparse
+
+import json
+
+import sqlite3
+
+import time
+
+from pathlib import Path
+
+from typing import List
+
+from response_cleaner import StreamCleaner, get_cleaner
+
+HISTORY_DIR = Path("user_history")
+
+DB_FILE = Path("data") / "bot_database.db"
+
+MODES = ("saharoza", "dedinside", "genius")
+
+NOISE_TEMPLATES = (
+    "{text}",
+    "Okay, here is the response:\n{text}",
+    "<s>{text}</s>",
+    "[INST]{text}[/INST]",
+    "Thought: надо ответить вежливо\n{text}",
+    "{text}\nЯ бот, но мне нравится болтать!",
+    "Как ИИ, я скажу так: {text}"
+)
+
+def legacy_clean_response(text: str, mode: str) -> str:
+
+    import re
+
+    text = re.sub(r'<\/?[\w\s="/.\':?]+>', '', text)
+
+    text = re.sub(r'\[\/?[\w\s="/.\':?]+\]', '', text)
+
+    text = re.sub(r'(^|\n)\s*Thought:.*', '', text, flags=re.MULTILINE)
+
+    text = re.sub(r'^\s*Okay, here is the response.*?\n', '', text, flags=re.IGNORECASE | re.MULTILINE)
+
+    if mode == "genius":
+
+        text = re.sub(r'(?i)(как (?:ии|искусственный интеллект|ai|language model))', '', text)
+
+        if text and len(text.split()) < 15 and not text.startswith("Ой,") and not text.startswith("Произошла"):
+
+            text += "\n\nЭто краткий ответ. Если нужно больше деталей - уточни вопрос."
+
+    elif mode == "dedinside":
+
+        text = re.sub(r'(?i)(я (?:бот|программа|ии|модель))', '', text)
+
+        if text and not any(c in text for c in ('?', '!', '...', '😏', '😈', '👀')): text += '... Ну че, как тебе такое? 😏'
+
+    elif mode == "saharoza":
+
+        text = re.sub(r'(?i)(я (?:бот|программа|ии|модель))', '', text)
+
+        if text and not any(c in text for c in ('?', '!', '...', '🌸', '✨', '💔', '😉')): text += '... И что ты на это скажешь? 😉'
+
+    cleaned_text = text.strip()
+
+    return cleaned_text if cleaned_text else "Хм, не знаю, что ответить... Спроси что-нибудь еще?"
+
+def load_corpus() -> List[str]:
+
+    outputs: List[str] = []
+
+    for history_file in sorted(HISTORY_DIR.glob("*_history.json")):
+
+        try:
+
+            with open(history_file, "r", encoding="utf-8") as f:
+
+                entries = json.load(f)
+
+        except (OSError, ValueError) as e:
+
+            print(f"Skipping {history_file}: {e}")
+
+            continue
+
+        outputs.extend(entry["bot"] for entry in entries if isinstance(entry, dict) and entry.get("bot"))
+
+    if DB_FILE.exists():
+
+        with sqlite3.connect(DB_FILE) as conn:
+
+            try:
+
+                outputs.extend(row[0] for row in conn.execute("SELECT content FROM dialog_ring WHERE role = 'assistant'"))
+
+            except sqlite3.Error as e:
+
+                print(f"Skipping {DB_FILE}: {e}")
+
+    return [template.format(text=text) for text in outputs for template in NOISE_TEMPLATES]
+
+def bench(label: str, fn, corpus: List[str], mode: str, iterations: int) -> float:
+
+    started = time.perf_counter()
+
+    for _ in range(iterations):
+
+        for text in corpus:
+
+            fn(text, mode)
+
+    elapsed = time.perf_counter() - started
+
+    per_call_us = elapsed / (iterations * len(corpus)) * 1e6
+
+    print(f"  {label:<10} {elapsed * 1000:9.1f} ms total, {per_call_us:7.2f} us/call")
+
+    return per_call_us
+
+def stream_clean(text: str, mode: str) -> str:
+
+    cleaner = StreamCleaner(mode)
+
+    for start in range(0, len(text), 8):
+
+        cleaner.feed(text[start:start + 8])
+
+    return cleaner.finish()
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare the legacy response cleaner with response_cleaner.")
+
+    parser.add_argument("--iterations", type=int, default=200)
+
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+
+    if not corpus:
+
+        print("Corpus is empty: no bot replies found in user_history/ or the dialog_ring table.")
+
+        return
+
+    print(f"Corpus: {len(corpus)} outputs ({len(corpus) // len(NOISE_TEMPLATES)} real replies x {len(NOISE_TEMPLATES)} noise templates), {args.iterations} iterations.")
+
+    for mode in MODES:
+
+        mismatches = sum(legacy_clean_response(text, mode) != get_cleaner(mode).clean(text) for text in corpus)
+
+        stream_mismatches = sum(legacy_clean_response(text, mode) != stream_clean(text, mode) for text in corpus)
+
+        print(f"{mode}: {mismatches} outputs differ from the legacy cleaner, {stream_mismatches} when streamed")
+
+        legacy = bench("legacy", legacy_clean_response, corpus, mode, args.iterations)
+
+        current = bench("compiled", lambda text, m: get_cleaner(m).clean(text), corpus, mode, args.iterations)
+
+        bench("stream", stream_clean, corpus, mode, max(1, args.iterations // 10))
+
+        print(f"  speedup    {legacy / current:.2f}x")
+
+if __name__ == '__main__':
+
+    main()
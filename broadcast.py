@@ -0,0 +1,231 @@
+import asyncio
+
+import os
+
+import logging
+
+from contextlib import suppress
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import database as db
+
+from outbound_limiter import PRIORITY_BULK, outbound_priority
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_WINDOW_SIZE = max(1, int(os.getenv("BROADCAST_WINDOW_SIZE", "25")))
+
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "bot was blocked", "bot can't initiate conversation")
+
+SEND_SENT = "sent"
+
+SEND_FAILED = "failed"
+
+SEND_UNREACHABLE = "unreachable"
+
+class Broadcaster:
+
+    def __init__(
+
+        self,
+
+        kind: str,
+
+        bot: Bot,
+
+        recipients: Callable[[int, int], Awaitable[List[int]]],
+
+        prune: Callable[[List[int]], Awaitable[Any]],
+
+        window_size: int = BROADCAST_WINDOW_SIZE
+
+    ):
+
+        self.kind = kind
+
+        self.bot = bot
+
+        self.recipients = recipients
+
+        self.prune = prune
+
+        self.window_size = window_size
+
+        self.jobs = 0
+
+        self.superseded = 0
+
+        self.sent = 0
+
+        self.failed = 0
+
+        self.pruned = 0
+
+        self._task: Optional[asyncio.Task] = None
+
+        self._job: Optional[Dict[str, Any]] = None
+
+    async def resume(self):
+
+        job = await db.get_broadcast_job(self.kind)
+
+        if job is None or job["status"] != "running":
+
+            return
+
+        logger.info(f"Resuming '{self.kind}' broadcast after user {job['cursor_user_id']} ({job['sent']} already sent).")
+
+        self._start(job)
+
+    async def broadcast(self, payload: str):
+
+        if self._task is not None and not self._task.done():
+
+            self.superseded += 1
+
+            logger.info(f"New '{self.kind}' broadcast supersedes the one still running after user {self._job['cursor_user_id']}.")
+
+            await self._cancel()
+
+        await db.start_broadcast_job(self.kind, payload)
+
+        self._start({"kind": self.kind, "payload": payload, "cursor_user_id": 0, "sent": 0, "failed": 0, "pruned": 0, "status": "running"})
+
+    def _start(self, job: Dict[str, Any]):
+
+        self.jobs += 1
+
+        self._job = job
+
+        self._task = asyncio.create_task(self._run(job), name=f"broadcast_{self.kind}")
+
+    async def _run(self, job: Dict[str, Any]):
+
+        outbound_priority.set(PRIORITY_BULK)
+
+        try:
+
+            while True:
+
+                window = await self.recipients(job["cursor_user_id"], self.window_size)
+
+                if not window:
+
+                    break
+
+                results = await asyncio.gather(*(self._send(user_id, job["payload"]) for user_id in window))
+
+                unreachable = [user_id for user_id, result in zip(window, results) if result == SEND_UNREACHABLE]
+
+                if unreachable:
+
+                    await self.prune(unreachable)
+
+                    logger.info(f"Pruned {len(unreachable)} unreachable '{self.kind}' subscribers.")
+
+                sent = results.count(SEND_SENT)
+
+                failed = results.count(SEND_FAILED)
+
+                job["sent"] += sent
+
+                job["failed"] += failed
+
+                job["pruned"] += len(unreachable)
+
+                job["cursor_user_id"] = window[-1]
+
+                self.sent += sent
+
+                self.failed += failed
+
+                self.pruned += len(unreachable)
+
+                await db.update_broadcast_job(self.kind, job["cursor_user_id"], job["sent"], job["failed"], job["pruned"])
+
+            job["status"] = "done"
+
+            await db.update_broadcast_job(self.kind, job["cursor_user_id"], job["sent"], job["failed"], job["pruned"], "done")
+
+            logger.info(f"'{self.kind}' broadcast finished: sent {job['sent']}, failed {job['failed']}, pruned {job['pruned']}.")
+
+        except asyncio.CancelledError:
+
+            raise
+
+        except Exception as e:
+
+            logger.error(f"'{self.kind}' broadcast stopped after user {job['cursor_user_id']}, it will resume on next start: {e}", exc_info=True)
+
+    async def _send(self, user_id: int, payload: str) -> str:
+
+        try:
+
+            await self.bot.send_message(user_id, payload)
+
+            return SEND_SENT
+
+        except TelegramForbiddenError:
+
+            return SEND_UNREACHABLE
+
+        except TelegramBadRequest as e:
+
+            if any(marker in str(e).lower() for marker in UNREACHABLE_ERRORS):
+
+                return SEND_UNREACHABLE
+
+            logger.warning(f"'{self.kind}' broadcast to user {user_id} failed: {e}")
+
+            return SEND_FAILED
+
+        except Exception as e:
+
+            logger.warning(f"'{self.kind}' broadcast to user {user_id} failed: {e}")
+
+            return SEND_FAILED
+
+    async def _cancel(self):
+
+        if self._task is None:
+
+            return
+
+        self._task.cancel()
+
+        with suppress(asyncio.CancelledError):
+
+            await self._task
+
+        self._task = None
+
+    async def close(self):
+
+        await self._cancel()
+
+    def stats(self) -> Dict[str, Any]:
+
+        running = self._task is not None and not self._task.done()
+
+        return {
+
+            "running": running,
+
+            "cursor_user_id": self._job["cursor_user_id"] if running else None,
+
+            "jobs": self.jobs,
+
+            "superseded": self.superseded,
+
+            "sent": self.sent,
+
+            "failed": self.failed,
+
+            "pruned": self.pruned
+
+        }
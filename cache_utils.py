@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+from typing import Any, Dict, Hashable, Optional
+
+class LRUCache:
+
+    def __init__(self, max_size: int):
+
+        self.max_size = max(1, max_size)
+
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+        self.hits = 0
+
+        self.misses = 0
+
+        self.evictions = 0
+
+    def __len__(self) -> int:
+
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+
+        return key in self._data
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+
+        if key in self._data:
+
+            self._data.move_to_end(key)
+
+            self.hits += 1
+
+            return self._data[key]
+
+        self.misses += 1
+
+        return default
+
+    def peek(self, key: Hashable, default: Optional[Any] = None) -> Any:
+
+        return self._data.get(key, default)
+
+    def set(self, key: Hashable, value: Any):
+
+        self._data[key] = value
+
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+
+            self._data.popitem(last=False)
+
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+
+        return self._data.pop(key, default)
+
+    def clear(self):
+
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+
+        lookups = self.hits + self.misses
+
+        return {
+
+            "size": len(self._data),
+
+            "max_size": self.max_size,
+
+            "hits": self.hits,
+
+            "misses": self.misses,
+
+            "evictions": self.evictions,
+
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+
+        }
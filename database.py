@@ -2,240 +2,1088 @@ import aiosqlite
 
 import asyncio
 
+import os
+
+from contextlib import asynccontextmanager, suppress
+
 from pathlib import Path
 
-from typing import List, Tuple, Optional, Dict, Any
+from collections import deque
+
+from typing import List, Tuple, Optional, Dict, Any, AsyncIterator, Set, Callable
+
+from datetime import datetime, timezone
+
+import logging
+
+import time
+
+from cache_utils import LRUCache
+
+from query_stats import QueryStats, statement_name
+
+import migrations
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = Path("data") / "bot_database.db"
+
+DB_FILE.parent.mkdir(exist_ok=True)
+
+DB_READER_CONNECTIONS = max(1, int(os.getenv("DB_READER_CONNECTIONS", "3")))
+
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+
+DB_WRITE_BATCH_MAX = max(1, int(os.getenv("DB_WRITE_BATCH_MAX", "64")))
+
+DB_BACKFILL_CHUNK_ROWS = max(1, int(os.getenv("DB_BACKFILL_CHUNK_ROWS", "500")))
+
+DB_BACKFILL_PAUSE_MS = max(0, int(os.getenv("DB_BACKFILL_PAUSE_MS", "50")))
+
+ANALYTICS_FLUSH_ROWS = max(1, int(os.getenv("ANALYTICS_FLUSH_ROWS", "200")))
+
+ANALYTICS_FLUSH_INTERVAL_MS = max(50, int(os.getenv("ANALYTICS_FLUSH_INTERVAL_MS", "2000")))
+
+ANALYTICS_MAX_BACKLOG_FACTOR = 10
+
+ANALYTICS_RETENTION_DAYS = max(0, int(os.getenv("ANALYTICS_RETENTION_DAYS", "90")))
+
+ANALYTICS_RETENTION_INTERVAL_SECONDS = max(60, int(os.getenv("ANALYTICS_RETENTION_INTERVAL_SECONDS", "3600")))
+
+ANALYTICS_RETENTION_CHUNK_ROWS = max(1, int(os.getenv("ANALYTICS_RETENTION_CHUNK_ROWS", "2000")))
+
+ANALYTICS_TOTALS_UPSERT = migrations.ANALYTICS_TOTALS_UPSERT
+
+DIALOG_HISTORY_SLOTS = 20
+
+HISTORY_CACHE_USERS = max(1, int(os.getenv("HISTORY_CACHE_USERS", "1000")))
+
+USER_MODE_CACHE_SIZE = max(1, int(os.getenv("USER_MODE_CACHE_SIZE", "5000")))
+
+class _WriteJob:
+
+    __slots__ = ("statements", "future", "name")
+
+    def __init__(self, statements: List[Tuple[str, Any, bool]], future: asyncio.Future, name: Optional[str] = None):
+
+        self.statements = statements
+
+        self.future = future
+
+        self.name = name or statement_name(statements[0][0])
+
+class ConnectionPool:
+
+    def __init__(self, db_file: Path, readers_count: int, query_stats: Optional[QueryStats] = None):
+
+        self.db_file = db_file
+
+        self.readers_count = readers_count
+
+        self.query_stats = query_stats or QueryStats()
+
+        self._writer: Optional[aiosqlite.Connection] = None
+
+        self._writer_lock = asyncio.Lock()
+
+        self._writer_task: Optional[asyncio.Task] = None
+
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+
+        self._readers: List[aiosqlite.Connection] = []
+
+        self._idle_readers: asyncio.Queue = asyncio.Queue()
+
+    @property
+    def is_open(self) -> bool:
+
+        return self._writer is not None
+
+    async def _configure(self, conn: aiosqlite.Connection):
+
+        await conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+
+        await conn.execute("PRAGMA synchronous = NORMAL")
+
+        await conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+
+        await conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+
+    async def open(self):
+
+        if self.is_open:
+
+            logger.warning("Connection pool is already open.")
+
+            return
+
+        self._writer = await aiosqlite.connect(self.db_file)
+
+        async with self._writer.execute("PRAGMA journal_mode = WAL") as cursor:
+
+            journal_mode = (await cursor.fetchone())[0]
+
+        if str(journal_mode).lower() != "wal":
+
+            logger.warning(f"Could not switch {self.db_file} to WAL, journal_mode is '{journal_mode}'.")
+
+        await self._configure(self._writer)
+
+        for _ in range(self.readers_count):
+
+            reader = await aiosqlite.connect(self.db_file)
+
+            await self._configure(reader)
+
+            self._readers.append(reader)
+
+            self._idle_readers.put_nowait(reader)
+
+        logger.info(f"Connection pool opened: 1 writer, {self.readers_count} readers ({self.db_file}, journal_mode={journal_mode}).")
+
+    def start_writer(self):
+
+        if self._writer_task is None or self._writer_task.done():
+
+            self._writer_task = asyncio.create_task(self._writer_loop(), name="db_writer")
+
+    async def close(self):
+
+        if not self.is_open:
+
+            return
+
+        if self._writer_task is not None:
+
+            self._write_queue.put_nowait(None)
+
+            with suppress(asyncio.CancelledError):
+
+                await self._writer_task
+
+            self._writer_task = None
+
+        async with self._writer_lock:
+
+            for reader in self._readers:
+
+                try:
+
+                    await reader.close()
+
+                except Exception as e:
+
+                    logger.error(f"Error closing reader connection: {e}", exc_info=True)
+
+            self._readers.clear()
+
+            self._idle_readers = asyncio.Queue()
+
+            try:
+
+                await self._writer.close()
+
+            except Exception as e:
+
+                logger.error(f"Error closing writer connection: {e}", exc_info=True)
+
+            self._writer = None
+
+        logger.info("Connection pool closed.")
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+
+        if self._writer is None: raise RuntimeError("Database pool is not initialized. Call init_db() first.")
+
+        async with self._writer_lock:
+
+            try:
+
+                yield self._writer
+
+            except Exception:
+
+                await self._writer.rollback()
+
+                raise
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+
+        if self._writer is None: raise RuntimeError("Database pool is not initialized. Call init_db() first.")
+
+        reader = await self._idle_readers.get()
+
+        try:
+
+            yield reader
+
+        finally:
+
+            self._idle_readers.put_nowait(reader)
+
+    async def _fetch(self, name: Optional[str], sql: str, params: Any, fetch_all: bool) -> Any:
+
+        async with self.reader() as db:
+
+            started = time.perf_counter()
+
+            result = None
+
+            error = None
+
+            try:
+
+                async with db.execute(sql, params) as cursor:
+
+                    result = await cursor.fetchall() if fetch_all else await cursor.fetchone()
+
+                return result
+
+            except Exception as e:
+
+                error = e
+
+                raise
+
+            finally:
+
+                rows = len(result) if fetch_all and result is not None else int(result is not None)
+
+                self.query_stats.record(name or statement_name(sql), (time.perf_counter() - started) * 1000, rows, params, error)
+
+    async def fetchone(self, sql: str, params: Any = (), name: Optional[str] = None) -> Optional[Tuple[Any, ...]]:
+
+        return await self._fetch(name, sql, params, False)
+
+    async def fetchall(self, sql: str, params: Any = (), name: Optional[str] = None) -> List[Tuple[Any, ...]]:
+
+        return await self._fetch(name, sql, params, True)
+
+    async def write(self, *statements: Tuple[str, Any], name: Optional[str] = None):
+
+        await self._submit([(sql, params, False) for sql, params in statements], name)
+
+    async def write_many(self, sql: str, seq_of_params: List[Any], name: Optional[str] = None):
+
+        await self._submit([(sql, seq_of_params, True)], name)
+
+    async def write_batch(self, statements: List[Tuple[str, Any, bool]], name: Optional[str] = None):
+
+        await self._submit(statements, name)
+
+    async def _submit(self, statements: List[Tuple[str, Any, bool]], name: Optional[str] = None):
+
+        if self._writer_task is None or self._writer_task.done():
+
+            raise RuntimeError("Database writer task is not running. Call init_db() first.")
+
+        future = asyncio.get_running_loop().create_future()
+
+        self._write_queue.put_nowait(_WriteJob(statements, future, name))
+
+        await future
+
+    async def _run_job(self, job: _WriteJob):
+
+        started = time.perf_counter()
+
+        rows = 0
+
+        error = None
+
+        try:
+
+            for sql, params, many in job.statements:
+
+                if many:
+
+                    cursor = await self._writer.executemany(sql, params)
+
+                else:
+
+                    cursor = await self._writer.execute(sql, params)
+
+                rows += max(0, cursor.rowcount)
+
+        except Exception as e:
+
+            error = e
+
+            raise
+
+        finally:
+
+            self.query_stats.record(job.name, (time.perf_counter() - started) * 1000, rows, [params for _, params, _ in job.statements], error)
+
+    async def _run_jobs(self, jobs: List[_WriteJob]):
+
+        for job in jobs:
+
+            await self._run_job(job)
+
+        started = time.perf_counter()
+
+        await self._writer.commit()
+
+        self.query_stats.record("COMMIT", (time.perf_counter() - started) * 1000, len(jobs))
+
+    async def _rollback(self):
+
+        try:
+
+            await self._writer.rollback()
+
+        except Exception as e:
+
+            logger.error(f"Rollback on the writer connection failed: {e}", exc_info=True)
+
+    async def _writer_loop(self):
+
+        logger.info("Database writer task started.")
+
+        stopping = False
+
+        while not stopping:
+
+            job = await self._write_queue.get()
+
+            if job is None:
+
+                break
+
+            batch = [job]
+
+            while len(batch) < DB_WRITE_BATCH_MAX and not self._write_queue.empty():
+
+                next_job = self._write_queue.get_nowait()
+
+                if next_job is None:
+
+                    stopping = True
+
+                    break
+
+                batch.append(next_job)
+
+            try:
+
+                async with self._writer_lock:
+
+                    try:
+
+                        await self._run_jobs(batch)
+
+                        failed = []
+
+                    except Exception as e:
+
+                        await self._rollback()
+
+                        if len(batch) == 1:
+
+                            failed = [(batch[0], e)]
+
+                        else:
+
+                            logger.warning(f"Batched write of {len(batch)} jobs failed ({e}), retrying jobs one by one.")
+
+                            failed = []
+
+                            for single_job in batch:
+
+                                try:
+
+                                    await self._run_jobs([single_job])
+
+                                except Exception as single_e:
+
+                                    await self._rollback()
+
+                                    failed.append((single_job, single_e))
+
+            except Exception as e:
+
+                logger.error(f"Database writer failed on a batch of {len(batch)} jobs: {e}", exc_info=True)
+
+                failed = [(failed_job, e) for failed_job in batch]
+
+            failed_jobs = {id(failed_job): error for failed_job, error in failed}
+
+            for finished_job in batch:
+
+                if finished_job.future.done():
+
+                    continue
+
+                if id(finished_job) in failed_jobs:
+
+                    finished_job.future.set_exception(failed_jobs[id(finished_job)])
+
+                else:
+
+                    finished_job.future.set_result(None)
+
+        logger.info("Database writer task stopped.")
+
+_pool: Optional[ConnectionPool] = None
+
+_backfill_task: Optional[asyncio.Task] = None
+
+_retention_task: Optional[asyncio.Task] = None
+
+class AnalyticsBuffer:
+
+    def __init__(self, max_rows: int, flush_interval_ms: int):
+
+        self.max_rows = max_rows
+
+        self.flush_interval = flush_interval_ms / 1000
+
+        self._interactions: List[Tuple[int, float, str, str]] = []
+
+        self._ratings: List[Tuple[int, float, int, str, Optional[int], Optional[int]]] = []
+
+        self._last_active: Dict[int, float] = {}
+
+        self._flush_lock = asyncio.Lock()
+
+        self._timer_task: Optional[asyncio.Task] = None
+
+        self._pending_flushes: set = set()
+
+    def __len__(self) -> int:
+
+        return len(self._interactions) + len(self._ratings)
+
+    def start(self):
+
+        if self._timer_task is None or self._timer_task.done():
+
+            self._timer_task = asyncio.create_task(self._flush_periodically(), name="analytics_flush")
+
+    async def stop(self):
+
+        if self._timer_task is not None:
+
+            self._timer_task.cancel()
+
+            with suppress(asyncio.CancelledError):
+
+                await self._timer_task
+
+            self._timer_task = None
+
+        if self._pending_flushes:
+
+            await asyncio.gather(*self._pending_flushes, return_exceptions=True)
+
+        await self.flush()
+
+    def add_interaction(self, user_id: int, timestamp: float, mode: str, action_type: str):
+
+        self._interactions.append((user_id, timestamp, mode, action_type))
+
+        self._last_active[user_id] = timestamp
+
+        self._flush_if_full()
+
+    def add_rating(self, user_id: int, timestamp: float, rating: int, message_preview: str, rated_msg_id: Optional[int], dialog_hist_id: Optional[int]):
+
+        self._ratings.append((user_id, timestamp, rating, message_preview, rated_msg_id, dialog_hist_id))
+
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+
+        if len(self) < self.max_rows or self._pending_flushes:
+
+            return
+
+        task = asyncio.create_task(self.flush())
+
+        self._pending_flushes.add(task)
+
+        task.add_done_callback(self._pending_flushes.discard)
+
+    async def _flush_periodically(self):
+
+        while True:
+
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+
+                await self.flush()
+
+            except Exception as e:
+
+                logger.error(f"Analytics buffer periodic flush failed: {e}", exc_info=True)
+
+    async def flush(self):
+
+        async with self._flush_lock:
+
+            if not self._interactions and not self._ratings:
+
+                return
+
+            interactions, self._interactions = self._interactions, []
+
+            ratings, self._ratings = self._ratings, []
+
+            last_active, self._last_active = self._last_active, {}
+
+            statements = []
+
+            if interactions:
+
+                statements.append(('''
+                    INSERT INTO analytics_interactions (user_id, timestamp, mode, action_type) VALUES (?, ?, ?, ?)
+                ''', interactions, True))
+
+                statements.append((
+                    'UPDATE users SET last_active_ts = ? WHERE user_id = ?',
+                    [(ts, user_id) for user_id, ts in last_active.items()],
+                    True
+                ))
+
+                daily_counts: Dict[Tuple[int, int, str], int] = {}
+
+                user_totals: Dict[int, List[Any]] = {}
+
+                for user_id, ts, mode, _ in interactions:
+
+                    day_key = (user_id, int(ts // 86400), mode)
+
+                    daily_counts[day_key] = daily_counts.get(day_key, 0) + 1
+
+                    totals = user_totals.setdefault(user_id, [0, mode, ts])
+
+                    totals[0] += 1
+
+                    if ts >= totals[2]:
+
+                        totals[1], totals[2] = mode, ts
+
+                statements.append(('''
+                    INSERT INTO analytics_daily_rollup (user_id, day, mode, interactions) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id, day, mode) DO UPDATE SET interactions = interactions + excluded.interactions
+                ''', [(user_id, day, mode, count) for (user_id, day, mode), count in daily_counts.items()], True))
 
-from datetime import datetime
+                statements.append((ANALYTICS_TOTALS_UPSERT, [(user_id, *totals) for user_id, totals in user_totals.items()], True))
 
-import logging
+            if ratings:
 
-logger = logging.getLogger(__name__)
+                statements.append(('''
+                    INSERT INTO analytics_ratings (user_id, timestamp, rating, message_preview, rated_message_id, dialog_history_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', ratings, True))
 
-DB_FILE = Path("data") / "bot_database.db"
+            try:
 
-DB_FILE.parent.mkdir(exist_ok=True)
+                await _get_pool().write_batch(statements, name="analytics.flush")
 
-async def init_db():
-
-    async with aiosqlite.connect(DB_FILE) as db:
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT NOT NULL,
-                last_active_ts REAL DEFAULT 0
-            )
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS value_subscriptions (
-                user_id INTEGER PRIMARY KEY,
-                subscribed_ts REAL NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS dialog_history (
-                history_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp REAL NOT NULL,
-                mode TEXT NOT NULL,
-                role TEXT NOT NULL CHECK(role IN ('user', 'assistant')), -- Добавим роль для явности
-                content TEXT NOT NULL, -- Одно поле для контента
-                -- user_message TEXT NOT NULL, -- Устарело, используем role и content
-                -- bot_response TEXT NOT NULL, -- Устарело, используем role и content
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        await db.execute('''
-            CREATE INDEX IF NOT EXISTS idx_dialog_history_user_ts ON dialog_history (user_id, timestamp DESC)
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS user_modes (
-                user_id INTEGER PRIMARY KEY,
-                mode TEXT NOT NULL DEFAULT 'saharoza', -- Добавим DEFAULT
-                rating_opportunities_count INTEGER DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS analytics_interactions (
-                interaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                timestamp REAL NOT NULL,
-                mode TEXT NOT NULL, -- Режим во время взаимодействия
-                action_type TEXT NOT NULL DEFAULT 'message', -- Тип действия (message, command, callback, etc.)
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        await db.execute('''
-            CREATE INDEX IF NOT EXISTS idx_interactions_user_ts_mode ON analytics_interactions (user_id, timestamp DESC, mode)
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS analytics_ratings (
-                rating_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                rated_message_id INTEGER, -- Опционально: ID сообщения бота, которое оценили
-                dialog_history_id INTEGER, -- Опционально: ссылка на запись в dialog_history (если оценка относится к конкретному ответу)
-                timestamp REAL NOT NULL,
-                rating INTEGER NOT NULL CHECK(rating IN (0, 1)), -- 0 для дизлайка, 1 для лайка
-                message_preview TEXT, -- Превью сообщения, к которому относится оценка
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-                FOREIGN KEY(dialog_history_id) REFERENCES dialog_history(history_id) ON DELETE SET NULL
-            )
-        ''')
-
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS rp_user_stats (
-                user_id INTEGER PRIMARY KEY,
-                hp INTEGER NOT NULL DEFAULT 100,
-                heal_cooldown_ts REAL NOT NULL DEFAULT 0,
-                recovery_end_ts REAL NOT NULL DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        await db.commit()
-
-    logger.info("Database initialized successfully.")
-
-async def ensure_user(user_id: int, username: Optional[str], first_name: str):
+            except Exception as e:
 
-    current_ts = datetime.now().timestamp()
+                logger.error(f"Failed to flush {len(interactions)} interactions and {len(ratings)} ratings: {e}", exc_info=True)
+
+                if len(interactions) + len(ratings) + len(self) <= self.max_rows * ANALYTICS_MAX_BACKLOG_FACTOR:
+
+                    self._interactions[:0] = interactions
+
+                    self._ratings[:0] = ratings
+
+                    for user_id, ts in last_active.items():
+
+                        self._last_active.setdefault(user_id, ts)
+
+                else:
+
+                    logger.error("Analytics backlog limit reached, dropping the failed batch.")
+
+                return
+
+            logger.debug(f"Flushed {len(interactions)} interactions and {len(ratings)} ratings.")
+
+_analytics = AnalyticsBuffer(ANALYTICS_FLUSH_ROWS, ANALYTICS_FLUSH_INTERVAL_MS)
+
+_history_cache = LRUCache(HISTORY_CACHE_USERS)
+
+_mode_cache = LRUCache(USER_MODE_CACHE_SIZE)
+
+_mode_invalidations: Dict[int, int] = {}
+
+_query_stats = QueryStats()
+
+_value_subscribers: Optional[Set[int]] = None
+
+_value_subscribers_lock = asyncio.Lock()
+
+_invalidation_listener: Optional[Callable[[str, int], None]] = None
+
+
+def _get_pool() -> ConnectionPool:
+
+    if _pool is None: raise RuntimeError("Database pool is not initialized. Call init_db() first.")
+
+    return _pool
+
+async def init_db(background_tasks: bool = True):
+
+    global _pool, _backfill_task, _retention_task
+
+    if _pool is None:
+
+        _pool = ConnectionPool(DB_FILE, DB_READER_CONNECTIONS, _query_stats)
+
+    if not _pool.is_open:
+
+        await _pool.open()
+
+    async with _pool.writer() as db:
+
+        schema_version = await migrations.apply_migrations(db)
+
+    _pool.start_writer()
+
+    _analytics.start()
+
+    if background_tasks and (_backfill_task is None or _backfill_task.done()):
+
+        _backfill_task = asyncio.create_task(_run_backfills(), name="db_backfills")
+
+    if background_tasks and ANALYTICS_RETENTION_DAYS and (_retention_task is None or _retention_task.done()):
+
+        _retention_task = asyncio.create_task(_analytics_retention_loop(), name="analytics_retention")
+
+    logger.info(f"Database initialized successfully (schema version {schema_version}).")
+
+async def _run_backfills():
+
+    try:
+
+        await migrations.run_backfills(_get_pool(), DB_BACKFILL_CHUNK_ROWS, DB_BACKFILL_PAUSE_MS / 1000)
+
+    except asyncio.CancelledError:
+
+        logger.info("Backfills interrupted, they will resume on next start.")
+
+        raise
+
+    except Exception as e:
+
+        logger.error(f"Backfill failed, it will resume on next start: {e}", exc_info=True)
+
+async def _analytics_retention_loop():
+
+    while True:
+
+        try:
+
+            await prune_analytics(ANALYTICS_RETENTION_DAYS)
+
+        except Exception as e:
+
+            logger.error(f"Analytics retention pass failed: {e}", exc_info=True)
+
+        await asyncio.sleep(ANALYTICS_RETENTION_INTERVAL_SECONDS)
+
+async def prune_analytics(retention_days: int, chunk_rows: int = ANALYTICS_RETENTION_CHUNK_ROWS) -> int:
+
+    pool = _get_pool()
+
+    async with pool.reader() as db:
+
+        if not await migrations.is_backfill_done(db, migrations.ANALYTICS_ROLLUP_BACKFILL):
+
+            logger.info("Analytics retention skipped: rollup backfill is still running.")
+
+            return 0
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    cutoff_ts = datetime.now().timestamp() - retention_days * 86400
 
-        await db.execute('''
-            INSERT INTO users (user_id, username, first_name, last_active_ts)
-            VALUES (?, ?, ?, ?)
+    pruned = 0
+
+    while True:
+
+        rows = await pool.fetchall('''
+            SELECT interaction_id FROM analytics_interactions
+            WHERE timestamp < ? ORDER BY interaction_id LIMIT ?
+        ''', (cutoff_ts, chunk_rows), name="analytics.select_stale")
+
+        stale_ids = [row[0] for row in rows]
+
+        if not stale_ids:
+
+            break
+
+        await pool.write_many('DELETE FROM analytics_interactions WHERE interaction_id = ?', [(interaction_id,) for interaction_id in stale_ids], name="analytics.prune")
+
+        pruned += len(stale_ids)
+
+        if len(stale_ids) < chunk_rows:
+
+            break
+
+        await asyncio.sleep(DB_BACKFILL_PAUSE_MS / 1000)
+
+    if pruned:
+
+        logger.info(f"Analytics retention: pruned {pruned} interactions older than {retention_days} days.")
+
+    return pruned
+
+async def flush_analytics():
+
+    await _analytics.flush()
+
+async def close_db():
+
+    global _pool, _backfill_task, _retention_task, _value_subscribers
+
+    for task in (_backfill_task, _retention_task):
+
+        if task is not None:
+
+            task.cancel()
+
+            with suppress(asyncio.CancelledError):
+
+                await task
+
+    _backfill_task = None
+
+    _retention_task = None
+
+    _value_subscribers = None
+
+    if _pool is not None:
+
+        await _analytics.stop()
+
+        await _pool.close()
+
+        _pool = None
+
+def set_invalidation_listener(listener: Optional[Callable[[str, int], None]]):
+
+    global _invalidation_listener
+
+    _invalidation_listener = listener
+
+def _publish_invalidation(kind: str, user_id: int):
+
+    if _invalidation_listener is not None:
+
+        _invalidation_listener(kind, user_id)
+
+def apply_invalidation(kind: str, user_id: int):
+
+    global _value_subscribers
+
+    if kind == "mode":
+
+        invalidate_user_mode_cache(user_id)
+
+    elif kind == "history":
+
+        _history_cache.pop(user_id)
+
+    elif kind == "value_subscribers":
+
+        _value_subscribers = None
+
+async def ensure_user(user_id: int, username: Optional[str], first_name: str, last_name: Optional[str] = None):
+
+    current_ts = datetime.now().timestamp()
+
+    await _get_pool().write(
+        ('''
+            INSERT INTO users (user_id, username, first_name, last_name, last_active_ts, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
             ON CONFLICT(user_id) DO UPDATE SET
                 username = excluded.username,
                 first_name = excluded.first_name,
+                last_name = excluded.last_name,
                 last_active_ts = excluded.last_active_ts
-        ''', (user_id, username, first_name, current_ts))
-
-        await db.execute('''
+        ''', (user_id, username, first_name, last_name, current_ts, current_ts)),
+        ('''
+            INSERT OR IGNORE INTO user_profiles (user_id) VALUES (?)
+        ''', (user_id,)),
+        ('''
             INSERT OR IGNORE INTO user_modes (user_id, mode, rating_opportunities_count)
             VALUES (?, 'saharoza', 0)
-        ''', (user_id,))
-
-        await db.execute('''
+        ''', (user_id,)),
+        ('''
             INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)
-        ''', (user_id,))
-
-        await db.commit()
+        ''', (user_id,)),
+        name="users.ensure"
+    )
 
 async def get_user_info(user_id: int) -> Optional[Dict[str, Any]]:
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    row = await _get_pool().fetchone('SELECT user_id, username, first_name, last_active_ts FROM users WHERE user_id = ?', (user_id,), name="users.get_info")
+
+    if row:
 
-        async with db.execute('SELECT user_id, username, first_name, last_active_ts FROM users WHERE user_id = ?', (user_id,)) as cursor:
+        return {
 
-            row = await cursor.fetchone()
+            "user_id": row[0],
 
-            if row:
+            "username": row[1],
 
-                return {
+            "first_name": row[2],
+
+            "last_active": datetime.fromtimestamp(row[3]).isoformat() if row[3] and row[3] > 0 else 'N/A'
+
+        }
+
+    return None
 
-                    "user_id": row[0],
+async def _load_value_subscribers() -> Set[int]:
 
-                    "username": row[1],
+    global _value_subscribers
 
-                    "first_name": row[2],
+    if _value_subscribers is None:
 
-                    "last_active": datetime.fromtimestamp(row[3]).isoformat() if row[3] and row[3] > 0 else 'N/A'
+        rows = await _get_pool().fetchall('SELECT user_id FROM value_subscriptions', name="value_subscribers.list")
 
-                }
+        _value_subscribers = {row[0] for row in rows}
 
-            return None
+    return _value_subscribers
 
 async def add_value_subscriber(user_id: int):
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _value_subscribers_lock:
 
-        await db.execute('''
+        subscribers = await _load_value_subscribers()
+
+        await _get_pool().write(('''
             INSERT OR IGNORE INTO value_subscriptions (user_id, subscribed_ts) VALUES (?, ?)
-        ''', (user_id, datetime.now().timestamp()))
+        ''', (user_id, datetime.now().timestamp())), name="value_subscribers.add")
+
+        subscribers.add(user_id)
 
-        await db.commit()
+    _publish_invalidation("value_subscribers", user_id)
 
 async def remove_value_subscriber(user_id: int):
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    await remove_value_subscribers([user_id])
+
+async def remove_value_subscribers(user_ids: List[int]):
+
+    if not user_ids: return
+
+    async with _value_subscribers_lock:
+
+        subscribers = await _load_value_subscribers()
+
+        await _get_pool().write_many('DELETE FROM value_subscriptions WHERE user_id = ?', [(user_id,) for user_id in user_ids], name="value_subscribers.remove")
+
+        subscribers.difference_update(user_ids)
 
-        await db.execute('DELETE FROM value_subscriptions WHERE user_id = ?', (user_id,))
+    for user_id in user_ids:
 
-        await db.commit()
+        _publish_invalidation("value_subscribers", user_id)
 
 async def get_value_subscribers() -> List[int]:
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _value_subscribers_lock:
 
-        async with db.execute('SELECT user_id FROM value_subscriptions') as cursor:
+        return sorted(await _load_value_subscribers())
 
-            rows = await cursor.fetchall()
+async def get_value_subscribers_page(after_user_id: int, limit: int) -> List[int]:
 
-            return [row[0] for row in rows]
+    rows = await _get_pool().fetchall('''
+        SELECT user_id FROM value_subscriptions WHERE user_id > ? ORDER BY user_id LIMIT ?
+    ''', (after_user_id, limit), name="value_subscribers.page")
+
+    return [row[0] for row in rows]
 
 async def is_value_subscriber(user_id: int) -> bool:
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    async with _value_subscribers_lock:
+
+        return user_id in await _load_value_subscribers()
+
+async def get_broadcast_job(kind: str) -> Optional[Dict[str, Any]]:
+
+    row = await _get_pool().fetchone('''
+        SELECT payload, cursor_user_id, sent, failed, pruned, status, started_ts FROM broadcast_jobs WHERE kind = ?
+    ''', (kind,), name="broadcast.get")
+
+    if not row: return None
+
+    return {"kind": kind, "payload": row[0], "cursor_user_id": row[1], "sent": row[2], "failed": row[3], "pruned": row[4], "status": row[5], "started_ts": row[6]}
+
+async def start_broadcast_job(kind: str, payload: str):
+
+    current_ts = datetime.now().timestamp()
+
+    await _get_pool().write(('''
+        INSERT OR REPLACE INTO broadcast_jobs (kind, payload, cursor_user_id, sent, failed, pruned, status, started_ts, updated_ts)
+        VALUES (?, ?, 0, 0, 0, 0, 'running', ?, ?)
+    ''', (kind, payload, current_ts, current_ts)), name="broadcast.start")
+
+async def update_broadcast_job(kind: str, cursor_user_id: int, sent: int, failed: int, pruned: int, status: str = "running"):
+
+    await _get_pool().write(('''
+        UPDATE broadcast_jobs SET cursor_user_id = ?, sent = ?, failed = ?, pruned = ?, status = ?, updated_ts = ?
+        WHERE kind = ?
+    ''', (cursor_user_id, sent, failed, pruned, status, datetime.now().timestamp(), kind)), name="broadcast.progress")
+
+async def _load_history_state(user_id: int) -> Dict[str, Any]:
+
+    state = _history_cache.get(user_id)
+
+    if state is not None:
+
+        return state
 
-        async with db.execute('SELECT 1 FROM value_subscriptions WHERE user_id = ?', (user_id,)) as cursor:
+    rows = await _get_pool().fetchall('''
+        SELECT seq, role, content, mode, timestamp FROM dialog_ring
+        WHERE user_id = ? ORDER BY seq
+    ''', (user_id,), name="dialog.load")
 
-            return await cursor.fetchone() is not None
+    summary_row = await _get_pool().fetchone('SELECT summary, covered_seq FROM dialog_summaries WHERE user_id = ?', (user_id,), name="dialog.load_summary")
+
+    state = _history_cache.peek(user_id)
+
+    if state is not None:
+
+        return state
+
+    state = {
+
+        "next_seq": rows[-1][0] + 1 if rows else 0,
+
+        "entries": deque(
+
+            ({"seq": row[0], "role": row[1], "content": row[2], "mode": row[3], "timestamp": row[4]} for row in rows),
+
+            maxlen=DIALOG_HISTORY_SLOTS
+
+        ),
+
+        "summary": summary_row[0] if summary_row else None,
+
+        "summary_seq": summary_row[1] if summary_row else -1
+
+    }
+
+    _history_cache.set(user_id, state)
+
+    return state
 
 async def add_dialog_history(user_id: int, mode: str, user_message_text: str, bot_response_text: str):
 
     current_ts = datetime.now().timestamp()
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    state = await _load_history_state(user_id)
+
+    user_seq = state["next_seq"]
+
+    state["next_seq"] += 2
 
-        await db.execute('''
-            INSERT INTO dialog_history (user_id, timestamp, mode, role, content)
-            VALUES (?, ?, ?, 'user', ?)
-        ''', (user_id, current_ts - 0.001, mode, user_message_text))
+    new_entries = [
 
-        await db.execute('''
-            INSERT INTO dialog_history (user_id, timestamp, mode, role, content)
-            VALUES (?, ?, ?, 'assistant', ?)
-        ''', (user_id, current_ts, mode, bot_response_text))
+        (user_seq, {"seq": user_seq, "role": "user", "content": user_message_text, "mode": mode, "timestamp": current_ts - 0.001}),
 
-        await db.execute('''
-            DELETE FROM dialog_history
-            WHERE history_id NOT IN (
-                SELECT history_id FROM dialog_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT 20
-            ) AND user_id = ?
-        ''', (user_id, user_id))
+        (user_seq + 1, {"seq": user_seq + 1, "role": "assistant", "content": bot_response_text, "mode": mode, "timestamp": current_ts})
 
-        await db.commit()
+    ]
+
+    upsert_sql = '''
+        INSERT INTO dialog_ring (user_id, slot, seq, timestamp, mode, role, content)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, slot) DO UPDATE SET
+            seq = excluded.seq,
+            timestamp = excluded.timestamp,
+            mode = excluded.mode,
+            role = excluded.role,
+            content = excluded.content
+        WHERE excluded.seq > dialog_ring.seq
+    '''
+
+    try:
+
+        await _get_pool().write(*[
+
+            (upsert_sql, (user_id, seq % DIALOG_HISTORY_SLOTS, seq, entry["timestamp"], entry["mode"], entry["role"], entry["content"]))
+
+            for seq, entry in new_entries
+
+        ], name="dialog.append")
+
+    except Exception:
+
+        _history_cache.pop(user_id)
+
+        raise
+
+    if _history_cache.peek(user_id) is state:
+
+        state["entries"].extend(entry for _, entry in new_entries)
+
+async def clear_dialog_history(user_id: int):
+
+    _history_cache.pop(user_id)
+
+    await _get_pool().write(
+        ('DELETE FROM dialog_ring WHERE user_id = ?', (user_id,)),
+        ('DELETE FROM dialog_summaries WHERE user_id = ?', (user_id,)),
+        name="dialog.clear"
+    )
+
+    _history_cache.pop(user_id)
+
+    _publish_invalidation("history", user_id)
 
 async def get_dialog_history(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    state = await _load_history_state(user_id)
+
+    entries = list(state["entries"])
+
+    return [dict(entry) for entry in entries[-limit:]] if limit > 0 else []
+
+def get_history_cache_stats() -> Dict[str, Any]:
+
+    return _history_cache.stats()
+
+async def get_dialog_summary(user_id: int) -> Tuple[Optional[str], int]:
+
+    state = await _load_history_state(user_id)
+
+    return state["summary"], state["summary_seq"]
 
-        async with db.execute('''
-            SELECT role, content, mode, timestamp FROM dialog_history
-            WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?
-        ''', (user_id, limit)) as cursor:
+async def save_dialog_summary(user_id: int, summary: str, covered_seq: int, mode: Optional[str] = None):
 
-            rows = await cursor.fetchall()
+    state = await _load_history_state(user_id)
 
-            history = [{"role": row[0], "content": row[1], "mode": row[2], "timestamp": row[3]} for row in reversed(rows)]
+    await _get_pool().write(('''
+        INSERT INTO dialog_summaries (user_id, summary, covered_seq, mode, updated_ts) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            summary = excluded.summary,
+            covered_seq = excluded.covered_seq,
+            mode = excluded.mode,
+            updated_ts = excluded.updated_ts
+        WHERE excluded.covered_seq > dialog_summaries.covered_seq
+    ''', (user_id, summary, covered_seq, mode, datetime.now().timestamp())), name="dialog.save_summary")
 
-            return history
+    if _history_cache.peek(user_id) is state and covered_seq > state["summary_seq"]:
 
-async def get_dialog_history_for_ollama(user_id: int, limit_turns: int = 5) -> List[Dict[str, str]]:
+        state["summary"], state["summary_seq"] = summary, covered_seq
 
-    raw_history = await get_dialog_history(user_id, limit=limit_turns * 2)
+async def get_dialog_history_for_ollama(user_id: int, limit_turns: int = 5, after_seq: int = -1) -> List[Dict[str, str]]:
+
+    raw_history = [entry for entry in await get_dialog_history(user_id, limit=limit_turns * 2) if entry["seq"] > after_seq]
 
     ollama_history = []
 
@@ -259,132 +1107,145 @@ async def get_dialog_history_for_ollama(user_id: int, limit_turns: int = 5) -> L
 
     return ollama_history
 
+def invalidate_user_mode_cache(user_id: int):
+
+    _mode_cache.pop(user_id)
+
+    _mode_invalidations[user_id] = _mode_invalidations.get(user_id, 0) + 1
+
+def get_mode_cache_stats() -> Dict[str, Any]:
+
+    return _mode_cache.stats()
+
 async def set_user_mode(user_id: int, mode: str):
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    invalidate_user_mode_cache(user_id)
 
-        await db.execute('''
-            INSERT INTO user_modes (user_id, mode) VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET mode = excluded.mode
-        ''', (user_id, mode))
+    await _get_pool().write(('''
+        INSERT INTO user_modes (user_id, mode) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET mode = excluded.mode
+    ''', (user_id, mode)), name="modes.set")
 
-        await db.commit()
+    invalidate_user_mode_cache(user_id)
+
+    _publish_invalidation("mode", user_id)
 
 async def get_user_mode_and_rating_opportunity(user_id: int) -> Dict[str, Any]:
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    cached = _mode_cache.get(user_id)
 
-        await db.execute('''
-            INSERT OR IGNORE INTO user_modes (user_id, mode, rating_opportunities_count)
-            VALUES (?, 'saharoza', 0)
-        ''', (user_id,))
+    if cached is not None:
 
-        async with db.execute('SELECT mode, rating_opportunities_count FROM user_modes WHERE user_id = ?', (user_id,)) as cursor:
+        return dict(cached)
 
-            row = await cursor.fetchone()
+    invalidations_before = _mode_invalidations.get(user_id, 0)
 
-            return {"mode": row[0], "rating_opportunities_count": row[1]}
+    pool = _get_pool()
 
-async def increment_rating_opportunity_count(user_id: int):
+    await pool.write(('''
+        INSERT OR IGNORE INTO user_modes (user_id, mode, rating_opportunities_count)
+        VALUES (?, 'saharoza', 0)
+    ''', (user_id,)), name="modes.ensure")
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    row = await pool.fetchone('SELECT mode, rating_opportunities_count FROM user_modes WHERE user_id = ?', (user_id,), name="modes.get")
 
-        await db.execute('''
-            UPDATE user_modes
-            SET rating_opportunities_count = rating_opportunities_count + 1
-            WHERE user_id = ?
-        ''', (user_id,))
+    mode_data = {"mode": row[0], "rating_opportunities_count": row[1]}
 
-        await db.commit()
+    if _mode_invalidations.get(user_id, 0) == invalidations_before:
 
-async def reset_rating_opportunity_count(user_id: int):
+        _mode_cache.set(user_id, mode_data)
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    return dict(mode_data)
 
-        await db.execute('UPDATE user_modes SET rating_opportunities_count = 0 WHERE user_id = ?', (user_id,))
+async def increment_rating_opportunity_count(user_id: int):
 
-        await db.commit()
+    await _get_pool().write(('''
+        UPDATE user_modes
+        SET rating_opportunities_count = rating_opportunities_count + 1
+        WHERE user_id = ?
+    ''', (user_id,)), name="modes.increment_rating_opportunity")
 
-async def log_interaction_db(user_id: int, mode: str, action_type: str = "message"):
+    cached = _mode_cache.peek(user_id)
 
-    current_ts = datetime.now().timestamp()
+    if cached is not None:
 
-    async with aiosqlite.connect(DB_FILE) as db:
+        cached["rating_opportunities_count"] += 1
 
-        await db.execute('''
-            INSERT INTO analytics_interactions (user_id, timestamp, mode, action_type) VALUES (?, ?, ?, ?)
-        ''', (user_id, current_ts, mode, action_type))
+    _publish_invalidation("mode", user_id)
 
-        await db.execute('UPDATE users SET last_active_ts = ? WHERE user_id = ?', (current_ts, user_id))
+async def reset_rating_opportunity_count(user_id: int):
 
-        await db.commit()
+    invalidate_user_mode_cache(user_id)
 
-async def log_rating_db(user_id: int, rating: int, message_preview: str, rated_msg_id: Optional[int] = None, dialog_hist_id: Optional[int] = None):
+    await _get_pool().write(('UPDATE user_modes SET rating_opportunities_count = 0 WHERE user_id = ?', (user_id,)), name="modes.reset_rating_opportunity")
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    invalidate_user_mode_cache(user_id)
 
-        await db.execute('''
-            INSERT INTO analytics_ratings (user_id, timestamp, rating, message_preview, rated_message_id, dialog_history_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, datetime.now().timestamp(), rating, message_preview[:500], rated_msg_id, dialog_hist_id))
+    _publish_invalidation("mode", user_id)
 
-        await db.commit()
+async def log_interaction_db(user_id: int, mode: str, action_type: str = "message"):
 
-async def get_user_stats_db(user_id: int) -> Dict[str, Any]:
+    _analytics.add_interaction(user_id, datetime.now().timestamp(), mode, action_type)
 
-    stats = {"count": 0, "last_mode": "N/A", "last_active": "N/A"}
+async def log_rating_db(user_id: int, rating: int, message_preview: str, rated_msg_id: Optional[int] = None, dialog_hist_id: Optional[int] = None):
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    _analytics.add_rating(user_id, datetime.now().timestamp(), rating, message_preview[:500], rated_msg_id, dialog_hist_id)
 
-        async with db.execute('SELECT COUNT(*) FROM analytics_interactions WHERE user_id = ?', (user_id,)) as cursor:
+async def get_user_stats_db(user_id: int) -> Dict[str, Any]:
 
-            count_row = await cursor.fetchone()
+    stats = {"count": 0, "last_mode": "N/A", "last_active": "N/A"}
 
-            if count_row: stats["count"] = count_row[0]
+    await _analytics.flush()
 
-        user_info = await get_user_info(user_id)
+    user_info = await get_user_info(user_id)
 
-        if user_info:
+    if user_info:
 
-            stats["last_active"] = user_info["last_active"]
+        stats["last_active"] = user_info["last_active"]
 
-        async with db.execute('SELECT mode FROM analytics_interactions WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1', (user_id,)) as cursor:
+    row = await _get_pool().fetchone('''
+        SELECT t.interactions, COALESCE(t.last_mode, m.mode)
+        FROM (SELECT ? AS user_id) AS q
+        LEFT JOIN analytics_user_totals t ON t.user_id = q.user_id
+        LEFT JOIN user_modes m ON m.user_id = q.user_id
+    ''', (user_id,), name="analytics.user_totals")
 
-            last_interaction_mode = await cursor.fetchone()
+    if row:
 
-            if last_interaction_mode:
+        if row[0] is not None: stats["count"] = row[0]
 
-                stats["last_mode"] = last_interaction_mode[0]
+        if row[1] is not None: stats["last_mode"] = row[1]
 
-            else:
+    return stats
 
-                async with db.execute('SELECT mode FROM user_modes WHERE user_id = ?', (user_id,)) as mode_cursor:
+async def get_user_daily_activity(user_id: int, days: int = 7) -> List[Dict[str, Any]]:
 
-                    current_mode = await mode_cursor.fetchone()
+    first_day = int(datetime.now().timestamp() // 86400) - days + 1
 
-                    if current_mode: stats["last_mode"] = current_mode[0]
+    rows = await _get_pool().fetchall('''
+        SELECT day, mode, interactions FROM analytics_daily_rollup
+        WHERE user_id = ? AND day >= ? ORDER BY day, mode
+    ''', (user_id, first_day), name="analytics.daily_activity")
 
-    return stats
+    return [{"date": datetime.fromtimestamp(row[0] * 86400, tz=timezone.utc).date().isoformat(), "mode": row[1], "count": row[2]} for row in rows]
 
 async def get_rp_stats(user_id: int) -> Dict[str, Any]:
 
-    async with aiosqlite.connect(DB_FILE) as db:
-
-        await db.execute('INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)', (user_id,))
+    pool = _get_pool()
 
-        async with db.execute('SELECT hp, heal_cooldown_ts, recovery_end_ts FROM rp_user_stats WHERE user_id = ?', (user_id,)) as cursor:
+    await pool.write(('INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)', (user_id,)), name="rp_stats.ensure")
 
-            row = await cursor.fetchone()
+    row = await pool.fetchone('SELECT hp, heal_cooldown_ts, recovery_end_ts FROM rp_user_stats WHERE user_id = ?', (user_id,), name="rp_stats.get")
 
-            if row:
+    if row:
 
-                return {"hp": row[0], "heal_cooldown_ts": row[1], "recovery_end_ts": row[2]}
+        return {"hp": row[0], "heal_cooldown_ts": row[1], "recovery_end_ts": row[2]}
 
-            else:
+    else:
 
-                logger.error(f"CRITICAL: RP stats row not found for user_id {user_id} after INSERT OR IGNORE. Schema defaults might be missing or DB error.")
+        logger.error(f"CRITICAL: RP stats row not found for user_id {user_id} after INSERT OR IGNORE. Schema defaults might be missing or DB error.")
 
-                return {"hp": 100, "heal_cooldown_ts": 0, "recovery_end_ts": 0}
+        return {"hp": 100, "heal_cooldown_ts": 0, "recovery_end_ts": 0}
 
 async def update_rp_stats(user_id: int, hp: Optional[int] = None, heal_cooldown_ts: Optional[float] = None, recovery_end_ts: Optional[float] = None):
 
@@ -416,13 +1277,11 @@ async def update_rp_stats(user_id: int, hp: Optional[int] = None, heal_cooldown_
 
     params.append(user_id)
 
-    async with aiosqlite.connect(DB_FILE) as db:
-
-        await db.execute('INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)', (user_id,))
-
-        await db.execute(query, tuple(params))
-
-        await db.commit()
+    await _get_pool().write(
+        ('INSERT OR IGNORE INTO rp_user_stats (user_id) VALUES (?)', (user_id,)),
+        (query, tuple(params)),
+        name="rp_stats.update"
+    )
 
 def read_value_from_file(file_path: Path) -> Optional[str]:
 
@@ -458,10 +1317,121 @@ async def get_users_for_hp_recovery(current_timestamp: float, min_hp_level_inclu
         WHERE hp <= ? AND recovery_end_ts > 0 AND recovery_end_ts <= ?
     """
 
-    async with aiosqlite.connect(DB_FILE) as db:
+    rows = await _get_pool().fetchall(query, (min_hp_level_inclusive, current_timestamp), name="rp_stats.hp_recovery_due")
+
+    return [(row[0], row[1]) for row in rows]
+
+async def get_profile(user_id: int) -> Optional[Dict[str, Any]]:
+
+    row = await _get_pool().fetchone('''
+        SELECT p.user_id, p.level, p.exp, p.lumcoins, p.daily_messages, p.total_messages, p.flames,
+               p.background_url, p.last_work_time, u.username, u.first_name, COALESCE(r.hp, 100)
+        FROM user_profiles p
+        JOIN users u ON u.user_id = p.user_id
+        LEFT JOIN rp_user_stats r ON r.user_id = p.user_id
+        WHERE p.user_id = ?
+    ''', (user_id,), name="profiles.get")
+
+    if not row:
+
+        return None
+
+    return {
+
+        "user_id": row[0],
+
+        "level": row[1],
+
+        "exp": row[2],
+
+        "lumcoins": row[3],
+
+        "daily_messages": row[4],
+
+        "total_messages": row[5],
+
+        "flames": row[6],
+
+        "background_url": row[7],
+
+        "last_work_time": row[8],
+
+        "username": f"@{row[9]}" if row[9] else row[10],
+
+        "hp": row[11]
+
+    }
+
+async def update_profile_progress(user_id: int, exp_added: int, level: int, levels_gained: int = 0, exp_spent: int = 0, lumcoins_added: int = 0, daily_messages_increment: int = 1):
+
+    statements = [('''
+        UPDATE user_profiles
+        SET daily_messages = daily_messages + ?,
+            total_messages = total_messages + 1,
+            exp = exp + ?
+        WHERE user_id = ?
+    ''', (daily_messages_increment, exp_added, user_id))]
+
+    if levels_gained:
+
+        statements.append(('''
+            UPDATE user_profiles
+            SET exp = exp - ?,
+                level = level + ?,
+                lumcoins = lumcoins + ?
+            WHERE user_id = ? AND level = ? AND exp >= ?
+        ''', (exp_spent, levels_gained, lumcoins_added, user_id, level, exp_spent)))
+
+    await _get_pool().write(*statements, name="profiles.update_progress")
+
+async def add_lumcoins(user_id: int, amount: int):
+
+    await _get_pool().write(('UPDATE user_profiles SET lumcoins = lumcoins + ? WHERE user_id = ?', (amount, user_id)), name="profiles.add_lumcoins")
+
+async def get_lumcoins(user_id: int) -> int:
+
+    row = await _get_pool().fetchone('SELECT lumcoins FROM user_profiles WHERE user_id = ?', (user_id,), name="profiles.get_lumcoins")
+
+    return row[0] if row else 0
+
+async def buy_profile_background(user_id: int, cost: int, background_url: str):
+
+    await _get_pool().write(
+        ('UPDATE user_profiles SET lumcoins = lumcoins - ? WHERE user_id = ?', (cost, user_id)),
+        ('UPDATE user_profiles SET background_url = ? WHERE user_id = ?', (background_url, user_id)),
+        name="profiles.buy_background"
+    )
+
+async def set_profile_background(user_id: int, background_url: Optional[str]):
+
+    await _get_pool().write(('UPDATE user_profiles SET background_url = ? WHERE user_id = ?', (background_url, user_id)), name="profiles.set_background")
+
+async def get_last_work_time(user_id: int) -> float:
+
+    row = await _get_pool().fetchone('SELECT last_work_time FROM user_profiles WHERE user_id = ?', (user_id,), name="profiles.get_last_work_time")
+
+    return row[0] if row else 0.0
+
+async def reward_work(user_id: int, reward: int, timestamp: float):
+
+    await _get_pool().write(('''
+        UPDATE user_profiles SET lumcoins = lumcoins + ?, last_work_time = ? WHERE user_id = ?
+    ''', (reward, timestamp, user_id)), name="profiles.reward_work")
+
+def get_query_stats(limit: Optional[int] = None, sort_by: str = "total_ms") -> Dict[str, Any]:
+
+    return {
+
+        "since": _query_stats.started_at,
+
+        "slow_query_ms": _query_stats.slow_query_ms,
+
+        "slow_queries": _query_stats.slow_queries,
+
+        "statements": _query_stats.summary(sort_by=sort_by, limit=limit)
 
-        async with db.execute(query, (min_hp_level_inclusive, current_timestamp)) as cursor:
+    }
 
-            rows = await cursor.fetchall()
+def reset_query_stats():
 
-            return [(row[0], row[1]) for row in rows]
\ No newline at end of file
+    _query_stats.reset()
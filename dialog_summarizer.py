@@ -0,0 +1,105 @@
+import asyncio
+
+import os
+
+import logging
+
+from contextlib import suppress
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_KEEP_TURNS = max(1, int(os.getenv("SUMMARY_KEEP_TURNS", "3")))
+
+SUMMARY_MIN_NEW_TURNS = max(1, int(os.getenv("SUMMARY_MIN_NEW_TURNS", "3")))
+
+SUMMARY_MAX_CHARS = max(100, int(os.getenv("SUMMARY_MAX_CHARS", "1200")))
+
+SUMMARY_MAX_PENDING = max(1, int(os.getenv("SUMMARY_MAX_PENDING", "100")))
+
+SummarizeFn = Callable[[str, Optional[str], List[Dict[str, Any]]], Awaitable[Optional[str]]]
+
+class DialogSummarizer:
+
+    def __init__(self, summarize: SummarizeFn, keep_turns: int = SUMMARY_KEEP_TURNS, min_new_turns: int = SUMMARY_MIN_NEW_TURNS):
+
+        self.summarize = summarize
+
+        self.keep_turns = keep_turns
+
+        self.min_new_turns = min_new_turns
+
+        self.updated = 0
+
+        self.skipped = 0
+
+        self._pending: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, user_id: int, mode: str):
+
+        if user_id in self._pending or len(self._pending) >= SUMMARY_MAX_PENDING:
+
+            return
+
+        task = asyncio.create_task(self._run(user_id, mode), name=f"summarize_{user_id}")
+
+        self._pending[user_id] = task
+
+        task.add_done_callback(lambda _: self._pending.pop(user_id, None))
+
+    async def _run(self, user_id: int, mode: str):
+
+        try:
+
+            summary, covered_seq = await db.get_dialog_summary(user_id)
+
+            entries = [entry for entry in await db.get_dialog_history(user_id, limit=db.DIALOG_HISTORY_SLOTS) if entry["seq"] > covered_seq]
+
+            candidates = entries[:-self.keep_turns * 2]
+
+            while candidates and candidates[-1]["role"] != "assistant":
+
+                candidates.pop()
+
+            if len(candidates) < self.min_new_turns * 2:
+
+                return
+
+            new_summary = await self.summarize(mode, summary, candidates)
+
+            if not new_summary:
+
+                self.skipped += 1
+
+                return
+
+            await db.save_dialog_summary(user_id, new_summary[:SUMMARY_MAX_CHARS], candidates[-1]["seq"], mode)
+
+            self.updated += 1
+
+            logger.debug(f"Dialog summary for user {user_id} now covers seq <= {candidates[-1]['seq']}.")
+
+        except Exception as e:
+
+            logger.error(f"Dialog summarisation failed for user {user_id}: {e}", exc_info=True)
+
+    async def close(self):
+
+        tasks = list(self._pending.values())
+
+        for task in tasks:
+
+            task.cancel()
+
+        for task in tasks:
+
+            with suppress(asyncio.CancelledError):
+
+                await task
+
+    def stats(self) -> Dict[str, int]:
+
+        return {"pending": len(self._pending), "updated": self.updated, "skipped": self.skipped}
@@ -0,0 +1,214 @@
+import argparse
+
+import asyncio
+
+import json
+
+import time
+
+from typing import Any, Dict, Iterable, Optional
+
+from aiohttp import web
+
+from ollama_pool import normalize_model
+
+class FakeOllamaServer:
+
+    def __init__(self, models: Iterable[str], reply: str = "ok", delay: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+
+        self.models = {normalize_model(model) for model in models}
+
+        self.reply = reply
+
+        self.delay = delay
+
+        self.host = host
+
+        self.port = port
+
+        self.fail_status: Optional[int] = None
+
+        self.gate: Optional[asyncio.Event] = None
+
+        self.requests: Dict[str, int] = {"tags": 0, "chat": 0, "generate": 0}
+
+        self.served: Dict[str, int] = {"chat": 0, "generate": 0}
+
+        self.in_flight = 0
+
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+
+        return f"http://{self.host}:{self.port}"
+
+    def build_app(self) -> web.Application:
+
+        app = web.Application()
+
+        app.router.add_get("/api/tags", self.tags)
+
+        app.router.add_post("/api/chat", self.chat)
+
+        app.router.add_post("/api/generate", self.generate)
+
+        return app
+
+    async def start(self) -> str:
+
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+
+        await self._runner.setup()
+
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        self.port = self._runner.addresses[0][1]
+
+        return self.url
+
+    async def close(self):
+
+        if self._runner is not None:
+
+            await self._runner.cleanup()
+
+            self._runner = None
+
+    async def tags(self, request: web.Request) -> web.Response:
+
+        self.requests["tags"] += 1
+
+        if self.fail_status is not None:
+
+            return web.json_response({"error": "unavailable"}, status=self.fail_status)
+
+        return web.json_response({"models": [{"name": model, "model": model, "size": 0, "digest": "", "details": {}} for model in sorted(self.models)]})
+
+    async def _admit(self, kind: str, body: Dict[str, Any]) -> Optional[web.Response]:
+
+        self.requests[kind] += 1
+
+        if self.fail_status is not None:
+
+            return web.json_response({"error": "unavailable"}, status=self.fail_status)
+
+        if normalize_model(body.get("model", "")) not in self.models:
+
+            return web.json_response({"error": f"model '{body.get('model')}' not found"}, status=404)
+
+        return None
+
+    async def _work(self):
+
+        self.in_flight += 1
+
+        try:
+
+            if self.gate is not None:
+
+                await self.gate.wait()
+
+            if self.delay:
+
+                await asyncio.sleep(self.delay)
+
+        finally:
+
+            self.in_flight -= 1
+
+    def _created_at(self) -> str:
+
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+
+        body = await request.json()
+
+        rejected = await self._admit("chat", body)
+
+        if rejected is not None:
+
+            return rejected
+
+        await self._work()
+
+        self.served["chat"] += 1
+
+        if not body.get("stream", True):
+
+            return web.json_response({"model": body["model"], "created_at": self._created_at(), "message": {"role": "assistant", "content": self.reply}, "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+
+        await response.prepare(request)
+
+        for word in self.reply.split(" "):
+
+            chunk = {"model": body["model"], "created_at": self._created_at(), "message": {"role": "assistant", "content": word + " "}, "done": False}
+
+            await response.write((json.dumps(chunk) + "\n").encode())
+
+        await response.write((json.dumps({"model": body["model"], "created_at": self._created_at(), "message": {"role": "assistant", "content": ""}, "done": True}) + "\n").encode())
+
+        await response.write_eof()
+
+        return response
+
+    async def generate(self, request: web.Request) -> web.Response:
+
+        body = await request.json()
+
+        rejected = await self._admit("generate", body)
+
+        if rejected is not None:
+
+            return rejected
+
+        await self._work()
+
+        self.served["generate"] += 1
+
+        return web.json_response({"model": body["model"], "created_at": self._created_at(), "response": self.reply, "done": True})
+
+async def serve(args: argparse.Namespace):
+
+    server = FakeOllamaServer(args.models, reply=args.reply, delay=args.delay, host=args.host, port=args.port)
+
+    print(f"Fake Ollama listening on {await server.start()} with models {sorted(server.models)}.")
+
+    try:
+
+        await asyncio.Event().wait()
+
+    finally:
+
+        await server.close()
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Minimal Ollama stand-in (/api/tags, /api/chat, /api/generate) for local tests.")
+
+    parser.add_argument("models", nargs="+")
+
+    parser.add_argument("--host", default="127.0.0.1")
+
+    parser.add_argument("--port", type=int, default=11435)
+
+    parser.add_argument("--reply", default="Привет! Это тестовый ответ.")
+
+    parser.add_argument("--delay", type=float, default=0.0)
+
+    args = parser.parse_args()
+
+    try:
+
+        asyncio.run(serve(args))
+
+    except KeyboardInterrupt:
+
+        pass
+
+if __name__ == '__main__':
+
+    main()
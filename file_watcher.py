@@ -0,0 +1,222 @@
+import asyncio
+
+import ctypes
+
+import ctypes.util
+
+import os
+
+import struct
+
+import logging
+
+from pathlib import Path
+
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FILE_WATCH_POLL_SECONDS = max(0.1, float(os.getenv("FILE_WATCH_POLL_SECONDS", "1")))
+
+FILE_WATCH_SAFETY_SECONDS = max(1.0, float(os.getenv("FILE_WATCH_SAFETY_SECONDS", "60")))
+
+FILE_WATCH_INOTIFY = os.getenv("FILE_WATCH_INOTIFY", "1") != "0"
+
+IN_CLOSE_WRITE = 0x00000008
+
+IN_MOVED_FROM = 0x00000040
+
+IN_MOVED_TO = 0x00000080
+
+IN_DELETE = 0x00000200
+
+IN_Q_OVERFLOW = 0x00004000
+
+IN_IGNORED = 0x00008000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+FileSignature = Optional[Tuple[int, int, int]]
+
+def _load_libc() -> Optional[ctypes.CDLL]:
+
+    try:
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+
+        libc.inotify_init1.restype = ctypes.c_int
+
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        libc.inotify_add_watch.restype = ctypes.c_int
+
+        return libc
+
+    except (OSError, AttributeError):
+
+        return None
+
+class FileWatcher:
+
+    def __init__(self, path: Path, poll_interval: float = FILE_WATCH_POLL_SECONDS, safety_interval: float = FILE_WATCH_SAFETY_SECONDS, use_inotify: bool = FILE_WATCH_INOTIFY):
+
+        self.path = Path(path)
+
+        self.poll_interval = poll_interval
+
+        self.safety_interval = safety_interval
+
+        self.use_inotify = use_inotify
+
+        self.events = 0
+
+        self.changes = 0
+
+        self._fd: Optional[int] = None
+
+        self._changed = asyncio.Event()
+
+        self._signature: FileSignature = None
+
+    @property
+    def mode(self) -> str:
+
+        return "inotify" if self._fd is not None else "stat"
+
+    def start(self):
+
+        self._signature = self._stat()
+
+        if self.use_inotify and self._fd is None:
+
+            self._fd = self._open_inotify()
+
+        logger.info(f"Watching {self.path} via {self.mode}.")
+
+    def _open_inotify(self) -> Optional[int]:
+
+        libc = _load_libc()
+
+        if libc is None:
+
+            logger.info("inotify is not available, falling back to stat polling.")
+
+            return None
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if fd < 0:
+
+            logger.warning(f"inotify_init1 failed ({os.strerror(ctypes.get_errno())}), falling back to stat polling.")
+
+            return None
+
+        if libc.inotify_add_watch(fd, os.fsencode(self.path.parent), WATCH_MASK) < 0:
+
+            logger.warning(f"Cannot watch {self.path.parent} ({os.strerror(ctypes.get_errno())}), falling back to stat polling.")
+
+            os.close(fd)
+
+            return None
+
+        asyncio.get_running_loop().add_reader(fd, self._on_readable)
+
+        return fd
+
+    def _on_readable(self):
+
+        name = os.fsencode(self.path.name)
+
+        while self._fd is not None:
+
+            try:
+
+                buffer = os.read(self._fd, 64 * 1024)
+
+            except BlockingIOError:
+
+                return
+
+            offset = 0
+
+            while offset + EVENT_HEADER.size <= len(buffer):
+
+                _, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+
+                event_name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_IGNORED:
+
+                    logger.warning(f"inotify watch on {self.path.parent} was removed, falling back to stat polling.")
+
+                    self._close_inotify()
+
+                    self._changed.set()
+
+                    return
+
+                if mask & IN_Q_OVERFLOW or event_name == name:
+
+                    self.events += 1
+
+                    self._changed.set()
+
+    def _stat(self) -> FileSignature:
+
+        try:
+
+            stat = os.stat(self.path)
+
+        except OSError:
+
+            return None
+
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    async def wait_for_change(self):
+
+        while True:
+
+            timeout = self.safety_interval if self._fd is not None else self.poll_interval
+
+            try:
+
+                await asyncio.wait_for(self._changed.wait(), timeout)
+
+            except asyncio.TimeoutError:
+
+                pass
+
+            self._changed.clear()
+
+            signature = self._stat()
+
+            if signature != self._signature:
+
+                self._signature = signature
+
+                self.changes += 1
+
+                return
+
+    def _close_inotify(self):
+
+        if self._fd is None:
+
+            return
+
+        fd, self._fd = self._fd, None
+
+        asyncio.get_running_loop().remove_reader(fd)
+
+        os.close(fd)
+
+    def close(self):
+
+        self._close_inotify()
@@ -1,11 +1,7 @@
 import os
 
-import aiosqlite
-
 import string
 
-import sqlite3
-
 import time
 
 from datetime import datetime, date, timedelta
@@ -36,6 +32,8 @@ import random
 
 import aiohttp
 
+import database as db
+
 formatter = string.Formatter()
 
 stat_router = Router(name="stat_router")
@@ -148,302 +146,83 @@ class ProfileConfig:
 
     FONT_SIZE_SMALL = 16
 
-def init_db():
-
-    if not os.path.exists('profiles.db'):
-
-        conn = sqlite3.connect('profiles.db')
-
-        cursor = conn.cursor()
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            profile_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            hp INTEGER DEFAULT 100 CHECK(hp >= 0 AND hp <= 150),
-            level INTEGER DEFAULT 1 CHECK(level >= 1 AND level <= 169),
-            exp INTEGER DEFAULT 0,
-            lumcoins INTEGER DEFAULT 0,
-            daily_messages INTEGER DEFAULT 0,
-            total_messages INTEGER DEFAULT 0,
-            flames INTEGER DEFAULT 0,
-            background_url TEXT,
-            last_work_time REAL DEFAULT 0, -- Добавляем поле для кулдауна работы
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS backgrounds (
-            user_id INTEGER PRIMARY KEY,
-            background_url TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_profiles_user_id ON user_profiles(user_id)')
-
-        conn.commit()
-
-        conn.close()
-
-        logger.info("Database initialized (sync).")
-
-    else:
-
-        logger.info("Database already exists (sync check).")
-
-init_db()
-
 class ProfileManager:
 
     def __init__(self):
 
-        self._conn = None
-
         self.font_cache = {}
 
         logger.info("ProfileManager instance created.")
 
     async def connect(self):
 
-        if self._conn is not None:
-
-            logger.warning("Database connection already exists.")
-
-            return
-
-        logger.info("Connecting to database...")
-
-        try:
-
-            self._conn = await aiosqlite.connect('profiles.db')
-
-            logger.info("Database connected asynchronously.")
-
-            await self._init_db_async()
-
-            logger.info("Database schema checked/initialized asynchronously.")
-
-        except Exception as e:
-
-            logger.exception("Failed to connect to database or initialize schema:")
-
-            raise
+        logger.info(f"ProfileManager uses the shared bot database ({db.DB_FILE}).")
 
     async def close(self):
 
-        if self._conn is not None:
-
-            logger.info("Closing database connection...")
-
-            try:
-
-                await self._conn.close()
-
-                self._conn = None
-
-                logger.info("Database connection closed.")
-
-            except Exception as e:
-
-                logger.exception("Error closing database connection:")
-
-    async def _init_db_async(self):
-
-        if self._conn is None:
-
-             logger.error("Cannot perform async DB init: connection is None.")
-
-             return
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        await cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_profiles (
-            profile_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE,
-            hp INTEGER DEFAULT 100 CHECK(hp >= 0 AND hp <= 150),
-            level INTEGER DEFAULT 1 CHECK(level >= 1 AND level <= 169),
-            exp INTEGER DEFAULT 0,
-            lumcoins INTEGER DEFAULT 0,
-            daily_messages INTEGER DEFAULT 0,
-            total_messages INTEGER DEFAULT 0,
-            flames INTEGER DEFAULT 0,
-            background_url TEXT,
-            last_work_time REAL DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-
-        await cursor.execute('''
-        CREATE TABLE IF NOT EXISTS backgrounds (
-            user_id INTEGER PRIMARY KEY,
-            background_url TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-        ''')
-
-        await cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_profiles_user_id ON user_profiles(user_id)')
-
-        await self._conn.commit()
-
-    async def _get_or_create_user(self, user: types.User) -> int:
-
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-        INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-        VALUES (?, ?, ?, ?)
-        ''', (user.id, user.username, user.first_name, user.last_name))
-
-        await self._conn.commit()
-
-        return user.id
-
-    async def _get_or_create_profile(self, user_id: int) -> Dict[str, Any]:
-
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-        INSERT OR IGNORE INTO user_profiles (user_id, background_url)
-        VALUES (?, ?)
-        ''', (user_id, ProfileConfig.DEFAULT_BG_URL))
-
-        await self._conn.commit()
+        pass
 
-        await cursor.execute('''
-        SELECT * FROM user_profiles WHERE user_id = ?
-        ''', (user_id,))
+    async def ensure_user(self, user: types.User) -> None:
 
-        profile = await cursor.fetchone()
-
-        if not profile:
-
-            return None
-
-        columns = [column[0] for column in cursor.description]
-
-        return dict(zip(columns, profile))
+        await db.ensure_user(user.id, user.username, user.first_name, user.last_name)
 
     async def get_user_profile(self, user: types.User) -> Optional[Dict[str, Any]]:
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-            INSERT INTO users (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-                username = excluded.username,
-                first_name = excluded.first_name,
-                last_name = excluded.last_name
-        ''', (user.id, user.username, user.first_name, user.last_name))
-
-        await self._conn.commit()
-
         user_id = user.id
 
-        await cursor.execute('''
-        INSERT OR IGNORE INTO user_profiles (user_id, background_url)
-        VALUES (?, ?)
-        ''', (user_id, ProfileConfig.DEFAULT_BG_URL))
+        profile_data = await db.get_profile(user_id)
 
-        await self._conn.commit()
+        if not profile_data:
 
-        await cursor.execute('''
-        SELECT * FROM user_profiles WHERE user_id = ?
-        ''', (user_id,))
+            await self.ensure_user(user)
 
-        profile = await cursor.fetchone()
+            profile_data = await db.get_profile(user_id)
 
-        if not profile:
+        if not profile_data:
 
             logger.error(f"Profile not found for user_id {user_id} after creation attempt.")
 
             return None
 
-        columns = [column[0] for column in cursor.description]
-
-        profile_data = dict(zip(columns, profile))
-
-        await cursor.execute('SELECT username, first_name FROM users WHERE user_id = ?', (user_id,))
-
-        user_data = await cursor.fetchone()
-
-        if user_data:
-
-             profile_data['username'] = f"@{user_data[0]}" if user_data[0] else user_data[1]
+        if not profile_data.get('username'):
 
-        else:
-
-             profile_data['username'] = user.first_name
-
-        await cursor.execute('SELECT background_url FROM backgrounds WHERE user_id = ?', (user_id,))
-
-        custom_bg = await cursor.fetchone()
+            profile_data['username'] = user.first_name
 
-        if custom_bg:
+        if not profile_data.get('background_url'):
 
-            profile_data['background_url'] = custom_bg[0]
+            profile_data['background_url'] = ProfileConfig.DEFAULT_BG_URL
 
-        else:
+        return profile_data
 
-            pass
+    async def get_rp_stats(self, user_id: int) -> Dict[str, Any]:
 
-        return profile_data
+        return await db.get_rp_stats(user_id)
 
-    async def record_message(self, user: types.User) -> None:
+    async def update_rp_stats_field(self, user_id: int, **kwargs: Any) -> None:
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
+        await db.update_rp_stats(user_id, **kwargs)
 
-        cursor = await self._conn.cursor()
+    async def record_message(self, user: types.User) -> Optional[Dict[str, Any]]:
 
         user_id = user.id
 
-        await cursor.execute('''
-        SELECT total_messages, level, exp, lumcoins
-        FROM user_profiles WHERE user_id = ?
-        ''', (user_id,))
-
-        profile_data = await cursor.fetchone()
+        profile_data = await self.get_user_profile(user)
 
         if not profile_data:
 
              logger.error(f"Profile not found for user_id: {user_id} in record_message. Skipping message count.")
 
-             return
+             return None
 
-        total_messages, level, exp, lumcoins = profile_data
+        total_messages = profile_data['total_messages']
 
-        total_messages += 1
+        level = profile_data['level']
+
+        exp = profile_data['exp']
 
-        daily_messages_increment = 1
+        lumcoins = profile_data['lumcoins']
+
+        total_messages += 1
 
         exp_added = 0
 
@@ -469,17 +248,27 @@ class ProfileManager:
 
              new_lumcoins += coins_this_level
 
-        await cursor.execute('''
-        UPDATE user_profiles
-        SET daily_messages = daily_messages + ?,
-            total_messages = ?,
-            exp = ?,
-            level = ?,
-            lumcoins = ?
-        WHERE user_id = ?
-        ''', (daily_messages_increment, total_messages, new_exp, new_level, new_lumcoins, user_id))
+        await db.update_profile_progress(user_id, exp_added, level, new_level - level, exp + exp_added - new_exp, new_lumcoins - lumcoins)
+
+        profile_data.update({
+
+            'total_messages': total_messages,
+
+            'daily_messages': profile_data['daily_messages'] + 1,
+
+            'exp': new_exp,
 
-        await self._conn.commit()
+            'level': new_level,
+
+            'lumcoins': new_lumcoins,
+
+            'previous_level': level,
+
+            'previous_lumcoins': lumcoins
+
+        })
+
+        return profile_data
 
     def _get_exp_for_level(self, level: int) -> int:
 
@@ -777,44 +566,19 @@ class ProfileManager:
 
     async def update_lumcoins(self, user_id: int, amount: int):
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-        UPDATE user_profiles
-        SET lumcoins = lumcoins + ?
-        WHERE user_id = ?
-        ''', (amount, user_id))
-
-        await self._conn.commit()
+        await db.add_lumcoins(user_id, amount)
 
     async def get_lumcoins(self, user_id: int) -> int:
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-        SELECT lumcoins FROM user_profiles WHERE user_id = ?
-        ''', (user_id,))
-
-        result = await cursor.fetchone()
-
-        return result[0] if result else 0
+        return await db.get_lumcoins(user_id)
 
     async def set_background(self, user_id: int, background_url: str):
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
+        await db.set_profile_background(user_id, background_url)
 
-        await cursor.execute('''
-        INSERT OR REPLACE INTO backgrounds (user_id, background_url)
-        VALUES (?, ?)
-        ''', (user_id, background_url))
+    async def buy_background(self, user_id: int, cost: int, background_url: str):
 
-        await self._conn.commit()
+        await db.buy_profile_background(user_id, cost, background_url)
 
     def get_available_backgrounds(self) -> Dict[str, Dict[str, Any]]:
 
@@ -822,31 +586,15 @@ class ProfileManager:
 
     async def get_last_work_time(self, user_id: int) -> float:
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
-
-        cursor = await self._conn.cursor()
-
-        await cursor.execute('''
-        SELECT last_work_time FROM user_profiles WHERE user_id = ?
-        ''', (user_id,))
-
-        result = await cursor.fetchone()
-
-        return result[0] if result else 0.0
+        return await db.get_last_work_time(user_id)
 
     async def update_last_work_time(self, user_id: int, timestamp: float):
 
-        if self._conn is None: raise RuntimeError("Database connection is not established.")
+        await db.reward_work(user_id, 0, timestamp)
 
-        cursor = await self._conn.cursor()
+    async def reward_work(self, user_id: int, reward: int, timestamp: float):
 
-        await cursor.execute('''
-        UPDATE user_profiles
-        SET last_work_time = ?
-        WHERE user_id = ?
-        ''', (timestamp, user_id))
-
-        await self._conn.commit()
+        await db.reward_work(user_id, reward, timestamp)
 
 @stat_router.message(F.text.lower().startswith(("профиль", "/профиль")))
 
@@ -900,9 +648,7 @@ async def do_work(message: types.Message, profile_manager: ProfileManager):
 
         task = random.choice(ProfileConfig.WORK_TASKS)
 
-        await profile_manager.update_lumcoins(user_id, reward)
-
-        await profile_manager.update_last_work_time(user_id, current_time)
+        await profile_manager.reward_work(user_id, reward, current_time)
 
         await message.reply(f"{message.from_user.first_name} {task} и заработал(а) {reward} LUMcoins!")
 
@@ -940,9 +686,7 @@ async def buy_background(message: types.Message, profile_manager: ProfileManager
 
         if user_coins >= item['cost']:
 
-            await profile_manager.update_lumcoins(user_id, -item['cost'])
-
-            await profile_manager.set_background(user_id, item['url'])
+            await profile_manager.buy_background(user_id, item['cost'], item['url'])
 
             await message.reply(f"✅ Вы успешно приобрели фон '{item['name']}' за {item['cost']} LUMcoins!")
 
@@ -960,28 +704,18 @@ async def track_message_activity(message: types.Message, profile_manager: Profil
 
     user_id = message.from_user.id
 
-    old_profile = await profile_manager.get_user_profile(message.from_user)
-
-    if not old_profile:
-
-         logger.error(f"Failed to get old profile for user_id {user_id} in track_message_activity.")
-
-         return
-
-    old_level = old_profile.get('level', 1)
-
-    old_lumcoins = old_profile.get('lumcoins', 0)
-
-    await profile_manager.record_message(message.from_user)
-
-    new_profile = await profile_manager.get_user_profile(message.from_user)
+    new_profile = await profile_manager.record_message(message.from_user)
 
     if not new_profile:
 
-        logger.error(f"Failed to get new profile for user_id {user_id} after record_message.")
+        logger.error(f"Failed to record message for user_id {user_id} in track_message_activity.")
 
         return
 
+    old_level = new_profile.get('previous_level', 1)
+
+    old_lumcoins = new_profile.get('previous_lumcoins', 0)
+
     new_level = new_profile.get('level', 1)
 
     new_lumcoins = new_profile.get('lumcoins', 0)
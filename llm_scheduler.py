@@ -0,0 +1,477 @@
+import asyncio
+
+import multiprocessing
+
+import os
+
+import time
+
+import logging
+
+from collections import deque
+
+from contextlib import asynccontextmanager
+
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+LLM_DEFAULT_CONCURRENCY = max(1, int(os.getenv("LLM_DEFAULT_CONCURRENCY", "1")))
+
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")
+
+LLM_MAX_QUEUE_DEPTH = max(0, int(os.getenv("LLM_MAX_QUEUE_DEPTH", "20")))
+
+LLM_SHARED_POLL_SECONDS = max(0.01, float(os.getenv("LLM_SHARED_POLL_SECONDS", "0.05")))
+
+class QueueFullError(RuntimeError):
+
+    def __init__(self, model: str, depth: int):
+
+        super().__init__(f"LLM queue for model '{model}' is full ({depth} waiting).")
+
+        self.model = model
+
+        self.depth = depth
+
+def parse_model_concurrency(spec: str) -> Dict[str, int]:
+
+    limits: Dict[str, int] = {}
+
+    for item in spec.split(","):
+
+        model, sep, value = item.strip().rpartition("=")
+
+        if not sep or not model:
+
+            continue
+
+        try:
+
+            limits[model.strip()] = max(1, int(value))
+
+        except ValueError:
+
+            logger.warning(f"Ignoring invalid LLM_MODEL_CONCURRENCY entry '{item}'.")
+
+    return limits
+
+class SharedSlots:
+
+    def __init__(self, workers: int, models: Iterable[str]):
+
+        context = multiprocessing.get_context("spawn")
+
+        self.workers = workers
+
+        self.models = {model: column for column, model in enumerate(sorted(set(models)))}
+
+        self.index = 0
+
+        self._lock = context.Lock()
+
+        self._active = context.RawArray("i", workers * len(self.models))
+
+        self._waiting = context.RawArray("i", workers * len(self.models))
+
+    def _cells(self, column: int) -> range:
+
+        return range(column, self.workers * len(self.models), len(self.models))
+
+    def try_acquire(self, model: str, limit: int) -> bool:
+
+        column = self.models.get(model)
+
+        if column is None:
+
+            return True
+
+        with self._lock:
+
+            if sum(self._active[cell] for cell in self._cells(column)) >= limit:
+
+                return False
+
+            self._active[self.index * len(self.models) + column] += 1
+
+            return True
+
+    def release(self, model: str):
+
+        column = self.models.get(model)
+
+        if column is None:
+
+            return
+
+        with self._lock:
+
+            cell = self.index * len(self.models) + column
+
+            self._active[cell] = max(0, self._active[cell] - 1)
+
+    def set_waiting(self, model: str, count: int):
+
+        column = self.models.get(model)
+
+        if column is not None:
+
+            self._waiting[self.index * len(self.models) + column] = count
+
+    def others_waiting(self, model: str) -> int:
+
+        column = self.models.get(model)
+
+        if column is None:
+
+            return 0
+
+        own = self.index * len(self.models) + column
+
+        return sum(self._waiting[cell] for cell in self._cells(column) if cell != own)
+
+    def active(self, model: str) -> Optional[int]:
+
+        column = self.models.get(model)
+
+        if column is None:
+
+            return None
+
+        return sum(self._active[cell] for cell in self._cells(column))
+
+    def reset_worker(self, index: int):
+
+        with self._lock:
+
+            for column in range(len(self.models)):
+
+                self._active[index * len(self.models) + column] = 0
+
+                self._waiting[index * len(self.models) + column] = 0
+
+class _Waiter:
+
+    __slots__ = ("future", "on_position")
+
+    def __init__(self, future: asyncio.Future, on_position: Optional[Callable[[int], None]]):
+
+        self.future = future
+
+        self.on_position = on_position
+
+class _ModelQueue:
+
+    def __init__(self, model: str, concurrency: int):
+
+        self.model = model
+
+        self.per_replica = concurrency
+
+        self.replicas = 1
+
+        self.concurrency = concurrency
+
+        self.active = 0
+
+        self.waiters: Deque[_Waiter] = deque()
+
+        self.background: Set[asyncio.Task] = set()
+
+        self.completed = 0
+
+        self.shed = 0
+
+        self.preempted = 0
+
+        self.yielded_at = 0.0
+
+class LLMScheduler:
+
+    def __init__(self, default_concurrency: int = LLM_DEFAULT_CONCURRENCY, max_queue_depth: int = LLM_MAX_QUEUE_DEPTH, model_concurrency: Optional[Dict[str, int]] = None):
+
+        self.default_concurrency = default_concurrency
+
+        self.max_queue_depth = max_queue_depth
+
+        self.model_concurrency = model_concurrency if model_concurrency is not None else parse_model_concurrency(LLM_MODEL_CONCURRENCY)
+
+        self.shared: Optional[SharedSlots] = None
+
+        self._poller: Optional[asyncio.Task] = None
+
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+
+        queue = self._queues.get(model)
+
+        if queue is None:
+
+            queue = self._queues[model] = _ModelQueue(model, self.model_concurrency.get(model, self.default_concurrency))
+
+        return queue
+
+    def share(self, slots: SharedSlots):
+
+        self.shared = slots
+
+        if self._poller is None or self._poller.done():
+
+            self._poller = asyncio.create_task(self._poll_shared(), name="llm_shared_slots")
+
+    async def _poll_shared(self):
+
+        while True:
+
+            await asyncio.sleep(LLM_SHARED_POLL_SECONDS)
+
+            for queue in list(self._queues.values()):
+
+                if queue.background and self.shared.others_waiting(queue.model):
+
+                    self._preempt(queue)
+
+                if queue.waiters and (time.monotonic() - queue.yielded_at > 2 * LLM_SHARED_POLL_SECONDS or not self.shared.others_waiting(queue.model)):
+
+                    self._promote(queue)
+
+    def _try_admit(self, queue: _ModelQueue) -> bool:
+
+        if queue.active >= queue.concurrency:
+
+            return False
+
+        if self.shared is not None and not self.shared.try_acquire(queue.model, queue.concurrency):
+
+            return False
+
+        queue.active += 1
+
+        return True
+
+    def _global_active(self, queue: _ModelQueue) -> int:
+
+        active = self.shared.active(queue.model) if self.shared is not None else None
+
+        return queue.active if active is None else active
+
+    def _publish_waiting(self, queue: _ModelQueue):
+
+        if self.shared is not None:
+
+            self.shared.set_waiting(queue.model, len(queue.waiters))
+
+    def set_replicas(self, model: str, replicas: int):
+
+        queue = self._queue(model)
+
+        replicas = max(1, replicas)
+
+        if replicas == queue.replicas:
+
+            return
+
+        logger.info(f"LLM model '{model}' now has {replicas} replicas, concurrency {queue.per_replica * replicas}.")
+
+        queue.replicas = replicas
+
+        queue.concurrency = queue.per_replica * replicas
+
+        self._promote(queue)
+
+    @asynccontextmanager
+    async def slot(self, model: str, on_position: Optional[Callable[[int], None]] = None) -> AsyncIterator[None]:
+
+        queue = self._queue(model)
+
+        if queue.waiters or not self._try_admit(queue):
+
+            if len(queue.waiters) >= self.max_queue_depth:
+
+                queue.shed += 1
+
+                raise QueueFullError(model, len(queue.waiters))
+
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), on_position)
+
+            queue.waiters.append(waiter)
+
+            self._publish_waiting(queue)
+
+            self._notify(waiter, len(queue.waiters))
+
+            self._preempt(queue)
+
+            try:
+
+                await waiter.future
+
+            except asyncio.CancelledError:
+
+                if waiter.future.done() and not waiter.future.cancelled():
+
+                    self._release(queue)
+
+                else:
+
+                    self._remove_waiter(queue, waiter)
+
+                raise
+
+        try:
+
+            yield
+
+        finally:
+
+            queue.completed += 1
+
+            self._release(queue)
+
+    @asynccontextmanager
+    async def background_slot(self, model: str) -> AsyncIterator[bool]:
+
+        queue = self._queue(model)
+
+        task = asyncio.current_task()
+
+        if task is None or queue.waiters or (self.shared is not None and self.shared.others_waiting(model)) or not self._try_admit(queue):
+
+            yield False
+
+            return
+
+        queue.background.add(task)
+
+        try:
+
+            yield True
+
+        finally:
+
+            queue.background.discard(task)
+
+            queue.completed += 1
+
+            self._release(queue)
+
+    def _preempt(self, queue: _ModelQueue):
+
+        if not queue.background:
+
+            return
+
+        task = queue.background.pop()
+
+        queue.preempted += 1
+
+        logger.info(f"Preempting background LLM work on '{queue.model}' for a waiting request.")
+
+        task.cancel()
+
+    def _notify(self, waiter: _Waiter, position: int):
+
+        if waiter.on_position is None:
+
+            return
+
+        try:
+
+            waiter.on_position(position)
+
+        except Exception as e:
+
+            logger.warning(f"Queue position callback failed: {e}")
+
+    def _remove_waiter(self, queue: _ModelQueue, waiter: _Waiter):
+
+        try:
+
+            index = queue.waiters.index(waiter)
+
+        except ValueError:
+
+            return
+
+        del queue.waiters[index]
+
+        self._publish_waiting(queue)
+
+        for position, later_waiter in enumerate(list(queue.waiters)[index:], start=index + 1):
+
+            self._notify(later_waiter, position)
+
+    def _release(self, queue: _ModelQueue):
+
+        queue.active -= 1
+
+        if self.shared is not None:
+
+            self.shared.release(queue.model)
+
+            if self.shared.others_waiting(queue.model):
+
+                queue.yielded_at = time.monotonic()
+
+                return
+
+        self._promote(queue)
+
+    def _promote(self, queue: _ModelQueue):
+
+        promoted = False
+
+        while queue.waiters:
+
+            if queue.waiters[0].future.done():
+
+                queue.waiters.popleft()
+
+                promoted = True
+
+                continue
+
+            if not self._try_admit(queue):
+
+                break
+
+            queue.waiters.popleft().future.set_result(None)
+
+            promoted = True
+
+        if promoted:
+
+            self._publish_waiting(queue)
+
+            for position, waiter in enumerate(queue.waiters, start=1):
+
+                self._notify(waiter, position)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+
+        return {
+
+            model: {
+
+                "concurrency": queue.concurrency,
+
+                "replicas": queue.replicas,
+
+                "active": queue.active,
+
+                "global_active": self._global_active(queue),
+
+                "waiting": len(queue.waiters),
+
+                "completed": queue.completed,
+
+                "shed": queue.shed,
+
+                "preempted": queue.preempted
+
+            }
+
+            for model, queue in self._queues.items()
+
+        }
@@ -4,24 +4,32 @@ import json
 
 import random
 
+import time
+
 import asyncio
 
+import signal
+
 from datetime import datetime, timezone
 
 from pathlib import Path
 
-from typing import Optional, List, Tuple, Dict, Any
+from typing import Optional, List, Tuple, Dict, Any, Callable
 
 from contextlib import suppress
 
-import logging
+from collections import deque
 
-import aiosqlite
+import logging
 
 import dotenv
 
+dotenv.load_dotenv()
+
 import ollama
 
+import httpx
+
 import aiohttp
 
 from bs4 import BeautifulSoup
@@ -32,7 +40,9 @@ from aiogram.client.default import DefaultBotProperties
 
 from aiogram.enums import ParseMode, ChatType
 
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 from aiogram.types import (
 
@@ -44,6 +54,8 @@ from aiogram.types import (
 
 )
 
+from aiogram.utils.chat_action import ChatActionSender
+
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from aiogram.utils.markdown import hide_link, hbold, hitalic, hcode
@@ -54,6 +66,30 @@ from group_stat import setup_stat_handlers, ProfileManager
 
 from rp_module_refactored import setup_rp_handlers, periodic_hp_recovery_task
 
+from middlewares import UserUpsertMiddleware
+
+from llm_scheduler import LLMScheduler, QueueFullError, SharedSlots
+
+from ollama_pool import OLLAMA_HOSTS, OllamaBackendPool, parse_hosts
+
+from prompt_builder import build_messages
+
+from dialog_summarizer import DialogSummarizer
+
+from response_cache import ResponseCache
+
+from response_cleaner import StreamCleaner, get_cleaner
+
+from outbound_limiter import OutboundLimiter, PRIORITY_BULK, outbound_priority
+
+from broadcast import Broadcaster
+
+from file_watcher import FileWatcher
+
+from webhook_server import WebhookServer
+
+from sharding import SHARD_WORKERS, ShardSupervisor, ShardWorker
+
 logging.basicConfig(
 
     level=logging.INFO,
@@ -64,8 +100,6 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-dotenv.load_dotenv()
-
 TOKEN = os.getenv("TOKEN")
 
 CHANNEL_ID_STR = os.getenv("CHANNEL_ID")
@@ -108,6 +142,38 @@ STICKERS_CACHE_FILE = DATA_DIR / "stickers_cache.json"
 
 MAX_RATING_OPPORTUNITIES = 3
 
+OLLAMA_STREAMING = os.getenv("OLLAMA_STREAMING", "1") != "0"
+
+STREAM_EDIT_INTERVAL_SECONDS = max(0.3, float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.2")))
+
+STREAM_EDIT_MIN_CHARS = max(1, int(os.getenv("STREAM_EDIT_MIN_CHARS", "24")))
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+BOT_RUN_MODE = os.getenv("BOT_RUN_MODE", "polling").strip().lower()
+
+TYPING_ACTION_INTERVAL_SECONDS = max(1.0, float(os.getenv("TYPING_ACTION_INTERVAL_SECONDS", "4.5")))
+
+OLLAMA_MAX_CONNECTIONS = max(1, int(os.getenv("OLLAMA_MAX_CONNECTIONS", "10")))
+
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = max(1, int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "5")))
+
+OLLAMA_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY_SECONDS", "120"))
+
+OLLAMA_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_CONNECT_TIMEOUT_SECONDS", "5"))
+
+OLLAMA_READ_TIMEOUT_SECONDS = float(os.getenv("OLLAMA_READ_TIMEOUT_SECONDS", "300"))
+
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1") != "0"
+
+OLLAMA_KEEP_ALIVE_HOT = os.getenv("OLLAMA_KEEP_ALIVE_HOT", "30m")
+
+OLLAMA_KEEP_ALIVE_COLD = os.getenv("OLLAMA_KEEP_ALIVE_COLD", "3m")
+
+OLLAMA_HOT_MIN_REQUESTS = max(1, int(os.getenv("OLLAMA_HOT_MIN_REQUESTS", "3")))
+
+OLLAMA_TRAFFIC_WINDOW_SECONDS = max(60, int(os.getenv("OLLAMA_TRAFFIC_WINDOW_SECONDS", "900")))
+
 class MonitoringState:
 
     def __init__(self):
@@ -120,10 +186,26 @@ class MonitoringState:
 
 monitoring_state = MonitoringState()
 
+llm_scheduler = LLMScheduler()
+
+response_cache = ResponseCache()
+
+outbound_limiter = OutboundLimiter()
+
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+bot.session.middleware(outbound_limiter)
+
+value_broadcaster = Broadcaster("value", bot, db.get_value_subscribers_page, db.remove_value_subscribers)
+
 dp = Dispatcher()
 
+webhook_server = WebhookServer(dp, bot) if BOT_RUN_MODE == "webhook" else None
+
+shard_worker: Optional[ShardWorker] = None
+
+user_upsert_middleware = UserUpsertMiddleware()
+
 class StickerManager:
 
     def __init__(self, cache_file_path: Path):
@@ -228,14 +310,18 @@ class NeuralAPI:
 
     MODEL_CONFIG = {
 
-        "saharoza": {"model": "saiga", "prompt": "[INST] <<SYS>>\nТы — Мэрри Шэдоу (Маша), 26 лет... <</SYS>>[/INST]\n\n"},
+        "saharoza": {"model": "saiga", "num_ctx": 2048, "reply_tokens": 384, "prompt": "[INST] <<SYS>>\nТы — Мэрри Шэдоу (Маша), 26 лет... <</SYS>>[/INST]\n\n"},
 
-        "dedinside": {"model": "saiga", "prompt": "[INST] <<SYS>>\nТы — Артём (ДедИнсайд), 24 года... <</SYS>>[/INST]\n\n"},
+        "dedinside": {"model": "saiga", "num_ctx": 2048, "reply_tokens": 384, "prompt": "[INST] <<SYS>>\nТы — Артём (ДедИнсайд), 24 года... <</SYS>>[/INST]\n\n"},
 
-        "genius": {"model": "deepseek-coder-v2:16b", "prompt": "[INST] <<SYS>>\nТы — профисианальный кодер , который пишет код который просто заставляет пользователя удивится <</SYS>>[/INST]\n\n"}
+        "genius": {"model": "deepseek-coder-v2:16b", "num_ctx": 4096, "reply_tokens": 1024, "prompt": "[INST] <<SYS>>\nТы — профисианальный кодер , который пишет код который просто заставляет пользователя удивится <</SYS>>[/INST]\n\n"}
 
     }
 
+    _backends: Optional[OllamaBackendPool] = None
+
+    _model_traffic: Dict[str, deque] = {}
+
     @classmethod
 
     def get_modes(cls) -> List[Tuple[str, str]]:
@@ -244,41 +330,185 @@ class NeuralAPI:
 
     @classmethod
 
-    async def generate_response(cls, message_text: str, history_ollama_format: list, mode: str = "saharoza") -> Optional[str]:
+    def get_model(cls, mode: str) -> str:
+
+        return cls.MODEL_CONFIG.get(mode, cls.MODEL_CONFIG["saharoza"])["model"]
+
+    @classmethod
+
+    def get_keep_alive(cls, model: str, record: bool = True) -> str:
+
+        now = time.monotonic()
+
+        traffic = cls._model_traffic.setdefault(model, deque())
+
+        if record:
+
+            traffic.append(now)
+
+        while traffic and now - traffic[0] > OLLAMA_TRAFFIC_WINDOW_SECONDS:
+
+            traffic.popleft()
+
+        return OLLAMA_KEEP_ALIVE_HOT if len(traffic) >= OLLAMA_HOT_MIN_REQUESTS else OLLAMA_KEEP_ALIVE_COLD
+
+    @classmethod
+
+    async def warm_up(cls):
+
+        models = list(dict.fromkeys(config["model"] for config in cls.MODEL_CONFIG.values()))
+
+        backends = cls.get_backends()
+
+        await backends.probe_all()
+
+        for model in models:
+
+            for backend in backends.backends_for(model):
+
+                started = time.monotonic()
+
+                try:
+
+                    async with llm_scheduler.slot(model):
+
+                        await backend.client.generate(model=model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE_HOT)
+
+                    logger.info(f"Model '{model}' warmed up on {backend.host} in {time.monotonic() - started:.1f}s.")
+
+                except QueueFullError:
+
+                    logger.info(f"Skipping warm-up of '{model}': its queue is already full.")
+
+                except Exception as e:
+
+                    logger.warning(f"Warm-up of model '{model}' on {backend.host} failed: {e}")
+
+    @staticmethod
+
+    def _create_client(host: Optional[str]) -> ollama.AsyncClient:
+
+        return ollama.AsyncClient(
+
+            host=host,
+
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT_SECONDS, connect=OLLAMA_CONNECT_TIMEOUT_SECONDS),
+
+            limits=httpx.Limits(
+
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY_SECONDS
+
+            )
+
+        )
+
+    @classmethod
+
+    def get_backends(cls) -> OllamaBackendPool:
+
+        if cls._backends is None:
+
+            cls._backends = OllamaBackendPool(parse_hosts(OLLAMA_HOSTS), cls._create_client, on_probe=cls._on_backends_probed)
+
+            hosts = ", ".join(backend.host for backend in cls._backends.backends)
+
+            logger.info(f"Ollama backends: {hosts} (max {OLLAMA_MAX_CONNECTIONS} connections, {OLLAMA_MAX_KEEPALIVE_CONNECTIONS} keep-alive each).")
+
+        return cls._backends
+
+    @classmethod
+
+    def _on_backends_probed(cls, backends: OllamaBackendPool):
+
+        for model in {config["model"] for config in cls.MODEL_CONFIG.values()}:
+
+            llm_scheduler.set_replicas(model, len(backends.backends_for(model)))
+
+    @classmethod
+
+    def get_backend_stats(cls) -> List[Dict[str, Any]]:
+
+        return cls._backends.stats() if cls._backends is not None else []
+
+    @classmethod
+
+    def start(cls):
+
+        cls.get_backends().start()
+
+    @classmethod
+
+    async def close(cls):
+
+        if cls._backends is None:
+
+            return
+
+        backends, cls._backends = cls._backends, None
+
+        await backends.close()
+
+        logger.info("Ollama backends closed.")
+
+    @classmethod
+
+    def _build_messages(cls, message_text: str, history_ollama_format: list, config: Dict[str, Any], summary: Optional[str] = None) -> List[Dict[str, str]]:
+
+        system_prompt = config["prompt"] + "Текущий диалог:\n(Отвечай только финальным сообщением без внутренних размышлений)"
+
+        messages_payload, packing = build_messages(system_prompt, history_ollama_format, message_text, config["num_ctx"], config["reply_tokens"], summary)
+
+        logger.debug(f"Prompt for {config['model']}: ~{packing['tokens']}/{packing['budget']} tokens, {packing['turns']}/{packing['turns_available']} turns, summary={packing['summary']}.")
+
+        return messages_payload
+
+    @classmethod
+
+    async def generate_response(cls, message_text: str, history_ollama_format: list, mode: str = "saharoza", on_partial: Optional[Callable[[StreamCleaner], None]] = None, summary: Optional[str] = None, cache_key: Optional[Tuple] = None) -> Optional[str]:
 
         try:
 
             config = cls.MODEL_CONFIG.get(mode, cls.MODEL_CONFIG["saharoza"])
 
-            messages_payload = [{"role": "system", "content": config["prompt"] + "Текущий диалог:\n(Отвечай только финальным сообщением без внутренних размышлений)"}]
+            messages_payload = cls._build_messages(message_text, history_ollama_format, config, summary)
 
-            for history_item in history_ollama_format:
+            backends = cls.get_backends()
 
-                if "user" in history_item and history_item["user"]:
+            options = {'temperature': 0.9 if mode == "dedinside" else 0.7, 'num_ctx': config["num_ctx"], 'num_predict': config["reply_tokens"], 'stop': ["<", "[", "Thought:"], 'repeat_penalty': 1.2}
 
-                    messages_payload.append({"role": "user", "content": history_item["user"]})
+            keep_alive = cls.get_keep_alive(config["model"])
 
-                if "bot" in history_item and history_item["bot"]:
+            if on_partial is None or not OLLAMA_STREAMING:
 
-                    messages_payload.append({"role": "assistant", "content": history_item["bot"]})
+                response = await backends.chat(config["model"], messages=messages_payload, options=options, keep_alive=keep_alive)
 
-            messages_payload.append({"role": "user", "content": message_text})
+                raw_response = response['message']['content']
 
-            client = ollama.AsyncClient()
+                response_text = get_cleaner(mode).clean(raw_response)
 
-            response = await client.chat(
+            else:
 
-                model=config["model"],
+                cleaner = StreamCleaner(mode)
 
-                messages=messages_payload,
+                async for chunk in backends.chat_stream(config["model"], messages=messages_payload, options=options, keep_alive=keep_alive):
 
-                options={'temperature': 0.9 if mode == "dedinside" else 0.7, 'num_ctx': 2048, 'stop': ["<", "[", "Thought:"], 'repeat_penalty': 1.2}
+                    if cleaner.feed(chunk['message']['content']):
 
-            )
+                        on_partial(cleaner)
+
+                raw_response = cleaner.raw_text
 
-            raw_response = response['message']['content']
+                response_text = cleaner.finish()
 
-            return cls._clean_response(raw_response, mode)
+            if raw_response.strip():
+
+                response_cache.put(cache_key, response_text)
+
+            return response_text
 
         except ollama.ResponseError as e:
 
@@ -294,43 +524,49 @@ class NeuralAPI:
 
             return "Произошла внутренняя ошибка при обращении к нейросети или подготовке данных. Попробуйте еще раз или /reset."
 
-    @staticmethod
+    @classmethod
 
-    def _clean_response(text: str, mode: str) -> str:
+    async def summarize(cls, mode: str, previous_summary: Optional[str], entries: List[Dict[str, Any]]) -> Optional[str]:
 
-        import re
+        model = cls.get_model(mode)
 
-        text = re.sub(r'<\/?[\w\s="/.\':?]+>', '', text)
+        transcript = "\n".join(f"{'Пользователь' if entry['role'] == 'user' else 'Ты'}: {entry['content']}" for entry in entries)
 
-        text = re.sub(r'\[\/?[\w\s="/.\':?]+\]', '', text)
+        prompt = (
 
-        text = re.sub(r'(^|\n)\s*Thought:.*', '', text, flags=re.MULTILINE)
+            "Сожми диалог в краткую сводку на русском (до 5 предложений): факты о пользователе, темы, договорённости. "
 
-        text = re.sub(r'^\s*Okay, here is the response.*?\n', '', text, flags=re.IGNORECASE | re.MULTILINE)
+            "Без вступлений, только сводка.\n\n"
 
-        if mode == "genius":
+            + (f"Прежняя сводка:\n{previous_summary}\n\n" if previous_summary else "")
 
-            text = re.sub(r'(?i)(как (?:ии|искусственный интеллект|ai|language model))', '', text)
+            + f"Новые реплики:\n{transcript}"
 
-            if text and len(text.split()) < 15 and not text.startswith("Ой,") and not text.startswith("Произошла"):
+        )
+
+        config = cls.MODEL_CONFIG.get(mode, cls.MODEL_CONFIG["saharoza"])
 
-                text += "\n\nЭто краткий ответ. Если нужно больше деталей - уточни вопрос."
+        async with llm_scheduler.background_slot(model) as admitted:
 
-        elif mode == "dedinside":
+            if not admitted:
 
-            text = re.sub(r'(?i)(я (?:бот|программа|ии|модель))', '', text)
+                return None
 
-            if text and not any(c in text for c in ('?', '!', '...', '😏', '😈', '👀')): text += '... Ну че, как тебе такое? 😏'
+            response = await cls.get_backends().chat(
 
-        elif mode == "saharoza":
+                model,
 
-            text = re.sub(r'(?i)(я (?:бот|программа|ии|модель))', '', text)
+                messages=[{"role": "user", "content": prompt}],
 
-            if text and not any(c in text for c in ('?', '!', '...', '🌸', '✨', '💔', '😉')): text += '... И что ты на это скажешь? 😉'
+                options={'temperature': 0.2, 'num_ctx': config["num_ctx"], 'num_predict': config["reply_tokens"]},
 
-        cleaned_text = text.strip()
+                keep_alive=cls.get_keep_alive(model, record=False)
+
+            )
 
-        return cleaned_text if cleaned_text else "Хм, не знаю, что ответить... Спроси что-нибудь еще?"
+        return get_cleaner(mode).clean_fragment(response['message']['content']).strip() or None
+
+dialog_summarizer = DialogSummarizer(NeuralAPI.summarize)
 
 async def safe_send_message(chat_id: int, text: str, **kwargs) -> Optional[Message]:
 
@@ -344,35 +580,143 @@ async def safe_send_message(chat_id: int, text: str, **kwargs) -> Optional[Messa
 
         return None
 
-async def typing_animation(chat_id: int, bot_instance: Bot) -> Optional[Message]:
+class ProgressiveReply:
 
-    typing_msg = None
+    def __init__(self, bot_instance: Bot, chat_id: int, placeholder: Optional[Message] = None):
 
-    try:
+        self.bot = bot_instance
 
-        typing_msg = await bot_instance.send_message(chat_id, "✍️ Печатает...")
+        self.chat_id = chat_id
 
-        for _ in range(2):
+        self.message = placeholder
 
-            await asyncio.sleep(0.7)
+        self.edits = 0
 
-            if typing_msg.text == "✍️ Печатает...": await typing_msg.edit_text("✍️ Печатает..")
+        self._shown = ""
 
-            elif typing_msg.text == "✍️ Печатает..": await typing_msg.edit_text("✍️ Печатает.")
+        self._next_edit_at = 0.0
 
-            else: await typing_msg.edit_text("✍️ Печатает...")
+        self._edit_task: Optional[asyncio.Task] = None
 
-        return typing_msg
+        self.status: Optional[str] = None
 
-    except Exception as e:
+        self._status_shown: Optional[str] = None
 
-        logger.warning(f"Typing animation error in chat {chat_id}: {e}")
+    def update(self, stream: StreamCleaner):
 
-        if typing_msg:
+        if self._edit_task is not None and not self._edit_task.done():
 
-            with suppress(Exception): await typing_msg.delete()
+            return
 
-        return None
+        if abs(stream.length - len(self._shown)) < STREAM_EDIT_MIN_CHARS and self._shown:
+
+            return
+
+        if asyncio.get_running_loop().time() < self._next_edit_at:
+
+            return
+
+        if not outbound_limiter.chat_ready(self.chat_id):
+
+            return
+
+        text = stream.text()
+
+        if not text:
+
+            return
+
+        self._edit_task = asyncio.create_task(self._show(text))
+
+    async def _show(self, text: str):
+
+        loop = asyncio.get_running_loop()
+
+        self._next_edit_at = loop.time() + STREAM_EDIT_INTERVAL_SECONDS
+
+        preview = text if len(text) <= TELEGRAM_MESSAGE_LIMIT - 2 else text[:TELEGRAM_MESSAGE_LIMIT - 2]
+
+        preview += " ▌"
+
+        if await self._edit(preview):
+
+            self._shown = text
+
+    def set_status(self, text: str):
+
+        self.status = text
+
+        self._edit_task = asyncio.create_task(self._show_status(self._edit_task))
+
+    async def _show_status(self, previous: Optional[asyncio.Task]):
+
+        if previous is not None:
+
+            with suppress(Exception):
+
+                await previous
+
+        text = self.status
+
+        if text is None or text == self._status_shown:
+
+            return
+
+        if await self._edit(text):
+
+            self._status_shown = text
+
+    async def _edit(self, text: str) -> bool:
+
+        try:
+
+            if self.message is None:
+
+                self.message = await self.bot.send_message(self.chat_id, text, parse_mode=None)
+
+            else:
+
+                await self.message.edit_text(text, parse_mode=None)
+
+            self.edits += 1
+
+            return True
+
+        except TelegramRetryAfter as e:
+
+            self._next_edit_at = asyncio.get_running_loop().time() + e.retry_after
+
+            logger.warning(f"Reply edits throttled by Telegram in chat {self.chat_id} for {e.retry_after}s.")
+
+        except TelegramBadRequest as e:
+
+            if "message is not modified" not in str(e):
+
+                logger.warning(f"Reply edit failed in chat {self.chat_id}: {e}")
+
+        return False
+
+    async def finish(self, text: str) -> Optional[Message]:
+
+        if self._edit_task is not None:
+
+            with suppress(Exception):
+
+                await self._edit_task
+
+        if self.message is None:
+
+            return await safe_send_message(self.chat_id, text)
+
+        try:
+
+            return await self.message.edit_text(text)
+
+        except TelegramRetryAfter as e:
+
+            await asyncio.sleep(e.retry_after)
+
+            return await self.message.edit_text(text)
 
 @dp.message(Command("start"))
 
@@ -382,8 +726,6 @@ async def start_handler(message: Message, profile_manager: ProfileManager):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     await message.answer(f"Привет, {user.first_name}! 👋\nЯ твой многоликий AI-собеседник. Используй /msg для выбора режима или /help для списка команд.")
 
 @dp.message(Command("reset"))
@@ -394,15 +736,9 @@ async def reset_handler(message: Message, profile_manager: ProfileManager):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     try:
 
-        async with aiosqlite.connect(db.DB_FILE) as conn:
-
-            await conn.execute('DELETE FROM dialog_history WHERE user_id = ?', (user.id,))
-
-            await conn.commit()
+        await db.clear_dialog_history(user.id)
 
         await db.set_user_mode(user.id, "saharoza")
 
@@ -426,8 +762,6 @@ async def help_handler(message: Message):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     help_text = f"""{hide_link('https://example.com/bot-preview.jpg')}
 <b>📚 Доступные команды:</b>
 /start - Начать работу с ботом
@@ -452,8 +786,6 @@ async def stats_handler(message: Message, profile_manager: ProfileManager):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     try:
 
         user_stats_summary = await db.get_user_stats_db(user.id)
@@ -462,6 +794,8 @@ async def stats_handler(message: Message, profile_manager: ProfileManager):
 
         user_mode_data = await db.get_user_mode_and_rating_opportunity(user.id)
 
+        weekly_activity = await db.get_user_daily_activity(user.id, days=7)
+
         rating_opportunities_left = MAX_RATING_OPPORTUNITIES - user_mode_data.get('rating_opportunities_count', 0)
 
         stats_text = (
@@ -470,6 +804,8 @@ async def stats_handler(message: Message, profile_manager: ProfileManager):
 
             f"• Всего запросов к ИИ: {user_stats_summary.get('count', 0)}\n"
 
+            f"• За последние 7 дней: {sum(day['count'] for day in weekly_activity)}\n"
+
             f"• Текущий режим: {user_mode_data.get('mode', 'saharoza')}\n"
 
             f"• Последняя активность: {user_stats_summary.get('last_active', 'еще не активен')}\n"
@@ -488,6 +824,152 @@ async def stats_handler(message: Message, profile_manager: ProfileManager):
 
         await message.answer("Не удалось получить статистику.")
 
+@dp.message(Command("cachestats"))
+
+async def cache_stats_handler(message: Message):
+
+    user = message.from_user
+
+    if not user or user.id != ADMIN_USER_ID: return
+
+    lines = ["🧮 <b>Кэши:</b>"]
+
+    for cache_name, cache_stats in (("Режимы пользователей", db.get_mode_cache_stats()), ("История диалогов", db.get_history_cache_stats()), ("Ответы нейросети", response_cache.stats())):
+
+        lines.append(
+
+            f"• {cache_name}: {cache_stats['size']}/{cache_stats['max_size']}, "
+
+            f"hit {cache_stats['hits']} / miss {cache_stats['misses']} "
+
+            f"({cache_stats['hit_ratio'] * 100:.1f}%), вытеснено {cache_stats['evictions']}"
+
+        )
+
+    upsert_stats = user_upsert_middleware.stats()
+
+    lines.append(
+
+        f"• Известные пользователи: {upsert_stats['size']}/{upsert_stats['max_size']}, "
+
+        f"записей в БД {upsert_stats['upserts']}, пропущено {upsert_stats['skipped']}"
+
+    )
+
+    summary_stats = dialog_summarizer.stats()
+
+    lines.append(f"• Сводки диалогов: в очереди {summary_stats['pending']}, обновлено {summary_stats['updated']}, пропущено {summary_stats['skipped']}")
+
+    for model, queue_stats in llm_scheduler.stats().items():
+
+        lines.append(
+
+            f"• Очередь {hcode(model)}: активно {queue_stats['global_active']}/{queue_stats['concurrency']}, "
+
+            f"ждут {queue_stats['waiting']}, выполнено {queue_stats['completed']}, отклонено {queue_stats['shed']}, прервано фоновых {queue_stats['preempted']}"
+
+        )
+
+    for backend_stats in NeuralAPI.get_backend_stats():
+
+        lines.append(
+
+            f"• Ollama {hcode(backend_stats['host'])}: {'✅' if backend_stats['healthy'] else '❌'}, "
+
+            f"в работе {backend_stats['outstanding']}, запросов {backend_stats['requests']}, ошибок {backend_stats['failures']}"
+
+        )
+
+    broadcast_stats = value_broadcaster.stats()
+
+    lines.append(
+
+        f"• Рассылка курса: {'идёт, после ' + str(broadcast_stats['cursor_user_id']) if broadcast_stats['running'] else 'нет'}, "
+
+        f"запусков {broadcast_stats['jobs']} (вытеснено {broadcast_stats['superseded']}), отправлено {broadcast_stats['sent']}, "
+
+        f"ошибок {broadcast_stats['failed']}, удалено заблокировавших {broadcast_stats['pruned']}"
+
+    )
+
+    if webhook_server is not None:
+
+        webhook_stats = webhook_server.stats()
+
+        lines.append(
+
+            f"• Webhook: в обработке {webhook_stats['in_flight']}/{webhook_stats['max_in_flight']} (пик {webhook_stats['peak_in_flight']}), "
+
+            f"получено {webhook_stats['received']}, ошибок {webhook_stats['failed']}, отклонено {webhook_stats['rejected']}"
+
+        )
+
+    if shard_worker is not None:
+
+        shard_stats = shard_worker.stats()
+
+        lines.append(
+
+            f"• Шард {shard_worker.index + 1}/{shard_worker.workers} (pid {shard_stats['pid']}): в обработке {shard_stats['in_flight']}, в очереди {shard_stats['pending']}, "
+
+            f"обработано {shard_stats['processed']}, ошибок {shard_stats['failed']}, отброшено {shard_stats['dropped']}, инвалидаций {shard_stats['invalidations']}"
+
+        )
+
+    outbound_stats = outbound_limiter.stats()
+
+    lines.append(
+
+        f"• Исходящие: ждут {outbound_stats['waiting']['interactive']} + {outbound_stats['waiting']['bulk']} (рассылки), пик {outbound_stats['peak_waiting']}, "
+
+        f"отправлено {outbound_stats['sent']}, задержано {outbound_stats['delayed']} (макс. {outbound_stats['max_wait_ms']} мс), 429: {outbound_stats['retry_after']}, отменено {outbound_stats['cancelled']}"
+
+    )
+
+    await message.answer("\n".join(lines))
+
+@dp.message(Command("dbstats"))
+
+async def db_stats_handler(message: Message, command: CommandObject):
+
+    user = message.from_user
+
+    if not user or user.id != ADMIN_USER_ID: return
+
+    if command.args and command.args.strip() == "reset":
+
+        db.reset_query_stats()
+
+        await message.answer("🗄 Статистика запросов сброшена.")
+
+        return
+
+    query_stats = db.get_query_stats(limit=15)
+
+    since = datetime.fromtimestamp(query_stats["since"]).strftime("%d.%m %H:%M")
+
+    lines = [f"🗄 <b>Запросы к БД</b> (с {since}, медленных ≥{query_stats['slow_query_ms']} мс: {query_stats['slow_queries']}):"]
+
+    for statement in query_stats["statements"]:
+
+        lines.append(
+
+            f"• {hcode(statement['name'])}: {statement['count']}×, "
+
+            f"p50 {statement['p50_ms']} / p95 {statement['p95_ms']} / p99 {statement['p99_ms']} мс, "
+
+            f"всего {statement['total_ms']:.0f} мс, строк {statement['rows']}"
+
+            + (f", ошибок {statement['errors']}" if statement['errors'] else "")
+
+        )
+
+    if not query_stats["statements"]:
+
+        lines.append("Пока нет данных.")
+
+    await message.answer("\n".join(lines))
+
 @dp.message(Command("msg"))
 
 async def msg_handler_command(message: Message):
@@ -496,8 +978,6 @@ async def msg_handler_command(message: Message):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     builder = InlineKeyboardBuilder()
 
     for name, mode_code in NeuralAPI.get_modes():
@@ -518,8 +998,6 @@ async def set_mode_handler(callback: CallbackQuery, profile_manager: ProfileMana
 
         user = callback.from_user
 
-        await db.ensure_user(user.id, user.username, user.first_name)
-
         await db.set_user_mode(user.id, mode)
 
         await db.log_interaction_db(user.id, f"set_mode_to_{mode}")
@@ -642,8 +1120,6 @@ async def start_sending_values(message: Message, profile_manager: ProfileManager
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     await db.add_value_subscriber(user.id)
 
     await message.answer("✅ Мониторинг курса активирован для вас.")
@@ -658,8 +1134,6 @@ async def stop_sending_values(message: Message, profile_manager: ProfileManager)
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     await db.remove_value_subscriber(user.id)
 
     await message.answer("❌ Мониторинг курса для вас отключен.")
@@ -674,8 +1148,6 @@ async def photo_handler(message: Message, profile_manager: ProfileManager):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     caption = message.caption or ""
 
     await message.answer(f"📸 Фото получил! Комментарий: '{caption[:100]}...'. Пока не умею анализировать изображения, но скоро научусь!")
@@ -688,8 +1160,6 @@ async def voice_handler_msg(message: Message, profile_manager: ProfileManager):
 
     if not user: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     await message.answer("🎤 Голосовые пока не обрабатываю, но очень хочу научиться! Отправь пока текстом, пожалуйста.")
 
 @dp.message(F.chat.type == ChatType.PRIVATE, F.text)
@@ -700,29 +1170,53 @@ async def message_handler(message: Message, bot_instance: Bot, profile_manager:
 
     if not user or not message.text: return
 
-    await db.ensure_user(user.id, user.username, user.first_name)
-
     user_mode_data = await db.get_user_mode_and_rating_opportunity(user.id)
 
     mode = user_mode_data.get('mode', "saharoza")
 
     rating_opportunities_count = user_mode_data.get('rating_opportunities_count', 0)
 
-    history_ollama = await db.get_dialog_history_for_ollama(user.id, limit=5)
+    summary, summary_seq = await db.get_dialog_summary(user.id)
 
-    typing_msg = await typing_animation(message.chat.id, bot_instance)
+    history_ollama = await db.get_dialog_history_for_ollama(user.id, limit_turns=db.DIALOG_HISTORY_SLOTS // 2, after_seq=summary_seq)
+
+    reply = ProgressiveReply(bot_instance, message.chat.id)
+
+    def show_queue_position(position: int):
+
+        reply.set_status(f"⏳ Нейросеть занята, ты {position}-й в очереди. Подожди немного...")
 
     try:
 
-        response_text = await NeuralAPI.generate_response(
+        cache_key = response_cache.make_key(mode, message.text, history_ollama, summary)
 
-            message_text=message.text,
+        response_text = response_cache.get(cache_key)
 
-            history_ollama_format=history_ollama,
+        if response_text is None:
 
-            mode=mode
+            async with ChatActionSender.typing(bot=bot_instance, chat_id=message.chat.id, interval=TYPING_ACTION_INTERVAL_SECONDS):
 
-        )
+                async with llm_scheduler.slot(NeuralAPI.get_model(mode), on_position=show_queue_position):
+
+                    if reply.status is not None:
+
+                        reply.set_status("✍️ Печатает...")
+
+                    response_text = await NeuralAPI.generate_response(
+
+                        message_text=message.text,
+
+                        history_ollama_format=history_ollama,
+
+                        mode=mode,
+
+                        on_partial=reply.update,
+
+                        summary=summary,
+
+                        cache_key=cache_key
+
+                    )
 
         if not response_text:
 
@@ -734,15 +1228,7 @@ async def message_handler(message: Message, bot_instance: Bot, profile_manager:
 
         await db.log_interaction_db(user.id, mode)
 
-        response_msg_obj: Optional[Message] = None
-
-        if typing_msg:
-
-            response_msg_obj = await typing_msg.edit_text(response_text)
-
-        else:
-
-            response_msg_obj = await safe_send_message(message.chat.id, response_text)
+        response_msg_obj = await reply.finish(response_text)
 
         if response_msg_obj and rating_opportunities_count < MAX_RATING_OPPORTUNITIES:
 
@@ -766,12 +1252,28 @@ async def message_handler(message: Message, bot_instance: Bot, profile_manager:
 
                 logger.warning(f"Could not edit reply markup for msg {response_msg_obj.message_id}: {edit_err}")
 
+        dialog_summarizer.schedule(user.id, mode)
+
         if random.random() < 0.3:
 
             sticker_id = sticker_manager.get_random_sticker(mode)
 
             if sticker_id: await message.answer_sticker(sticker_id)
 
+    except QueueFullError as e:
+
+        logger.warning(f"Shedding message from user {user.id}: {e}")
+
+        busy_text = "😮‍💨 Сейчас слишком много желающих поболтать. Попробуй написать через минутку!"
+
+        if reply.message:
+
+            with suppress(Exception): await reply.message.edit_text(busy_text)
+
+        else:
+
+            await safe_send_message(message.chat.id, busy_text)
+
     except Exception as e:
 
         logger.error(f"Error processing message for user {user.id} in mode {mode}: {e}", exc_info=True)
@@ -788,9 +1290,9 @@ async def message_handler(message: Message, bot_instance: Bot, profile_manager:
 
         error_msg_text = error_texts.get(mode, "Произошла непредвиденная ошибка.")
 
-        if typing_msg:
+        if reply.message:
 
-            with suppress(Exception): await typing_msg.edit_text(error_msg_text)
+            with suppress(Exception): await reply.message.edit_text(error_msg_text)
 
         else:
 
@@ -800,60 +1302,62 @@ async def monitoring_task(bot_instance: Bot):
 
     logger.info("Monitoring task started.")
 
+    value_watcher = FileWatcher(VALUE_FILE_PATH)
+
+    value_watcher.start()
+
     async with monitoring_state.lock:
 
         monitoring_state.last_value = await asyncio.to_thread(db.read_value_from_file, VALUE_FILE_PATH)
 
         logger.info(f"Initial value for monitoring: {monitoring_state.last_value}")
 
-    while True:
-
-        await asyncio.sleep(5)
-
-        try:
+    try:
 
-            subscribers_ids = await db.get_value_subscribers()
+        while True:
 
-            if not subscribers_ids:
+            await value_watcher.wait_for_change()
 
-                async with monitoring_state.lock: monitoring_state.is_sending_values = False
+            try:
 
-                continue
+                new_value = await asyncio.to_thread(db.read_value_from_file, VALUE_FILE_PATH)
 
-            async with monitoring_state.lock: monitoring_state.is_sending_values = True
+                value_changed = False
 
-            new_value = await asyncio.to_thread(db.read_value_from_file, VALUE_FILE_PATH)
+                async with monitoring_state.lock:
 
-            value_changed = False
+                    if new_value is not None and new_value != monitoring_state.last_value:
 
-            async with monitoring_state.lock:
+                        logger.info(f"Value change detected: '{monitoring_state.last_value}' -> '{new_value}'")
 
-                if new_value is not None and new_value != monitoring_state.last_value:
+                        monitoring_state.last_value = new_value
 
-                    logger.info(f"Value change detected: '{monitoring_state.last_value}' -> '{new_value}'")
+                        value_changed = True
 
-                    monitoring_state.last_value = new_value
+                subscribers_ids = await db.get_value_subscribers()
 
-                    value_changed = True
+                async with monitoring_state.lock: monitoring_state.is_sending_values = bool(subscribers_ids)
 
-            if value_changed and subscribers_ids:
+                if value_changed and subscribers_ids:
 
-                logger.info(f"Notifying {len(subscribers_ids)} value subscribers about new value: {new_value}")
+                    logger.info(f"Notifying {len(subscribers_ids)} value subscribers about new value: {new_value}")
 
-                msg_text = f"⚠️ Обнаружено движение! Всего: {new_value}"
+                    await value_broadcaster.broadcast(f"⚠️ Обнаружено движение! Всего: {new_value}")
 
-                tasks = [safe_send_message(uid, msg_text) for uid in subscribers_ids]
+            except Exception as e:
 
-                await asyncio.gather(*tasks, return_exceptions=True)
+                logger.error(f"Error in monitoring_task loop: {e}", exc_info=True)
 
-        except Exception as e:
+    finally:
 
-            logger.error(f"Error in monitoring_task loop: {e}", exc_info=True)
+        value_watcher.close()
 
 async def jokes_task(bot_instance: Bot):
 
     logger.info("Jokes task started.")
 
+    outbound_priority.set(PRIORITY_BULK)
+
     if not CHANNEL_ID:
 
         logger.warning("Jokes task disabled: CHANNEL_ID is not set or invalid.")
@@ -912,95 +1416,265 @@ async def jokes_task(bot_instance: Bot):
 
                 await asyncio.sleep(random.randint(300, 600))
 
-async def main():
+def setup_dispatcher(profile_manager: ProfileManager, sticker_manager: StickerManager):
+
+    dp["profile_manager"] = profile_manager
+
+    dp["sticker_manager"] = sticker_manager
+
+    dp["bot_instance"] = bot
+
+    dp.update.outer_middleware(user_upsert_middleware)
+
+    setup_stat_handlers(dp)
+
+    setup_rp_handlers(
+
+        main_dp=dp,
+
+        bot_instance=bot,
+
+        profile_manager_instance=profile_manager,
+
+        database_module=db
+
+    )
+
+async def start_runtime(primary: bool = True) -> Optional[Dict[str, Any]]:
 
     profile_manager = ProfileManager()
 
     try:
 
+        await db.init_db(background_tasks=primary)
+
         if hasattr(profile_manager, 'connect'):
 
             await profile_manager.connect()
 
-        await db.init_db()
-
         logger.info("Database and ProfileManager initialized.")
 
     except Exception as e:
 
         logger.critical(f"Failed to initialize database or ProfileManager: {e}", exc_info=True)
 
-        return
+        return None
+
+    NeuralAPI.start()
+
+    warmup_bg_task = asyncio.create_task(NeuralAPI.warm_up()) if OLLAMA_WARMUP and primary else None
 
     sticker_manager_instance = StickerManager(cache_file_path=STICKERS_CACHE_FILE)
 
     await sticker_manager_instance.fetch_stickers(bot)
 
-    dp["profile_manager"] = profile_manager
+    setup_dispatcher(profile_manager, sticker_manager_instance)
 
-    dp["sticker_manager"] = sticker_manager_instance
+    background_tasks: List[asyncio.Task] = []
 
-    dp["bot_instance"] = bot
+    if primary:
 
-    setup_stat_handlers(dp)
+        await value_broadcaster.resume()
 
-    setup_rp_handlers(
+        background_tasks = [
 
-        main_dp=dp,
+            asyncio.create_task(monitoring_task(bot)),
 
-        bot_instance=bot,
+            asyncio.create_task(jokes_task(bot)),
 
-        profile_manager_instance=profile_manager,
+            asyncio.create_task(periodic_hp_recovery_task(bot, profile_manager, db))
 
-        database_module=db
+        ]
 
-    )
+    return {"profile_manager": profile_manager, "warmup_task": warmup_bg_task, "background_tasks": background_tasks}
+
+async def stop_runtime(runtime: Dict[str, Any]):
+
+    logger.info("Stopping bot...")
+
+    for task in runtime["background_tasks"]:
 
-    monitoring_bg_task = asyncio.create_task(monitoring_task(bot))
+        task.cancel()
 
-    jokes_bg_task = asyncio.create_task(jokes_task(bot))
+    warmup_bg_task = runtime["warmup_task"]
 
-    rp_recovery_bg_task = asyncio.create_task(periodic_hp_recovery_task(bot, profile_manager, db))
+    if warmup_bg_task:
 
-    logger.info("Starting bot polling...")
+        warmup_bg_task.cancel()
+
+        with suppress(asyncio.CancelledError, Exception): await warmup_bg_task
 
     try:
 
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        await asyncio.gather(*runtime["background_tasks"], return_exceptions=True)
+
+        logger.info("Background tasks gracefully cancelled.")
+
+    except asyncio.CancelledError:
+
+        logger.info("Background tasks were cancelled during shutdown.")
+
+    await value_broadcaster.close()
+
+    profile_manager = runtime["profile_manager"]
+
+    if hasattr(profile_manager, 'close'):
+
+        await profile_manager.close()
+
+        logger.info("ProfileManager connection closed.")
+
+    await db.flush_analytics()
+
+    await db.close_db()
+
+    logger.info("Analytics flushed, database pool closed.")
+
+    await dialog_summarizer.close()
+
+    await NeuralAPI.close()
+
+    await outbound_limiter.close()
+
+    await bot.session.close()
+
+    logger.info("Bot session closed. Exiting.")
+
+def run_shard_worker(index: int, workers: int, updates_queue: Any, control_queue: Any, llm_slots: SharedSlots):
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+
+        asyncio.run(shard_worker_main(index, workers, updates_queue, control_queue, llm_slots))
 
     except Exception as e:
 
-        logger.critical(f"Bot polling failed: {e}", exc_info=True)
+        logger.critical(f"Shard worker {index} crashed: {e}", exc_info=True)
+
+        raise
+
+async def shard_worker_main(index: int, workers: int, updates_queue: Any, control_queue: Any, llm_slots: SharedSlots):
+
+    global shard_worker
+
+    llm_slots.index = index
+
+    llm_scheduler.share(llm_slots)
+
+    outbound_limiter.share_between(workers)
+
+    runtime = await start_runtime(primary=index == 0)
+
+    if runtime is None:
+
+        raise SystemExit(1)
+
+    shard_worker = ShardWorker(index, workers, updates_queue, control_queue, dp, bot, db.apply_invalidation)
+
+    db.set_invalidation_listener(shard_worker.publish_invalidation)
+
+    logger.info(f"Shard worker {index}/{workers} is processing updates{' and runs background tasks' if index == 0 else ''}.")
+
+    try:
+
+        await shard_worker.run()
 
     finally:
 
-        logger.info("Stopping bot...")
+        db.set_invalidation_listener(None)
 
-        monitoring_bg_task.cancel()
+        await stop_runtime(runtime)
 
-        jokes_bg_task.cancel()
+async def run_shard_front():
 
-        rp_recovery_bg_task.cancel()
+    try:
 
-        try:
+        await db.init_db(background_tasks=False)
+
+        await db.close_db()
+
+    except Exception as e:
+
+        logger.critical(f"Failed to prepare the database for shard workers: {e}", exc_info=True)
+
+        return
+
+    sticker_manager_instance = StickerManager(cache_file_path=STICKERS_CACHE_FILE)
+
+    await sticker_manager_instance.fetch_stickers(bot)
+
+    setup_dispatcher(ProfileManager(), sticker_manager_instance)
+
+    llm_slots = SharedSlots(SHARD_WORKERS, [config["model"] for config in NeuralAPI.MODEL_CONFIG.values()] + list(llm_scheduler.model_concurrency))
+
+    supervisor = ShardSupervisor(SHARD_WORKERS, run_shard_worker, target_args=(llm_slots,), on_worker_exit=llm_slots.reset_worker)
+
+    supervisor.start()
+
+    try:
+
+        if webhook_server is not None:
+
+            logger.info(f"Starting shard front in webhook mode with {SHARD_WORKERS} workers...")
+
+            webhook_server.feed = supervisor.route
 
-            await asyncio.gather(monitoring_bg_task, jokes_bg_task, rp_recovery_bg_task, return_exceptions=True)
+            await webhook_server.serve(allowed_updates=dp.resolve_used_update_types())
 
-            logger.info("Background tasks gracefully cancelled.")
+        else:
+
+            logger.info(f"Starting shard front polling with {SHARD_WORKERS} workers...")
 
-        except asyncio.CancelledError:
+            await supervisor.poll(bot, allowed_updates=dp.resolve_used_update_types())
+
+    except Exception as e:
 
-            logger.info("Background tasks were cancelled during shutdown.")
+        logger.critical(f"Shard front {BOT_RUN_MODE} failed: {e}", exc_info=True)
 
-        if hasattr(profile_manager, 'close'):
+    finally:
 
-            await profile_manager.close()
+        await supervisor.close()
 
-            logger.info("ProfileManager connection closed.")
+        await outbound_limiter.close()
 
         await bot.session.close()
 
-        logger.info("Bot session closed. Exiting.")
+async def main():
+
+    if SHARD_WORKERS > 1:
+
+        await run_shard_front()
+
+        return
+
+    runtime = await start_runtime()
+
+    if runtime is None:
+
+        return
+
+    try:
+
+        if webhook_server is not None:
+
+            logger.info("Starting bot in webhook mode...")
+
+            await webhook_server.serve(allowed_updates=dp.resolve_used_update_types())
+
+        else:
+
+            logger.info("Starting bot polling...")
+
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+    except Exception as e:
+
+        logger.critical(f"Bot {BOT_RUN_MODE} failed: {e}", exc_info=True)
+
+    finally:
+
+        await stop_runtime(runtime)
 
 if __name__ == '__main__':
 
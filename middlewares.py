@@ -0,0 +1,157 @@
+import asyncio
+
+import os
+
+import time
+
+import logging
+
+from collections import OrderedDict
+
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, types
+
+from aiogram.types import TelegramObject
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+USER_UPSERT_TTL_SECONDS = int(os.getenv("USER_UPSERT_TTL_SECONDS", "300"))
+
+USER_UPSERT_CACHE_SIZE = int(os.getenv("USER_UPSERT_CACHE_SIZE", "10000"))
+
+class UserUpsertMiddleware(BaseMiddleware):
+
+    def __init__(self, ttl_seconds: int = USER_UPSERT_TTL_SECONDS, max_entries: int = USER_UPSERT_CACHE_SIZE):
+
+        self.ttl_seconds = ttl_seconds
+
+        self.max_entries = max_entries
+
+        self._known: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+        self._in_flight: Dict[int, asyncio.Future] = {}
+
+        self.upserts = 0
+
+        self.skipped = 0
+
+    async def __call__(
+
+        self,
+
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+
+        event: TelegramObject,
+
+        data: Dict[str, Any]
+
+    ) -> Any:
+
+        user: Optional[types.User] = data.get("event_from_user")
+
+        if user is not None and not user.is_bot:
+
+            try:
+
+                await self.ensure(user)
+
+            except Exception as e:
+
+                logger.error(f"User upsert failed for user {user.id}: {e}", exc_info=True)
+
+        return await handler(event, data)
+
+    def _identity(self, user: types.User) -> Tuple[Optional[str], str, Optional[str]]:
+
+        return user.username, user.first_name, user.last_name
+
+    def _get_fresh(self, user: types.User) -> Optional[Dict[str, Any]]:
+
+        user_ctx = self._known.get(user.id)
+
+        if user_ctx is None:
+
+            return None
+
+        if time.monotonic() - user_ctx["ensured_at"] > self.ttl_seconds or user_ctx["identity"] != self._identity(user):
+
+            return None
+
+        self._known.move_to_end(user.id)
+
+        return user_ctx
+
+    async def ensure(self, user: types.User) -> Dict[str, Any]:
+
+        user_ctx = self._get_fresh(user)
+
+        if user_ctx is not None:
+
+            self.skipped += 1
+
+            return user_ctx
+
+        pending = self._in_flight.get(user.id)
+
+        if pending is not None:
+
+            self.skipped += 1
+
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+
+        self._in_flight[user.id] = future
+
+        try:
+
+            await db.ensure_user(user.id, user.username, user.first_name, user.last_name)
+
+            self.upserts += 1
+
+            user_ctx = {
+
+                "user_id": user.id,
+
+                "username": user.username,
+
+                "first_name": user.first_name,
+
+                "last_name": user.last_name,
+
+                "identity": self._identity(user),
+
+                "ensured_at": time.monotonic()
+
+            }
+
+            self._known[user.id] = user_ctx
+
+            self._known.move_to_end(user.id)
+
+            while len(self._known) > self.max_entries:
+
+                self._known.popitem(last=False)
+
+            future.set_result(user_ctx)
+
+            return user_ctx
+
+        except Exception as e:
+
+            future.set_exception(e)
+
+            future.exception()
+
+            raise
+
+        finally:
+
+            self._in_flight.pop(user.id, None)
+
+    def stats(self) -> Dict[str, Any]:
+
+        return {"size": len(self._known), "max_size": self.max_entries, "upserts": self.upserts, "skipped": self.skipped}
@@ -0,0 +1,550 @@
+import asyncio
+
+import logging
+
+import time
+
+from pathlib import Path
+
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+LEGACY_PROFILES_DB_FILE = Path("profiles.db")
+
+LEGACY_DIALOG_HISTORY_SLOTS = 20
+
+BACKFILL_START_KEY = -(2 ** 63)
+
+ANALYTICS_ROLLUP_BACKFILL = "analytics_rollups"
+
+ANALYTICS_TOTALS_UPSERT = '''
+    INSERT INTO analytics_user_totals (user_id, interactions, last_mode, last_ts) VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        interactions = interactions + excluded.interactions,
+        last_mode = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last_mode ELSE last_mode END,
+        last_ts = MAX(last_ts, excluded.last_ts)
+'''
+
+WriteStatement = Tuple[str, Any, bool]
+
+class Migration:
+
+    def __init__(self, version: int, name: str, apply: Callable[[aiosqlite.Connection], Awaitable[None]]):
+
+        self.version = version
+
+        self.name = name
+
+        self.apply = apply
+
+class Backfill:
+
+    def __init__(self, name: str, plan_chunk: Callable[[aiosqlite.Connection, int, int], Awaitable[Tuple[List[WriteStatement], Optional[int]]]]):
+
+        self.name = name
+
+        self.plan_chunk = plan_chunk
+
+async def _ensure_column(db: aiosqlite.Connection, table: str, column: str, declaration: str):
+
+    async with db.execute(f'PRAGMA table_info({table})') as cursor:
+
+        columns = {row[1] for row in await cursor.fetchall()}
+
+    if column not in columns:
+
+        await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+        logger.info(f"Added column {table}.{column}.")
+
+async def _m001_initial_schema(db: aiosqlite.Connection):
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT NOT NULL,
+            last_active_ts REAL DEFAULT 0
+        )
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS value_subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            subscribed_ts REAL NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS dialog_history (
+            history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            mode TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('user', 'assistant')), -- Добавим роль для явности
+            content TEXT NOT NULL, -- Одно поле для контента
+            -- user_message TEXT NOT NULL, -- Устарело, используем role и content
+            -- bot_response TEXT NOT NULL, -- Устарело, используем role и content
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_dialog_history_user_ts ON dialog_history (user_id, timestamp DESC)
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_modes (
+            user_id INTEGER PRIMARY KEY,
+            mode TEXT NOT NULL DEFAULT 'saharoza', -- Добавим DEFAULT
+            rating_opportunities_count INTEGER DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_interactions (
+            interaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            mode TEXT NOT NULL, -- Режим во время взаимодействия
+            action_type TEXT NOT NULL DEFAULT 'message', -- Тип действия (message, command, callback, etc.)
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    await db.execute('''
+        CREATE INDEX IF NOT EXISTS idx_interactions_user_ts_mode ON analytics_interactions (user_id, timestamp DESC, mode)
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_ratings (
+            rating_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            rated_message_id INTEGER, -- Опционально: ID сообщения бота, которое оценили
+            dialog_history_id INTEGER, -- Опционально: ссылка на запись в dialog_history (если оценка относится к конкретному ответу)
+            timestamp REAL NOT NULL,
+            rating INTEGER NOT NULL CHECK(rating IN (0, 1)), -- 0 для дизлайка, 1 для лайка
+            message_preview TEXT, -- Превью сообщения, к которому относится оценка
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+            FOREIGN KEY(dialog_history_id) REFERENCES dialog_history(history_id) ON DELETE SET NULL
+        )
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS rp_user_stats (
+            user_id INTEGER PRIMARY KEY,
+            hp INTEGER NOT NULL DEFAULT 100,
+            heal_cooldown_ts REAL NOT NULL DEFAULT 0,
+            recovery_end_ts REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_progress (
+            name TEXT PRIMARY KEY,
+            last_key INTEGER,
+            target_key INTEGER, -- верхняя граница ключа, если бэкфилл ограничен снимком на момент миграции
+            done INTEGER NOT NULL DEFAULT 0,
+            chunks INTEGER NOT NULL DEFAULT 0,
+            updated_ts REAL NOT NULL
+        )
+    ''')
+
+async def _m002_dialog_ring(db: aiosqlite.Connection):
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS dialog_ring (
+            user_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL, -- seq % 20, старые записи перезаписываются
+            seq INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            mode TEXT NOT NULL,
+            role TEXT NOT NULL CHECK(role IN ('user', 'assistant')),
+            content TEXT NOT NULL,
+            PRIMARY KEY (user_id, slot),
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+
+    async with db.execute('SELECT EXISTS(SELECT 1 FROM dialog_ring)') as cursor:
+
+        if (await cursor.fetchone())[0]:
+
+            return
+
+    async with db.execute('SELECT COUNT(*) FROM dialog_history') as cursor:
+
+        legacy_rows = (await cursor.fetchone())[0]
+
+    if not legacy_rows:
+
+        return
+
+    await db.execute('''
+        INSERT OR IGNORE INTO dialog_ring (user_id, slot, seq, timestamp, mode, role, content)
+        SELECT user_id, ? - rn, ? - rn, timestamp, mode, role, content FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC, history_id DESC) AS rn
+            FROM dialog_history
+        ) WHERE rn <= ?
+    ''', (LEGACY_DIALOG_HISTORY_SLOTS, LEGACY_DIALOG_HISTORY_SLOTS, LEGACY_DIALOG_HISTORY_SLOTS))
+
+    await db.execute('DELETE FROM dialog_history')
+
+    logger.info(f"Imported {legacy_rows} legacy dialog_history rows into dialog_ring.")
+
+async def _m003_unified_profiles(db: aiosqlite.Connection):
+
+    await _ensure_column(db, "users", "last_name", "TEXT")
+
+    await _ensure_column(db, "users", "created_ts", "REAL DEFAULT 0")
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_profiles (
+            user_id INTEGER PRIMARY KEY,
+            level INTEGER NOT NULL DEFAULT 1 CHECK(level >= 1 AND level <= 169),
+            exp INTEGER NOT NULL DEFAULT 0,
+            lumcoins INTEGER NOT NULL DEFAULT 0,
+            daily_messages INTEGER NOT NULL DEFAULT 0,
+            total_messages INTEGER NOT NULL DEFAULT 0,
+            flames INTEGER NOT NULL DEFAULT 0,
+            background_url TEXT, -- NULL = фон по умолчанию
+            last_work_time REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    if not LEGACY_PROFILES_DB_FILE.exists():
+
+        return
+
+    logger.info(f"Importing legacy profiles database {LEGACY_PROFILES_DB_FILE}...")
+
+    await db.commit()
+
+    await db.execute('ATTACH DATABASE ? AS legacy', (str(LEGACY_PROFILES_DB_FILE),))
+
+    try:
+
+        async with db.execute("SELECT name FROM legacy.sqlite_master WHERE type = 'table'") as cursor:
+
+            legacy_tables = {row[0] for row in await cursor.fetchall()}
+
+        if "users" in legacy_tables:
+
+            await db.execute('''
+                INSERT INTO users (user_id, username, first_name, last_name)
+                SELECT user_id, username, COALESCE(first_name, ''), last_name FROM legacy.users WHERE user_id IS NOT NULL
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = COALESCE(users.username, excluded.username),
+                    last_name = COALESCE(users.last_name, excluded.last_name)
+            ''')
+
+        if "user_profiles" in legacy_tables:
+
+            background_source = "COALESCE(b.background_url, p.background_url)" if "backgrounds" in legacy_tables else "p.background_url"
+
+            background_join = "LEFT JOIN legacy.backgrounds b ON b.user_id = p.user_id" if "backgrounds" in legacy_tables else ""
+
+            async with db.execute("PRAGMA legacy.table_info(user_profiles)") as cursor:
+
+                legacy_columns = {row[1] for row in await cursor.fetchall()}
+
+            last_work_source = "COALESCE(p.last_work_time, 0)" if "last_work_time" in legacy_columns else "0"
+
+            await db.execute('''
+                INSERT OR IGNORE INTO users (user_id, first_name)
+                SELECT user_id, '' FROM legacy.user_profiles WHERE user_id IS NOT NULL
+            ''')
+
+            await db.execute(f'''
+                INSERT OR IGNORE INTO user_profiles (user_id, level, exp, lumcoins, daily_messages, total_messages, flames, background_url, last_work_time)
+                SELECT p.user_id, p.level, p.exp, p.lumcoins, p.daily_messages, p.total_messages, p.flames, {background_source}, {last_work_source}
+                FROM legacy.user_profiles p {background_join}
+                WHERE p.user_id IS NOT NULL
+            ''')
+
+            await db.execute('''
+                INSERT OR IGNORE INTO rp_user_stats (user_id, hp)
+                SELECT user_id, hp FROM legacy.user_profiles WHERE user_id IS NOT NULL AND hp IS NOT NULL
+            ''')
+
+        await db.commit()
+
+    except Exception:
+
+        await db.rollback()
+
+        raise
+
+    finally:
+
+        await db.execute('DETACH DATABASE legacy')
+
+    migrated_path = LEGACY_PROFILES_DB_FILE.with_name(LEGACY_PROFILES_DB_FILE.name + ".migrated")
+
+    LEGACY_PROFILES_DB_FILE.replace(migrated_path)
+
+    logger.info(f"Legacy profiles imported, old file moved to {migrated_path}.")
+
+async def _m004_analytics_rollups(db: aiosqlite.Connection):
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_daily_rollup (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL, -- дни с 1970-01-01 (UTC)
+            mode TEXT NOT NULL,
+            interactions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, mode)
+        ) WITHOUT ROWID
+    ''')
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_user_totals (
+            user_id INTEGER PRIMARY KEY,
+            interactions INTEGER NOT NULL DEFAULT 0,
+            last_mode TEXT,
+            last_ts REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+    async with db.execute('SELECT COALESCE(MAX(interaction_id), 0) FROM analytics_interactions') as cursor:
+
+        target_key = (await cursor.fetchone())[0]
+
+    await db.execute('''
+        INSERT OR IGNORE INTO backfill_progress (name, last_key, target_key, done, updated_ts) VALUES (?, 0, ?, ?, ?)
+    ''', (ANALYTICS_ROLLUP_BACKFILL, target_key, int(target_key == 0), time.time()))
+
+async def _m005_dialog_summaries(db: aiosqlite.Connection):
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS dialog_summaries (
+            user_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_seq INTEGER NOT NULL, -- последний seq из dialog_ring, вошедший в сводку
+            mode TEXT,
+            updated_ts REAL NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        )
+    ''')
+
+async def _m006_broadcast_jobs(db: aiosqlite.Connection):
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            kind TEXT PRIMARY KEY, -- одна актуальная рассылка на тип, новая вытесняет старую
+            payload TEXT NOT NULL,
+            cursor_user_id INTEGER NOT NULL DEFAULT 0, -- последний user_id из завершённого окна
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            pruned INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_ts REAL NOT NULL,
+            updated_ts REAL NOT NULL
+        )
+    ''')
+
+async def _plan_analytics_rollups(db: aiosqlite.Connection, last_key: int, chunk_size: int) -> Tuple[List[WriteStatement], Optional[int]]:
+
+    async with db.execute('SELECT target_key FROM backfill_progress WHERE name = ?', (ANALYTICS_ROLLUP_BACKFILL,)) as cursor:
+
+        row = await cursor.fetchone()
+
+    target_key = row[0] if row and row[0] is not None else 0
+
+    lower_key = max(last_key, 0)
+
+    if lower_key >= target_key:
+
+        return [], None
+
+    upper_key = min(lower_key + chunk_size, target_key)
+
+    async with db.execute('''
+        SELECT user_id, COUNT(*), mode, MAX(timestamp) FROM analytics_interactions
+        WHERE interaction_id > ? AND interaction_id <= ?
+        GROUP BY user_id
+    ''', (lower_key, upper_key)) as cursor:
+
+        totals = await cursor.fetchall()
+
+    statements: List[WriteStatement] = [('''
+        INSERT INTO analytics_daily_rollup (user_id, day, mode, interactions)
+        SELECT user_id, CAST(timestamp / 86400 AS INTEGER), mode, COUNT(*) FROM analytics_interactions
+        WHERE interaction_id > ? AND interaction_id <= ?
+        GROUP BY 1, 2, 3
+        ON CONFLICT(user_id, day, mode) DO UPDATE SET interactions = interactions + excluded.interactions
+    ''', (lower_key, upper_key), False)]
+
+    if totals:
+
+        statements.append((ANALYTICS_TOTALS_UPSERT, [tuple(row) for row in totals], True))
+
+    return statements, upper_key
+
+async def _plan_users_created_ts(db: aiosqlite.Connection, last_key: int, chunk_size: int) -> Tuple[List[WriteStatement], Optional[int]]:
+
+    async with db.execute('SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (last_key, chunk_size)) as cursor:
+
+        rows = await cursor.fetchall()
+
+    if not rows:
+
+        return [], None
+
+    upper_key = rows[-1][0]
+
+    return [('''
+        UPDATE users SET created_ts = last_active_ts
+        WHERE user_id > ? AND user_id <= ? AND (created_ts IS NULL OR created_ts = 0) AND last_active_ts > 0
+    ''', (last_key, upper_key), False)], upper_key
+
+MIGRATIONS: List[Migration] = [
+
+    Migration(1, "initial_schema", _m001_initial_schema),
+
+    Migration(2, "dialog_ring", _m002_dialog_ring),
+
+    Migration(3, "unified_profiles", _m003_unified_profiles),
+
+    Migration(4, "analytics_rollups", _m004_analytics_rollups),
+
+    Migration(5, "dialog_summaries", _m005_dialog_summaries),
+
+    Migration(6, "broadcast_jobs", _m006_broadcast_jobs),
+
+]
+
+BACKFILLS: List[Backfill] = [
+
+    Backfill("users_created_ts", _plan_users_created_ts),
+
+    Backfill(ANALYTICS_ROLLUP_BACKFILL, _plan_analytics_rollups),
+
+]
+
+async def _ensure_migration_tables(db: aiosqlite.Connection):
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_ts REAL NOT NULL
+        )
+    ''')
+
+    await db.commit()
+
+async def is_backfill_done(db: aiosqlite.Connection, name: str) -> bool:
+
+    async with db.execute('SELECT done FROM backfill_progress WHERE name = ?', (name,)) as cursor:
+
+        row = await cursor.fetchone()
+
+    return bool(row and row[0])
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+
+    async with db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations') as cursor:
+
+        return (await cursor.fetchone())[0]
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+
+    await _ensure_migration_tables(db)
+
+    current_version = await get_schema_version(db)
+
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+
+        if migration.version <= current_version:
+
+            continue
+
+        logger.info(f"Applying migration {migration.version:03d}_{migration.name}...")
+
+        started = time.monotonic()
+
+        try:
+
+            await migration.apply(db)
+
+            await db.execute(
+
+                'INSERT INTO schema_migrations (version, name, applied_ts) VALUES (?, ?, ?)',
+
+                (migration.version, migration.name, time.time())
+
+            )
+
+            await db.commit()
+
+        except Exception:
+
+            await db.rollback()
+
+            logger.critical(f"Migration {migration.version:03d}_{migration.name} failed, schema stays at version {current_version}.")
+
+            raise
+
+        current_version = migration.version
+
+        logger.info(f"Migration {migration.version:03d}_{migration.name} applied in {time.monotonic() - started:.2f}s.")
+
+    return current_version
+
+async def run_backfills(pool: Any, chunk_size: int, pause_seconds: float):
+
+    for backfill in BACKFILLS:
+
+        async with pool.reader() as db:
+
+            async with db.execute('SELECT last_key, done, chunks FROM backfill_progress WHERE name = ?', (backfill.name,)) as cursor:
+
+                row = await cursor.fetchone()
+
+        if row and row[1]:
+
+            continue
+
+        last_key = row[0] if row and row[0] is not None else BACKFILL_START_KEY
+
+        chunks = row[2] if row else 0
+
+        logger.info(f"Backfill '{backfill.name}' started from key {last_key}.")
+
+        while True:
+
+            async with pool.reader() as db:
+
+                statements, next_key = await backfill.plan_chunk(db, last_key, chunk_size)
+
+            chunks += 1
+
+            statements.append(('''
+                INSERT INTO backfill_progress (name, last_key, done, chunks, updated_ts) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    last_key = excluded.last_key,
+                    done = excluded.done,
+                    chunks = excluded.chunks,
+                    updated_ts = excluded.updated_ts
+            ''', (backfill.name, last_key if next_key is None else next_key, int(next_key is None), chunks, time.time()), False))
+
+            await pool.write_batch(statements, name=f"backfill.{backfill.name}")
+
+            if next_key is None:
+
+                break
+
+            last_key = next_key
+
+            await asyncio.sleep(pause_seconds)
+
+        logger.info(f"Backfill '{backfill.name}' finished after {chunks} chunks.")
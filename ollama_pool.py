@@ -0,0 +1,305 @@
+import asyncio
+
+import os
+
+import time
+
+import logging
+
+from contextlib import suppress
+
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+import httpx
+
+import ollama
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_HOSTS = os.getenv("OLLAMA_HOSTS", "")
+
+OLLAMA_PROBE_INTERVAL_SECONDS = max(1.0, float(os.getenv("OLLAMA_PROBE_INTERVAL_SECONDS", "15")))
+
+OLLAMA_PROBE_TIMEOUT_SECONDS = max(0.5, float(os.getenv("OLLAMA_PROBE_TIMEOUT_SECONDS", "5")))
+
+def parse_hosts(spec: str) -> List[Optional[str]]:
+
+    hosts = [host.strip() for host in spec.split(",") if host.strip()]
+
+    return hosts or [os.getenv("OLLAMA_HOST") or None]
+
+def normalize_model(name: str) -> str:
+
+    return name if ":" in name else f"{name}:latest"
+
+class NoBackendAvailable(RuntimeError):
+
+    pass
+
+class OllamaBackend:
+
+    def __init__(self, host: Optional[str], client: ollama.AsyncClient):
+
+        self.host = host or "default"
+
+        self.client = client
+
+        self.healthy = True
+
+        self.models: Optional[Set[str]] = None
+
+        self.outstanding = 0
+
+        self.requests = 0
+
+        self.failures = 0
+
+        self.last_probe_ts = 0.0
+
+        self.last_error: Optional[str] = None
+
+    def serves(self, model: str) -> bool:
+
+        return self.models is None or normalize_model(model) in self.models
+
+    def mark_down(self, error: BaseException):
+
+        if self.healthy:
+
+            logger.warning(f"Ollama backend {self.host} marked unhealthy: {error}")
+
+        self.healthy = False
+
+        self.last_error = str(error)
+
+class OllamaBackendPool:
+
+    def __init__(
+
+        self,
+
+        hosts: List[Optional[str]],
+
+        client_factory: Callable[[Optional[str]], ollama.AsyncClient],
+
+        probe_interval: float = OLLAMA_PROBE_INTERVAL_SECONDS,
+
+        on_probe: Optional[Callable[["OllamaBackendPool"], None]] = None
+
+    ):
+
+        self.backends = [OllamaBackend(host, client_factory(host)) for host in hosts]
+
+        self.probe_interval = probe_interval
+
+        self.on_probe = on_probe
+
+        self._probe_task: Optional[asyncio.Task] = None
+
+        self._rotation = 0
+
+    def start(self):
+
+        if self._probe_task is None or self._probe_task.done():
+
+            self._probe_task = asyncio.create_task(self._probe_periodically(), name="ollama_probe")
+
+    async def close(self):
+
+        if self._probe_task is not None:
+
+            self._probe_task.cancel()
+
+            with suppress(asyncio.CancelledError):
+
+                await self._probe_task
+
+            self._probe_task = None
+
+        for backend in self.backends:
+
+            try:
+
+                await backend.client.close()
+
+            except Exception as e:
+
+                logger.error(f"Error closing Ollama client for {backend.host}: {e}", exc_info=True)
+
+    async def _probe_periodically(self):
+
+        while True:
+
+            await self.probe_all()
+
+            await asyncio.sleep(self.probe_interval)
+
+    async def probe_all(self):
+
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends))
+
+        if self.on_probe is not None:
+
+            try:
+
+                self.on_probe(self)
+
+            except Exception as e:
+
+                logger.error(f"Ollama probe callback failed: {e}", exc_info=True)
+
+    async def _probe(self, backend: OllamaBackend):
+
+        try:
+
+            response = await asyncio.wait_for(backend.client.list(), OLLAMA_PROBE_TIMEOUT_SECONDS)
+
+            backend.models = {normalize_model(item.model) for item in response.models if item.model}
+
+            if not backend.healthy:
+
+                logger.info(f"Ollama backend {backend.host} is healthy again ({len(backend.models)} models).")
+
+            backend.healthy = True
+
+            backend.last_error = None
+
+        except Exception as e:
+
+            backend.mark_down(e)
+
+        backend.last_probe_ts = time.time()
+
+    def _candidates(self, model: str) -> List[OllamaBackend]:
+
+        self._rotation += 1
+
+        count = len(self.backends)
+
+        ordered = [self.backends[(self._rotation + offset) % count] for offset in range(count)]
+
+        return sorted(ordered, key=lambda backend: (not backend.healthy, not backend.serves(model), backend.outstanding))
+
+    def _handle_failure(self, backend: OllamaBackend, model: str, error: BaseException):
+
+        backend.failures += 1
+
+        if isinstance(error, ollama.ResponseError):
+
+            if error.status_code == 404 and backend.models is not None:
+
+                backend.models.discard(normalize_model(model))
+
+            elif error.status_code >= 500:
+
+                backend.mark_down(error)
+
+        else:
+
+            backend.mark_down(error)
+
+        logger.warning(f"Ollama backend {backend.host} failed for model '{model}', failing over: {error}")
+
+    async def call(self, method: str, model: str, **kwargs) -> Any:
+
+        last_error: Optional[BaseException] = None
+
+        for backend in self._candidates(model):
+
+            backend.outstanding += 1
+
+            backend.requests += 1
+
+            try:
+
+                return await getattr(backend.client, method)(model=model, **kwargs)
+
+            except (ollama.ResponseError, httpx.TransportError, ConnectionError) as e:
+
+                self._handle_failure(backend, model, e)
+
+                last_error = e
+
+            finally:
+
+                backend.outstanding -= 1
+
+        raise last_error or NoBackendAvailable("No Ollama backends configured.")
+
+    async def chat(self, model: str, **kwargs) -> Any:
+
+        return await self.call("chat", model, **kwargs)
+
+    async def generate(self, model: str, **kwargs) -> Any:
+
+        return await self.call("generate", model, **kwargs)
+
+    async def chat_stream(self, model: str, **kwargs) -> AsyncIterator[Any]:
+
+        last_error: Optional[BaseException] = None
+
+        for backend in self._candidates(model):
+
+            backend.outstanding += 1
+
+            backend.requests += 1
+
+            started = False
+
+            try:
+
+                async for chunk in await backend.client.chat(model=model, stream=True, **kwargs):
+
+                    started = True
+
+                    yield chunk
+
+                return
+
+            except (ollama.ResponseError, httpx.TransportError, ConnectionError) as e:
+
+                if started:
+
+                    backend.mark_down(e)
+
+                    raise
+
+                self._handle_failure(backend, model, e)
+
+                last_error = e
+
+            finally:
+
+                backend.outstanding -= 1
+
+        raise last_error or NoBackendAvailable("No Ollama backends configured.")
+
+    def backends_for(self, model: str) -> List[OllamaBackend]:
+
+        return [backend for backend in self.backends if backend.healthy and backend.serves(model)]
+
+    def stats(self) -> List[Dict[str, Any]]:
+
+        return [
+
+            {
+
+                "host": backend.host,
+
+                "healthy": backend.healthy,
+
+                "models": sorted(backend.models) if backend.models is not None else None,
+
+                "outstanding": backend.outstanding,
+
+                "requests": backend.requests,
+
+                "failures": backend.failures,
+
+                "last_error": backend.last_error
+
+            }
+
+            for backend in self.backends
+
+        ]
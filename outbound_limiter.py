@@ -0,0 +1,413 @@
+import asyncio
+
+import heapq
+
+import itertools
+
+import os
+
+import time
+
+import logging
+
+from contextlib import suppress
+
+from contextvars import ContextVar
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from aiogram.methods import (
+
+    CopyMessage,
+
+    EditMessageCaption,
+
+    EditMessageMedia,
+
+    EditMessageReplyMarkup,
+
+    EditMessageText,
+
+    ForwardMessage,
+
+    SendAnimation,
+
+    SendAudio,
+
+    SendDice,
+
+    SendDocument,
+
+    SendLocation,
+
+    SendMediaGroup,
+
+    SendMessage,
+
+    SendPhoto,
+
+    SendPoll,
+
+    SendSticker,
+
+    SendVideo,
+
+    SendVoice,
+
+    TelegramMethod
+
+)
+
+from cache_utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_GLOBAL_RATE = max(1.0, float(os.getenv("OUTBOUND_GLOBAL_RATE", "30")))
+
+OUTBOUND_GLOBAL_BURST = max(1, int(os.getenv("OUTBOUND_GLOBAL_BURST", "30")))
+
+OUTBOUND_PRIVATE_RATE = max(0.01, float(os.getenv("OUTBOUND_PRIVATE_RATE", "1")))
+
+OUTBOUND_PRIVATE_BURST = max(1, int(os.getenv("OUTBOUND_PRIVATE_BURST", "3")))
+
+OUTBOUND_GROUP_RATE = max(0.01, float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20")) / 60)
+
+OUTBOUND_GROUP_BURST = max(1, int(os.getenv("OUTBOUND_GROUP_BURST", "3")))
+
+OUTBOUND_CHAT_BUCKETS = max(1, int(os.getenv("OUTBOUND_CHAT_BUCKETS", "10000")))
+
+OUTBOUND_MAX_RETRIES = max(0, int(os.getenv("OUTBOUND_MAX_RETRIES", "2")))
+
+OUTBOUND_MAX_RETRY_AFTER_SECONDS = max(1, int(os.getenv("OUTBOUND_MAX_RETRY_AFTER_SECONDS", "60")))
+
+PRIORITY_INTERACTIVE = 0
+
+PRIORITY_BULK = 1
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+THROTTLED_METHODS = (
+
+    CopyMessage,
+
+    EditMessageCaption,
+
+    EditMessageMedia,
+
+    EditMessageReplyMarkup,
+
+    EditMessageText,
+
+    ForwardMessage,
+
+    SendAnimation,
+
+    SendAudio,
+
+    SendDice,
+
+    SendDocument,
+
+    SendLocation,
+
+    SendMediaGroup,
+
+    SendMessage,
+
+    SendPhoto,
+
+    SendPoll,
+
+    SendSticker,
+
+    SendVideo,
+
+    SendVoice
+
+)
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: int):
+
+        self.rate = rate
+
+        self.capacity = capacity
+
+        self.tokens = float(capacity)
+
+        self.updated = time.monotonic()
+
+    def _refill(self):
+
+        now = time.monotonic()
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+
+        self.updated = now
+
+    def reserve(self) -> float:
+
+        self._refill()
+
+        self.tokens -= 1
+
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self) -> bool:
+
+        self._refill()
+
+        if self.tokens < 1:
+
+            return False
+
+        self.tokens -= 1
+
+        return True
+
+    def refund(self):
+
+        self._refill()
+
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def wait_time(self) -> float:
+
+        self._refill()
+
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def penalize(self, seconds: float):
+
+        self._refill()
+
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class OutboundLimiter(BaseRequestMiddleware):
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE, global_burst: int = OUTBOUND_GLOBAL_BURST, max_retries: int = OUTBOUND_MAX_RETRIES):
+
+        self.max_retries = max_retries
+
+        self.global_rate = global_rate
+
+        self.global_burst = global_burst
+
+        self._global = TokenBucket(global_rate, global_burst)
+
+        self._chats = LRUCache(OUTBOUND_CHAT_BUCKETS)
+
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+
+        self._sequence = itertools.count()
+
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self._waiting: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+
+        self.peak_waiting = 0
+
+        self.sent = 0
+
+        self.delayed = 0
+
+        self.retry_after_hits = 0
+
+        self.cancelled = 0
+
+        self.max_wait = 0.0
+
+    def share_between(self, workers: int):
+
+        workers = max(1, workers)
+
+        self._global = TokenBucket(self.global_rate / workers, max(1, self.global_burst // workers))
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Any, method: TelegramMethod) -> Any:
+
+        chat_id = getattr(method, "chat_id", None)
+
+        throttled = chat_id is not None and isinstance(method, THROTTLED_METHODS)
+
+        attempt = 0
+
+        while True:
+
+            if throttled:
+
+                await self._acquire(chat_id, outbound_priority.get())
+
+            try:
+
+                return await make_request(bot, method)
+
+            except TelegramRetryAfter as e:
+
+                self.retry_after_hits += 1
+
+                if chat_id is not None:
+
+                    self._bucket(chat_id).penalize(e.retry_after)
+
+                if not throttled or attempt >= self.max_retries or e.retry_after > OUTBOUND_MAX_RETRY_AFTER_SECONDS:
+
+                    raise
+
+                attempt += 1
+
+                logger.warning(f"Telegram flood control on {type(method).__name__} to chat {chat_id}: retrying after {e.retry_after}s (attempt {attempt}/{self.max_retries}).")
+
+    def chat_ready(self, chat_id: Any) -> bool:
+
+        bucket = self._chats.peek(chat_id)
+
+        return (bucket is None or bucket.wait_time() == 0) and not self._waiters and self._global.wait_time() == 0
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+
+        bucket = self._chats.peek(chat_id)
+
+        if bucket is None:
+
+            if isinstance(chat_id, int) and chat_id > 0:
+
+                bucket = TokenBucket(OUTBOUND_PRIVATE_RATE, OUTBOUND_PRIVATE_BURST)
+
+            else:
+
+                bucket = TokenBucket(OUTBOUND_GROUP_RATE, OUTBOUND_GROUP_BURST)
+
+        self._chats.set(chat_id, bucket)
+
+        return bucket
+
+    async def _acquire(self, chat_id: Any, priority: int):
+
+        started = time.monotonic()
+
+        self._waiting[priority] = self._waiting.get(priority, 0) + 1
+
+        self.peak_waiting = max(self.peak_waiting, sum(self._waiting.values()))
+
+        bucket = self._bucket(chat_id)
+
+        try:
+
+            delay = bucket.reserve()
+
+            if delay > 0:
+
+                await asyncio.sleep(delay)
+
+            if self._waiters or not self._global.try_take():
+
+                future = asyncio.get_running_loop().create_future()
+
+                heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+
+                if self._dispatcher is None or self._dispatcher.done():
+
+                    self._dispatcher = asyncio.create_task(self._dispatch(), name="outbound_dispatcher")
+
+                try:
+
+                    await future
+
+                except asyncio.CancelledError:
+
+                    if future.done() and not future.cancelled():
+
+                        self._global.refund()
+
+                    raise
+
+        except asyncio.CancelledError:
+
+            bucket.refund()
+
+            self.cancelled += 1
+
+            raise
+
+        finally:
+
+            self._waiting[priority] -= 1
+
+        waited = time.monotonic() - started
+
+        self.sent += 1
+
+        if waited > 0.001:
+
+            self.delayed += 1
+
+            self.max_wait = max(self.max_wait, waited)
+
+    async def _dispatch(self):
+
+        while self._waiters:
+
+            delay = self._global.wait_time()
+
+            if delay > 0:
+
+                await asyncio.sleep(delay)
+
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+
+            if future.done():
+
+                continue
+
+            self._global.try_take()
+
+            future.set_result(None)
+
+    async def close(self):
+
+        if self._dispatcher is not None:
+
+            self._dispatcher.cancel()
+
+            with suppress(asyncio.CancelledError):
+
+                await self._dispatcher
+
+        for _, _, future in self._waiters:
+
+            if not future.done():
+
+                future.cancel()
+
+        self._waiters.clear()
+
+    def stats(self) -> Dict[str, Any]:
+
+        return {
+
+            "waiting": {PRIORITY_NAMES.get(priority, str(priority)): count for priority, count in self._waiting.items()},
+
+            "peak_waiting": self.peak_waiting,
+
+            "sent": self.sent,
+
+            "delayed": self.delayed,
+
+            "retry_after": self.retry_after_hits,
+
+            "cancelled": self.cancelled,
+
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+
+            "chats": len(self._chats)
+
+        }
@@ -0,0 +1,99 @@
+import math
+
+import os
+
+from typing import Any, Dict, List, Optional, Tuple
+
+PROMPT_CHARS_PER_TOKEN = max(1.0, float(os.getenv("PROMPT_CHARS_PER_TOKEN", "2.5")))
+
+PROMPT_MESSAGE_OVERHEAD_TOKENS = max(0, int(os.getenv("PROMPT_MESSAGE_OVERHEAD_TOKENS", "4")))
+
+TRUNCATION_MARK = "\n…\n"
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части диалога:\n"
+
+def estimate_tokens(text: str) -> int:
+
+    return math.ceil(len(text) / PROMPT_CHARS_PER_TOKEN) + PROMPT_MESSAGE_OVERHEAD_TOKENS
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+
+    max_chars = int((max_tokens - PROMPT_MESSAGE_OVERHEAD_TOKENS) * PROMPT_CHARS_PER_TOKEN) - len(TRUNCATION_MARK)
+
+    if len(text) <= max_chars + len(TRUNCATION_MARK):
+
+        return text
+
+    if max_chars <= 0:
+
+        return ""
+
+    head = max_chars // 2
+
+    return text[:head] + TRUNCATION_MARK + text[len(text) - (max_chars - head):]
+
+def build_messages(system_prompt: str, history_turns: List[Dict[str, str]], message_text: str, num_ctx: int, reply_tokens: int, summary: Optional[str] = None) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+
+    budget = max(0, num_ctx - reply_tokens)
+
+    system_tokens = estimate_tokens(system_prompt)
+
+    message_tokens = estimate_tokens(message_text)
+
+    if system_tokens + message_tokens > budget:
+
+        message_text = truncate_to_tokens(message_text, budget - system_tokens)
+
+        message_tokens = estimate_tokens(message_text)
+
+    used = system_tokens + message_tokens
+
+    summary_message = None
+
+    if summary:
+
+        summary_text = truncate_to_tokens(SUMMARY_PREFIX + summary, budget - used)
+
+        if summary_text:
+
+            summary_message = {"role": "system", "content": summary_text}
+
+            used += estimate_tokens(summary_text)
+
+    packed_turns: List[Tuple[str, str]] = []
+
+    for turn in reversed(history_turns):
+
+        user_text = turn.get("user") or ""
+
+        assistant_text = turn.get("assistant") or ""
+
+        if not user_text or not assistant_text:
+
+            continue
+
+        turn_tokens = estimate_tokens(user_text) + estimate_tokens(assistant_text)
+
+        if used + turn_tokens > budget:
+
+            break
+
+        packed_turns.append((user_text, assistant_text))
+
+        used += turn_tokens
+
+    messages = [{"role": "system", "content": system_prompt}]
+
+    if summary_message:
+
+        messages.append(summary_message)
+
+    for user_text, assistant_text in reversed(packed_turns):
+
+        messages.append({"role": "user", "content": user_text})
+
+        messages.append({"role": "assistant", "content": assistant_text})
+
+    messages.append({"role": "user", "content": message_text})
+
+    return messages, {"tokens": used, "budget": budget, "turns": len(packed_turns), "turns_available": len(history_turns), "summary": summary_message is not None}
@@ -0,0 +1,147 @@
+import os
+
+import re
+
+import time
+
+import logging
+
+from collections import deque
+
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DB_SLOW_QUERY_MS = max(0, int(os.getenv("DB_SLOW_QUERY_MS", "100")))
+
+DB_QUERY_STATS_SAMPLES = max(16, int(os.getenv("DB_QUERY_STATS_SAMPLES", "512")))
+
+SLOW_QUERY_PARAMS_PREVIEW = 300
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def statement_name(sql: str) -> str:
+
+    return _WHITESPACE_RE.sub(" ", sql).strip()[:80]
+
+def _preview(value: Any) -> str:
+
+    text = repr(value)
+
+    return text if len(text) <= SLOW_QUERY_PARAMS_PREVIEW else text[:SLOW_QUERY_PARAMS_PREVIEW] + "..."
+
+class _StatementStats:
+
+    __slots__ = ("count", "errors", "rows", "total_ms", "max_ms", "samples")
+
+    def __init__(self, samples: int):
+
+        self.count = 0
+
+        self.errors = 0
+
+        self.rows = 0
+
+        self.total_ms = 0.0
+
+        self.max_ms = 0.0
+
+        self.samples: Deque[float] = deque(maxlen=samples)
+
+class QueryStats:
+
+    def __init__(self, slow_query_ms: int = DB_SLOW_QUERY_MS, samples: int = DB_QUERY_STATS_SAMPLES):
+
+        self.slow_query_ms = slow_query_ms
+
+        self.samples = samples
+
+        self.slow_queries = 0
+
+        self.started_at = time.time()
+
+        self._statements: Dict[str, _StatementStats] = {}
+
+    def record(self, name: str, elapsed_ms: float, rows: int = 0, params: Any = None, error: Optional[BaseException] = None):
+
+        stats = self._statements.get(name)
+
+        if stats is None:
+
+            stats = self._statements[name] = _StatementStats(self.samples)
+
+        stats.count += 1
+
+        stats.rows += max(0, rows)
+
+        stats.total_ms += elapsed_ms
+
+        stats.samples.append(elapsed_ms)
+
+        if elapsed_ms > stats.max_ms:
+
+            stats.max_ms = elapsed_ms
+
+        if error is not None:
+
+            stats.errors += 1
+
+        if self.slow_query_ms and elapsed_ms >= self.slow_query_ms:
+
+            self.slow_queries += 1
+
+            logger.warning(f"Slow query '{name}': {elapsed_ms:.1f} ms, rows={rows}, params={_preview(params)}")
+
+    def reset(self):
+
+        self._statements.clear()
+
+        self.slow_queries = 0
+
+        self.started_at = time.time()
+
+    def summary(self, sort_by: str = "total_ms", limit: Optional[int] = None) -> List[Dict[str, Any]]:
+
+        result = []
+
+        for name, stats in self._statements.items():
+
+            samples = sorted(stats.samples)
+
+            result.append({
+
+                "name": name,
+
+                "count": stats.count,
+
+                "errors": stats.errors,
+
+                "rows": stats.rows,
+
+                "total_ms": round(stats.total_ms, 2),
+
+                "avg_ms": round(stats.total_ms / stats.count, 2),
+
+                "p50_ms": round(_percentile(samples, 50), 2),
+
+                "p95_ms": round(_percentile(samples, 95), 2),
+
+                "p99_ms": round(_percentile(samples, 99), 2),
+
+                "max_ms": round(stats.max_ms, 2)
+
+            })
+
+        result.sort(key=lambda item: item[sort_by], reverse=True)
+
+        return result[:limit] if limit else result
+
+def _percentile(sorted_samples: List[float], percent: float) -> float:
+
+    if not sorted_samples:
+
+        return 0.0
+
+    rank = max(1, -(-len(sorted_samples) * percent // 100))
+
+    return sorted_samples[int(rank) - 1]
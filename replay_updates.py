@@ -0,0 +1,95 @@
+import argparse
+
+import asyncio
+
+import json
+
+import time
+
+from pathlib import Path
+
+from typing import Any, Dict, List
+
+import aiohttp
+
+import dotenv
+
+dotenv.load_dotenv()
+
+from webhook_server import SECRET_HEADER, WEBHOOK_LISTEN_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+def load_updates(path: Path) -> List[Dict[str, Any]]:
+
+    text = path.read_text(encoding="utf-8").strip()
+
+    if text.startswith("["):
+
+        return json.loads(text)
+
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+async def post_update(session: aiohttp.ClientSession, url: str, headers: Dict[str, str], update: Dict[str, Any], slots: asyncio.Semaphore) -> float:
+
+    async with slots:
+
+        started = time.perf_counter()
+
+        async with session.post(url, json=update, headers=headers) as response:
+
+            if response.status != 200:
+
+                print(f"Update {update.get('update_id')}: HTTP {response.status} {await response.text()}")
+
+        return time.perf_counter() - started
+
+async def replay(args: argparse.Namespace):
+
+    updates = load_updates(Path(args.file))
+
+    if args.renumber:
+
+        base = int(time.time())
+
+        for index, update in enumerate(updates):
+
+            update["update_id"] = base + index
+
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+
+    slots = asyncio.Semaphore(args.concurrency)
+
+    started = time.perf_counter()
+
+    async with aiohttp.ClientSession() as session:
+
+        latencies = await asyncio.gather(*(post_update(session, args.url, headers, update, slots) for update in updates * args.repeat))
+
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    print(f"Posted {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s), p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms.")
+
+def main():
+
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates (JSON array or JSON lines) to the local webhook server.")
+
+    parser.add_argument("file")
+
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_LISTEN_PORT}{WEBHOOK_PATH}")
+
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+
+    parser.add_argument("--concurrency", type=int, default=10)
+
+    parser.add_argument("--repeat", type=int, default=1)
+
+    parser.add_argument("--renumber", action="store_true", help="assign fresh update_id values before sending")
+
+    args = parser.parse_args()
+
+    asyncio.run(replay(args))
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,147 @@
+import os
+
+import re
+
+import random
+
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache_utils import LRUCache
+
+RESPONSE_CACHE_MODES = {mode.strip() for mode in os.getenv("RESPONSE_CACHE_MODES", "saharoza,dedinside").split(",") if mode.strip()}
+
+RESPONSE_CACHE_SIZE = max(1, int(os.getenv("RESPONSE_CACHE_SIZE", "2000")))
+
+RESPONSE_CACHE_TTL_SECONDS = max(1, int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")))
+
+RESPONSE_CACHE_VARIANTS = max(1, int(os.getenv("RESPONSE_CACHE_VARIANTS", "3")))
+
+RESPONSE_CACHE_MAX_MESSAGE_CHARS = max(1, int(os.getenv("RESPONSE_CACHE_MAX_MESSAGE_CHARS", "40")))
+
+RESPONSE_CACHE_MAX_HISTORY_TURNS = max(0, int(os.getenv("RESPONSE_CACHE_MAX_HISTORY_TURNS", "1")))
+
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+_SPACES_RE = re.compile(r"\s+")
+
+def normalize_message(text: str) -> str:
+
+    text = text.lower().replace("ё", "е")
+
+    text = _NON_WORD_RE.sub(" ", text)
+
+    return _SPACES_RE.sub(" ", text).strip()
+
+class ResponseCache:
+
+    def __init__(
+
+        self,
+
+        modes: Optional[set] = None,
+
+        max_size: int = RESPONSE_CACHE_SIZE,
+
+        ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS,
+
+        variants: int = RESPONSE_CACHE_VARIANTS,
+
+        max_message_chars: int = RESPONSE_CACHE_MAX_MESSAGE_CHARS,
+
+        max_history_turns: int = RESPONSE_CACHE_MAX_HISTORY_TURNS
+
+    ):
+
+        self.modes = RESPONSE_CACHE_MODES if modes is None else modes
+
+        self.ttl_seconds = ttl_seconds
+
+        self.variants = variants
+
+        self.max_message_chars = max_message_chars
+
+        self.max_history_turns = max_history_turns
+
+        self.hits = 0
+
+        self.misses = 0
+
+        self._entries = LRUCache(max_size)
+
+    def make_key(self, mode: str, message_text: str, history_turns: List[Dict[str, str]], summary: Optional[str] = None) -> Optional[Tuple[str, str, Tuple[str, ...]]]:
+
+        if mode not in self.modes or summary or len(history_turns) > self.max_history_turns:
+
+            return None
+
+        normalized = normalize_message(message_text)
+
+        if not normalized or len(normalized) > self.max_message_chars:
+
+            return None
+
+        fingerprint = tuple(normalize_message(turn.get("user") or "")[:self.max_message_chars] for turn in history_turns)
+
+        return mode, normalized, fingerprint
+
+    def get(self, key: Optional[Tuple[str, str, Tuple[str, ...]]]) -> Optional[str]:
+
+        if key is None:
+
+            return None
+
+        entry = self._entries.peek(key)
+
+        if entry is not None and time.monotonic() > entry["expires_at"]:
+
+            self._entries.pop(key)
+
+            entry = None
+
+        if entry is None or len(entry["variants"]) < self.variants:
+
+            self.misses += 1
+
+            return None
+
+        self.hits += 1
+
+        self._entries.set(key, entry)
+
+        return random.choice(entry["variants"])
+
+    def put(self, key: Optional[Tuple[str, str, Tuple[str, ...]]], response_text: str):
+
+        if key is None or not response_text:
+
+            return
+
+        entry = self._entries.peek(key)
+
+        if entry is None or time.monotonic() > entry["expires_at"]:
+
+            entry = {"variants": [], "expires_at": time.monotonic() + self.ttl_seconds}
+
+        if response_text not in entry["variants"] and len(entry["variants"]) < self.variants:
+
+            entry["variants"].append(response_text)
+
+        self._entries.set(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+
+        lookups = self.hits + self.misses
+
+        return {
+
+            **self._entries.stats(),
+
+            "hits": self.hits,
+
+            "misses": self.misses,
+
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+
+        }
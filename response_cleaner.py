@@ -0,0 +1,202 @@
+import re
+
+from typing import Dict, List, Optional, Tuple
+
+TAG_MARKUP_RE = re.compile(r'<\/?[\w\s="/.\':?]+>')
+
+BRACKET_MARKUP_RE = re.compile(r'\[\/?[\w\s="/.\':?]+\]')
+
+THOUGHT_RE = re.compile(r'(^|\n)\s*Thought:.*', re.MULTILINE)
+
+PREAMBLE_RE = re.compile(r'^\s*Okay, here is the response.*?\n', re.IGNORECASE | re.MULTILINE)
+
+SELF_REFERENCE_RE = re.compile(r'(?i)(я (?:бот|программа|ии|модель))')
+
+AI_DISCLAIMER_RE = re.compile(r'(?i)(как (?:ии|искусственный интеллект|ai|language model))')
+
+MODE_PHRASE_RULES: Dict[str, Tuple["re.Pattern[str]", Tuple[str, ...]]] = {
+    "genius": (AI_DISCLAIMER_RE, ("как ии", "как искусственный", "как ai", "как language")),
+    "dedinside": (SELF_REFERENCE_RE, ("я бот", "я программа", "я ии", "я модель")),
+    "saharoza": (SELF_REFERENCE_RE, ("я бот", "я программа", "я ии", "я модель"))
+}
+
+MODE_ENDINGS: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "dedinside": (('?', '!', '...', '😏', '😈', '👀'), '... Ну че, как тебе такое? 😏'),
+    "saharoza": (('?', '!', '...', '🌸', '✨', '💔', '😉'), '... И что ты на это скажешь? 😉')
+}
+
+GENIUS_SHORT_ANSWER_WORDS = 15
+
+GENIUS_SHORT_ANSWER_NOTE = "\n\nЭто краткий ответ. Если нужно больше деталей - уточни вопрос."
+
+EMPTY_RESPONSE_FALLBACK = "Хм, не знаю, что ответить... Спроси что-нибудь еще?"
+
+class ResponseCleaner:
+
+    def __init__(self, mode: str):
+
+        self.mode = mode
+
+        self.phrase_re, self.phrase_markers = MODE_PHRASE_RULES.get(mode, (None, ()))
+
+    def clean_fragment(self, text: str) -> str:
+
+        if "<" in text:
+
+            text = TAG_MARKUP_RE.sub('', text)
+
+        if "[" in text:
+
+            text = BRACKET_MARKUP_RE.sub('', text)
+
+        if "Thought:" in text:
+
+            text = THOUGHT_RE.sub('', text)
+
+        lowered = text.lower()
+
+        if "okay, here is the response" in lowered:
+
+            text = PREAMBLE_RE.sub('', text)
+
+            lowered = text.lower()
+
+        if self.phrase_re is not None and any(marker in lowered for marker in self.phrase_markers):
+
+            text = self.phrase_re.sub('', text)
+
+        return text
+
+    def clean(self, text: str) -> str:
+
+        return self.finalize(self.clean_fragment(text))
+
+    def finalize(self, text: str) -> str:
+
+        if self.mode == "genius":
+
+            if text and len(text.split()) < GENIUS_SHORT_ANSWER_WORDS and not text.startswith("Ой,") and not text.startswith("Произошла"):
+
+                text += GENIUS_SHORT_ANSWER_NOTE
+
+        elif self.mode in MODE_ENDINGS:
+
+            endings, suffix = MODE_ENDINGS[self.mode]
+
+            if text and not any(c in text for c in endings): text += suffix
+
+        cleaned_text = text.strip()
+
+        return cleaned_text if cleaned_text else EMPTY_RESPONSE_FALLBACK
+
+_cleaners: Dict[str, ResponseCleaner] = {}
+
+def get_cleaner(mode: str) -> ResponseCleaner:
+
+    cleaner = _cleaners.get(mode)
+
+    if cleaner is None:
+
+        cleaner = _cleaners[mode] = ResponseCleaner(mode)
+
+    return cleaner
+
+class StreamCleaner:
+
+    HELD_PREFIXES = ("thought:", "okay, here is the response")
+
+    def __init__(self, mode: str):
+
+        self.mode = mode
+
+        self.cleaner = get_cleaner(mode)
+
+        self._chunks: List[str] = []
+
+        self._pending_parts: List[str] = []
+
+        self._pending_chars = 0
+
+        self._cleaned_lines: List[str] = []
+
+        self._cleaned_chars = 0
+
+        self._text: Optional[str] = None
+
+    @property
+    def raw_text(self) -> str:
+
+        return "".join(self._chunks)
+
+    @property
+    def length(self) -> int:
+
+        return self._cleaned_chars + self._pending_chars
+
+    def feed(self, delta: str) -> bool:
+
+        if not delta:
+
+            return False
+
+        self._chunks.append(delta)
+
+        self._text = None
+
+        if "\n" not in delta:
+
+            self._pending_parts.append(delta)
+
+            self._pending_chars += len(delta)
+
+            return True
+
+        head, tail = delta.rsplit("\n", 1)
+
+        complete = "".join(self._pending_parts) + head
+
+        self._pending_parts = [tail] if tail else []
+
+        self._pending_chars = len(tail)
+
+        for line in complete.split("\n"):
+
+            if not line.lstrip().startswith("Thought:"):
+
+                cleaned = self.cleaner.clean_fragment(line + "\n")
+
+                self._cleaned_lines.append(cleaned)
+
+                self._cleaned_chars += len(cleaned)
+
+        return True
+
+    def text(self) -> str:
+
+        if self._text is None:
+
+            self._text = ("".join(self._cleaned_lines) + self._clean_tail()).strip()
+
+        return self._text
+
+    def finish(self) -> str:
+
+        return self.cleaner.finalize("".join(self._cleaned_lines) + self.cleaner.clean_fragment("".join(self._pending_parts)))
+
+    def _clean_tail(self) -> str:
+
+        tail = "".join(self._pending_parts)
+
+        cut = max(tail.rfind("<"), tail.rfind("["))
+
+        if cut != -1 and tail.find(">" if tail[cut] == "<" else "]", cut) == -1:
+
+            tail = tail[:cut]
+
+        stripped = tail.strip().lower()
+
+        if stripped and any(prefix.startswith(stripped) or stripped.startswith(prefix) for prefix in self.HELD_PREFIXES):
+
+            return ""
+
+        return self.cleaner.clean_fragment(tail)
@@ -22,6 +22,8 @@ from contextlib import suppress
 
 import database as db
 
+from outbound_limiter import PRIORITY_BULK, outbound_priority
+
 try:
 
     from group_stat import ProfileManager
@@ -506,11 +508,11 @@ async def _process_rp_action(
 
     target_current_hp_before_action = target_initial_stats.get('hp', RPConfig.DEFAULT_HP)
 
-    if target_current_hp_before_action <= RPConfig.MIN_HP and
+    if (target_current_hp_before_action <= RPConfig.MIN_HP and
 
        hp_change_target_val < 0 and
 
-       command != "превратить":
+       command != "превратить"):
 
         await message.reply(f"{target_name} уже без сознания. Зачем же его мучить еще больше?", parse_mode=ParseMode.HTML)
 
@@ -742,6 +744,8 @@ async def periodic_hp_recovery_task(bot: Bot, profile_manager: ProfileManager, d
 
     logger.info("Periodic HP recovery task started.")
 
+    outbound_priority.set(PRIORITY_BULK)
+
     while True:
 
         await asyncio.sleep(60)
@@ -0,0 +1,725 @@
+import asyncio
+
+import multiprocessing
+
+import os
+
+import queue
+
+import signal
+
+import time
+
+import logging
+
+from contextlib import suppress
+
+from functools import partial
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+
+from aiogram.methods import GetUpdates, TelegramMethod
+
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+logger = logging.getLogger(__name__)
+
+SHARD_WORKERS = max(0, int(os.getenv("SHARD_WORKERS", "0")))
+
+SHARD_QUEUE_SIZE = max(1, int(os.getenv("SHARD_QUEUE_SIZE", "1000")))
+
+SHARD_WORKER_MAX_IN_FLIGHT = max(1, int(os.getenv("SHARD_WORKER_MAX_IN_FLIGHT", "32")))
+
+SHARD_CHAT_MAX_PENDING = max(1, int(os.getenv("SHARD_CHAT_MAX_PENDING", "50")))
+
+SHARD_FORWARD_RETRY_SECONDS = max(0.01, float(os.getenv("SHARD_FORWARD_RETRY_SECONDS", "0.05")))
+
+SHARD_HEARTBEAT_SECONDS = max(0.5, float(os.getenv("SHARD_HEARTBEAT_SECONDS", "2")))
+
+SHARD_HEARTBEAT_TIMEOUT_SECONDS = max(5.0, float(os.getenv("SHARD_HEARTBEAT_TIMEOUT_SECONDS", "60")))
+
+SHARD_MAX_RESTART_DELAY_SECONDS = max(1.0, float(os.getenv("SHARD_MAX_RESTART_DELAY_SECONDS", "60")))
+
+SHARD_SHUTDOWN_SECONDS = max(1.0, float(os.getenv("SHARD_SHUTDOWN_SECONDS", "20")))
+
+SHARD_STATUS_LOG_SECONDS = max(10.0, float(os.getenv("SHARD_STATUS_LOG_SECONDS", "300")))
+
+POLLING_TIMEOUT_SECONDS = 30
+
+POLLING_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+
+CHAT_UPDATE_FIELDS = (
+
+    "message",
+
+    "edited_message",
+
+    "channel_post",
+
+    "edited_channel_post",
+
+    "business_message",
+
+    "edited_business_message",
+
+    "message_reaction",
+
+    "message_reaction_count",
+
+    "my_chat_member",
+
+    "chat_member",
+
+    "chat_join_request",
+
+    "chat_boost",
+
+    "removed_chat_boost"
+
+)
+
+USER_UPDATE_FIELDS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+def update_shard_key(update: Dict[str, Any]) -> int:
+
+    for field in CHAT_UPDATE_FIELDS:
+
+        event = update.get(field)
+
+        if event and event.get("chat"):
+
+            return event["chat"]["id"]
+
+    callback = update.get("callback_query")
+
+    if callback:
+
+        message = callback.get("message")
+
+        return message["chat"]["id"] if message and message.get("chat") else callback["from"]["id"]
+
+    for field in USER_UPDATE_FIELDS:
+
+        event = update.get(field)
+
+        user = event and (event.get("from") or event.get("user"))
+
+        if user:
+
+            return user["id"]
+
+    return update.get("update_id", 0)
+
+async def feed_dispatcher(dispatcher: Dispatcher, bot: Bot, update: Dict[str, Any]):
+
+    result = await dispatcher.feed_raw_update(bot, update, dispatcher=dispatcher, bots=[bot])
+
+    if isinstance(result, TelegramMethod):
+
+        await dispatcher.silent_call_request(bot, result)
+
+class ShardWorker:
+
+    def __init__(
+
+        self,
+
+        index: int,
+
+        workers: int,
+
+        updates: Any,
+
+        control: Any,
+
+        dispatcher: Dispatcher,
+
+        bot: Bot,
+
+        on_invalidation: Callable[[str, int], None],
+
+        max_in_flight: int = SHARD_WORKER_MAX_IN_FLIGHT,
+
+        max_pending: int = SHARD_QUEUE_SIZE,
+
+        chat_max_pending: int = SHARD_CHAT_MAX_PENDING
+
+    ):
+
+        self.index = index
+
+        self.workers = workers
+
+        self.updates = updates
+
+        self.control = control
+
+        self.dispatcher = dispatcher
+
+        self.bot = bot
+
+        self.on_invalidation = on_invalidation
+
+        self.in_flight = 0
+
+        self.processed = 0
+
+        self.failed = 0
+
+        self.invalidations = 0
+
+        self.dropped = 0
+
+        self.chat_max_pending = chat_max_pending
+
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+        self._backlog = asyncio.Semaphore(max_pending)
+
+        self._pending: Dict[int, int] = {}
+
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def publish_invalidation(self, kind: str, user_id: int):
+
+        self.control.put(("invalidate", self.index, kind, user_id))
+
+    async def run(self):
+
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop(), name=f"shard_{self.index}_heartbeat")
+
+        try:
+
+            await self._consume()
+
+            if self._tails:
+
+                await asyncio.wait(set(self._tails.values()), timeout=SHARD_SHUTDOWN_SECONDS)
+
+        finally:
+
+            heartbeat_task.cancel()
+
+            with suppress(asyncio.CancelledError):
+
+                await heartbeat_task
+
+    async def _consume(self):
+
+        parent = multiprocessing.parent_process()
+
+        while True:
+
+            await self._backlog.acquire()
+
+            item = None
+
+            while item is None:
+
+                try:
+
+                    item = await asyncio.to_thread(self.updates.get, True, 1.0)
+
+                except queue.Empty:
+
+                    if parent is not None and not parent.is_alive():
+
+                        logger.error(f"Shard {self.index}: front process is gone, stopping.")
+
+                        self._backlog.release()
+
+                        return
+
+                    continue
+
+                if item == "stop":
+
+                    self._backlog.release()
+
+                    return
+
+            if item[0] == "invalidate":
+
+                self.invalidations += 1
+
+                self.on_invalidation(item[1], item[2])
+
+                self._backlog.release()
+
+                continue
+
+            _, key, update = item
+
+            if self._pending.get(key, 0) >= self.chat_max_pending:
+
+                self.dropped += 1
+
+                logger.warning(f"Shard {self.index}: chat {key} already has {self.chat_max_pending} pending updates, dropping update {update.get('update_id')}.")
+
+                self._backlog.release()
+
+                continue
+
+            self._pending[key] = self._pending.get(key, 0) + 1
+
+            task = asyncio.create_task(self._process(key, self._tails.get(key), update))
+
+            self._tails[key] = task
+
+            task.add_done_callback(partial(self._forget, key))
+
+    async def _process(self, key: int, previous: Optional[asyncio.Task], update: Dict[str, Any]):
+
+        try:
+
+            if previous is not None:
+
+                await asyncio.wait([previous])
+
+            async with self._slots:
+
+                self.in_flight += 1
+
+                try:
+
+                    await feed_dispatcher(self.dispatcher, self.bot, update)
+
+                finally:
+
+                    self.in_flight -= 1
+
+            self.processed += 1
+
+        except Exception as e:
+
+            self.failed += 1
+
+            logger.error(f"Shard {self.index} failed to process update {update.get('update_id')}: {e}", exc_info=True)
+
+        finally:
+
+            self._pending[key] -= 1
+
+            if not self._pending[key]:
+
+                del self._pending[key]
+
+            self._backlog.release()
+
+    def _forget(self, key: int, task: asyncio.Task):
+
+        if self._tails.get(key) is task:
+
+            del self._tails[key]
+
+    async def _heartbeat_loop(self):
+
+        while True:
+
+            self.control.put(("heartbeat", self.index, self.stats()))
+
+            await asyncio.sleep(SHARD_HEARTBEAT_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+
+        return {
+
+            "pid": os.getpid(),
+
+            "in_flight": self.in_flight,
+
+            "pending": sum(self._pending.values()),
+
+            "chats": len(self._tails),
+
+            "processed": self.processed,
+
+            "failed": self.failed,
+
+            "dropped": self.dropped,
+
+            "invalidations": self.invalidations
+
+        }
+
+class ShardSupervisor:
+
+    def __init__(
+
+        self,
+
+        workers: int,
+
+        target: Callable[..., None],
+
+        target_args: Tuple[Any, ...] = (),
+
+        on_worker_exit: Optional[Callable[[int], None]] = None,
+
+        queue_size: int = SHARD_QUEUE_SIZE
+
+    ):
+
+        self.workers = workers
+
+        self.target = target
+
+        self.target_args = target_args
+
+        self.on_worker_exit = on_worker_exit
+
+        self.queue_size = queue_size
+
+        self._context = multiprocessing.get_context("spawn")
+
+        self.updates = [self._context.Queue(queue_size) for _ in range(workers)]
+
+        self.control = self._context.Queue()
+
+        self.outboxes: List[asyncio.Queue] = [asyncio.Queue() for _ in range(workers)]
+
+        self.processes: List[Any] = [None] * workers
+
+        self.routed = [0] * workers
+
+        self.dropped = [0] * workers
+
+        self.restarts = [0] * workers
+
+        self.worker_stats: List[Dict[str, Any]] = [{} for _ in range(workers)]
+
+        self._last_heartbeat = [0.0] * workers
+
+        self._failures = [0] * workers
+
+        self._restart_at: Dict[int, float] = {}
+
+        self._tasks: List[asyncio.Task] = []
+
+        self._forwarders: List[asyncio.Task] = []
+
+    def _spawn(self, index: int):
+
+        process = self._context.Process(target=self.target, args=(index, self.workers, self.updates[index], self.control, *self.target_args), name=f"shard-{index}", daemon=True)
+
+        process.start()
+
+        self.processes[index] = process
+
+        self._last_heartbeat[index] = 0.0
+
+        logger.info(f"Shard worker {index}/{self.workers} started (pid {process.pid}).")
+
+    def start(self):
+
+        for index in range(self.workers):
+
+            self._spawn(index)
+
+        self._tasks = [
+
+            asyncio.create_task(self._read_control(), name="shard_control"),
+
+            asyncio.create_task(self._supervise(), name="shard_supervisor")
+
+        ]
+
+        self._forwarders = [asyncio.create_task(self._forward(index), name=f"shard_{index}_forward") for index in range(self.workers)]
+
+    async def route(self, update: Dict[str, Any]) -> bool:
+
+        key = update_shard_key(update)
+
+        index = key % self.workers
+
+        if self.outboxes[index].qsize() >= self.queue_size:
+
+            self.dropped[index] += 1
+
+            if self.dropped[index] == 1 or self.dropped[index] % 100 == 0:
+
+                logger.warning(f"Shard worker {index} is not keeping up, dropped update {update.get('update_id')} ({self.dropped[index]} dropped so far).")
+
+            return False
+
+        self.outboxes[index].put_nowait(("update", key, update))
+
+        self.routed[index] += 1
+
+        return True
+
+    async def _forward(self, index: int):
+
+        outbox = self.outboxes[index]
+
+        while True:
+
+            item = await outbox.get()
+
+            while True:
+
+                try:
+
+                    self.updates[index].put_nowait(item)
+
+                    break
+
+                except queue.Full:
+
+                    await asyncio.sleep(SHARD_FORWARD_RETRY_SECONDS)
+
+    async def _read_control(self):
+
+        while True:
+
+            try:
+
+                message = await asyncio.to_thread(self.control.get, True, 1.0)
+
+            except queue.Empty:
+
+                continue
+
+            if message[0] == "heartbeat":
+
+                _, index, stats = message
+
+                self._last_heartbeat[index] = time.monotonic()
+
+                self._failures[index] = 0
+
+                self.worker_stats[index] = stats
+
+            elif message[0] == "invalidate":
+
+                _, origin, kind, user_id = message
+
+                for index in range(self.workers):
+
+                    if index != origin:
+
+                        self.outboxes[index].put_nowait(("invalidate", kind, user_id))
+
+    async def _supervise(self):
+
+        next_status_log = time.monotonic() + SHARD_STATUS_LOG_SECONDS
+
+        while True:
+
+            await asyncio.sleep(SHARD_HEARTBEAT_SECONDS)
+
+            now = time.monotonic()
+
+            if now >= next_status_log:
+
+                next_status_log = now + SHARD_STATUS_LOG_SECONDS
+
+                logger.info(f"Shard status: {self.stats()}")
+
+            for index, process in enumerate(self.processes):
+
+                if index in self._restart_at:
+
+                    if now >= self._restart_at[index]:
+
+                        del self._restart_at[index]
+
+                        self._spawn(index)
+
+                    continue
+
+                if not process.is_alive():
+
+                    logger.error(f"Shard worker {index} (pid {process.pid}) exited with code {process.exitcode}.")
+
+                    if process.exitcode < 0:
+
+                        self._replace_queue(index)
+
+                    self._release_worker(index)
+
+                    self._schedule_restart(index)
+
+                elif self._last_heartbeat[index] and now - self._last_heartbeat[index] > SHARD_HEARTBEAT_TIMEOUT_SECONDS:
+
+                    logger.error(f"Shard worker {index} (pid {process.pid}) sent no heartbeat for {now - self._last_heartbeat[index]:.0f}s, killing it.")
+
+                    process.kill()
+
+                    await asyncio.to_thread(process.join, 5)
+
+                    self._replace_queue(index)
+
+                    self._release_worker(index)
+
+                    self._schedule_restart(index)
+
+    def _release_worker(self, index: int):
+
+        if self.on_worker_exit is not None:
+
+            self.on_worker_exit(index)
+
+    def _replace_queue(self, index: int):
+
+        self.updates[index] = self._context.Queue(self.queue_size)
+
+        logger.warning(f"Shard worker {index} was killed and may hold its queue lock: updates still queued for it were dropped.")
+
+    def _schedule_restart(self, index: int):
+
+        delay = min(SHARD_MAX_RESTART_DELAY_SECONDS, 2 ** self._failures[index] - 1)
+
+        self._failures[index] += 1
+
+        self.restarts[index] += 1
+
+        self._restart_at[index] = time.monotonic() + delay
+
+        logger.warning(f"Restarting shard worker {index} in {delay:.0f}s (restart #{self.restarts[index]}).")
+
+    async def poll(self, bot: Bot, allowed_updates: Optional[List[str]] = None):
+
+        stop_event = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+
+            with suppress(NotImplementedError, RuntimeError):
+
+                loop.add_signal_handler(sig, stop_event.set)
+
+        polling_task = asyncio.create_task(self._poll_updates(bot, allowed_updates), name="shard_polling")
+
+        stop_task = asyncio.create_task(stop_event.wait())
+
+        try:
+
+            await asyncio.wait([polling_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+
+            logger.info("Stop signal received, shutting down shard front.")
+
+        finally:
+
+            for task in (polling_task, stop_task):
+
+                task.cancel()
+
+                with suppress(asyncio.CancelledError):
+
+                    await task
+
+    async def _poll_updates(self, bot: Bot, allowed_updates: Optional[List[str]]):
+
+        backoff = Backoff(config=POLLING_BACKOFF)
+
+        get_updates = GetUpdates(timeout=POLLING_TIMEOUT_SECONDS, allowed_updates=allowed_updates)
+
+        request_timeout = int(bot.session.timeout + POLLING_TIMEOUT_SECONDS)
+
+        while True:
+
+            try:
+
+                updates = await bot(get_updates, request_timeout=request_timeout)
+
+            except Exception as e:
+
+                logger.error(f"Failed to fetch updates: {type(e).__name__}: {e}. Retrying in {backoff.next_delay:.1f}s.")
+
+                await backoff.asleep()
+
+                continue
+
+            backoff.reset()
+
+            for update in updates:
+
+                await self.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+                get_updates.offset = update.update_id + 1
+
+    async def close(self):
+
+        for task in self._tasks:
+
+            task.cancel()
+
+        for task in self._tasks:
+
+            with suppress(asyncio.CancelledError):
+
+                await task
+
+        self._restart_at.clear()
+
+        for index, process in enumerate(self.processes):
+
+            if process is not None and process.is_alive():
+
+                self.outboxes[index].put_nowait("stop")
+
+        deadline = time.monotonic() + SHARD_SHUTDOWN_SECONDS
+
+        while time.monotonic() < deadline and any(self.outboxes[index].qsize() and process.is_alive() for index, process in enumerate(self.processes) if process is not None):
+
+            await asyncio.sleep(SHARD_FORWARD_RETRY_SECONDS)
+
+        for task in self._forwarders:
+
+            task.cancel()
+
+        for task in self._forwarders:
+
+            with suppress(asyncio.CancelledError):
+
+                await task
+
+        for index, process in enumerate(self.processes):
+
+            if process is None:
+
+                continue
+
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+
+            if process.is_alive():
+
+                logger.warning(f"Shard worker {index} did not stop in time, terminating it.")
+
+                process.terminate()
+
+                await asyncio.to_thread(process.join, 5)
+
+        logger.info(f"Shard workers stopped. Routed per shard: {self.routed}, dropped: {self.dropped}, restarts: {self.restarts}.")
+
+    def stats(self) -> List[Dict[str, Any]]:
+
+        now = time.monotonic()
+
+        return [
+
+            {
+
+                "alive": process is not None and process.is_alive(),
+
+                "routed": self.routed[index],
+
+                "dropped_by_front": self.dropped[index],
+
+                "backlog": self.outboxes[index].qsize(),
+
+                "restarts": self.restarts[index],
+
+                "heartbeat_age": round(now - self._last_heartbeat[index], 1) if self._last_heartbeat[index] else None,
+
+                **self.worker_stats[index]
+
+            }
+
+            for index, process in enumerate(self.processes)
+
+        ]
@@ -0,0 +1,219 @@
+import asyncio
+
+import unittest
+
+from typing import List
+
+import ollama
+
+from fake_ollama import FakeOllamaServer
+
+from ollama_pool import NoBackendAvailable, OllamaBackendPool
+
+MODEL = "gemma3:latest"
+
+MESSAGES = [{"role": "user", "content": "привет"}]
+
+class OllamaBackendPoolTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+
+        self.servers: List[FakeOllamaServer] = []
+
+        self.pool: OllamaBackendPool = None
+
+    async def asyncTearDown(self):
+
+        if self.pool is not None:
+
+            await self.pool.close()
+
+        for server in self.servers:
+
+            await server.close()
+
+    async def start_servers(self, *model_sets: List[str]) -> List[FakeOllamaServer]:
+
+        for models in model_sets:
+
+            server = FakeOllamaServer(models, reply="ответ сервера")
+
+            await server.start()
+
+            self.servers.append(server)
+
+        return self.servers
+
+    def make_pool(self, hosts: List[str]) -> OllamaBackendPool:
+
+        self.pool = OllamaBackendPool(hosts, lambda host: ollama.AsyncClient(host=host))
+
+        return self.pool
+
+    async def test_probe_reads_inventory_and_health(self):
+
+        first, second = await self.start_servers([MODEL, "mistral"], [MODEL])
+
+        pool = self.make_pool([first.url, second.url])
+
+        second.fail_status = 503
+
+        await pool.probe_all()
+
+        self.assertEqual(pool.backends[0].models, {MODEL, "mistral:latest"})
+
+        self.assertTrue(pool.backends[0].healthy)
+
+        self.assertFalse(pool.backends[1].healthy)
+
+        second.fail_status = None
+
+        await pool.probe_all()
+
+        self.assertTrue(pool.backends[1].healthy)
+
+        self.assertEqual(pool.backends_for("mistral"), [pool.backends[0]])
+
+    async def test_failover_to_next_host_when_one_is_down(self):
+
+        first, second = await self.start_servers([MODEL], [MODEL])
+
+        pool = self.make_pool([first.url, second.url])
+
+        await pool.probe_all()
+
+        await first.close()
+
+        for _ in range(4):
+
+            response = await pool.chat(MODEL, messages=MESSAGES, stream=False)
+
+            self.assertEqual(response.message.content, "ответ сервера")
+
+        self.assertFalse(pool.backends[0].healthy)
+
+        self.assertEqual(pool.backends[0].failures, 1)
+
+        self.assertEqual(second.served["chat"], 4)
+
+    async def test_failover_on_server_error_and_stream(self):
+
+        first, second = await self.start_servers([MODEL], [MODEL])
+
+        pool = self.make_pool([first.url, second.url])
+
+        first.fail_status = 500
+
+        second.fail_status = 500
+
+        with self.assertRaises(ollama.ResponseError):
+
+            await pool.generate(MODEL, prompt="x")
+
+        self.assertFalse(any(backend.healthy for backend in pool.backends))
+
+        second.fail_status = None
+
+        await pool.probe_all()
+
+        chunks = [chunk.message.content async for chunk in pool.chat_stream(MODEL, messages=MESSAGES)]
+
+        self.assertEqual("".join(chunks).strip(), "ответ сервера")
+
+        self.assertEqual(second.served["chat"], 1)
+
+    async def test_404_drops_model_from_inventory(self):
+
+        first, second = await self.start_servers([MODEL], [MODEL])
+
+        pool = self.make_pool([first.url, second.url])
+
+        await pool.probe_all()
+
+        first.models.clear()
+
+        for _ in range(3):
+
+            response = await pool.generate(MODEL, prompt="x")
+
+            self.assertEqual(response.response, "ответ сервера")
+
+        self.assertNotIn(MODEL, pool.backends[0].models)
+
+        self.assertTrue(pool.backends[0].healthy)
+
+        self.assertEqual(first.requests["generate"], 1)
+
+        self.assertEqual(second.served["generate"], 3)
+
+        self.assertEqual(pool.backends_for(MODEL), [pool.backends[1]])
+
+    async def test_unknown_model_everywhere_raises(self):
+
+        first, = await self.start_servers([MODEL])
+
+        pool = self.make_pool([first.url])
+
+        with self.assertRaises(ollama.ResponseError):
+
+            await pool.chat("missing", messages=MESSAGES, stream=False)
+
+        with self.assertRaises(NoBackendAvailable):
+
+            await self.make_pool([]).chat(MODEL, messages=MESSAGES, stream=False)
+
+    async def test_least_outstanding_routing(self):
+
+        servers = await self.start_servers([MODEL], [MODEL], [MODEL])
+
+        pool = self.make_pool([server.url for server in servers])
+
+        await pool.probe_all()
+
+        gate = asyncio.Event()
+
+        for server in servers:
+
+            server.gate = gate
+
+        calls = []
+
+        for expected_busy in range(1, 4):
+
+            calls.append(asyncio.create_task(pool.chat(MODEL, messages=MESSAGES, stream=False)))
+
+            while sum(server.in_flight for server in servers) < expected_busy:
+
+                await asyncio.sleep(0.01)
+
+        self.assertEqual([server.in_flight for server in servers], [1, 1, 1])
+
+        self.assertEqual([backend.outstanding for backend in pool.backends], [1, 1, 1])
+
+        gate.set()
+
+        await asyncio.gather(*calls)
+
+        self.assertEqual([backend.outstanding for backend in pool.backends], [0, 0, 0])
+
+    async def test_busy_host_is_skipped(self):
+
+        busy, idle = await self.start_servers([MODEL], [MODEL])
+
+        pool = self.make_pool([busy.url, idle.url])
+
+        await pool.probe_all()
+
+        pool.backends[0].outstanding = 5
+
+        for _ in range(3):
+
+            await pool.chat(MODEL, messages=MESSAGES, stream=False)
+
+        self.assertEqual(busy.requests["chat"], 0)
+
+        self.assertEqual(idle.served["chat"], 3)
+
+if __name__ == '__main__':
+
+    unittest.main()
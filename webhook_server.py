@@ -0,0 +1,281 @@
+import asyncio
+
+import os
+
+import secrets
+
+import signal
+
+import logging
+
+from contextlib import suppress
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from aiohttp import web
+
+from aiogram import Bot, Dispatcher
+
+from aiogram.methods import TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+
+WEBHOOK_LISTEN_HOST = os.getenv("WEBHOOK_LISTEN_HOST", "0.0.0.0")
+
+WEBHOOK_LISTEN_PORT = int(os.getenv("WEBHOOK_LISTEN_PORT", "8080"))
+
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+WEBHOOK_MAX_IN_FLIGHT = max(1, int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "64")))
+
+WEBHOOK_MAX_CONNECTIONS = min(100, max(1, int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))))
+
+WEBHOOK_DRAIN_SECONDS = max(0, int(os.getenv("WEBHOOK_DRAIN_SECONDS", "10")))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+
+    def __init__(
+
+        self,
+
+        dispatcher: Dispatcher,
+
+        bot: Bot,
+
+        path: str = WEBHOOK_PATH,
+
+        secret: str = WEBHOOK_SECRET,
+
+        max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT,
+
+        feed: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None
+
+    ):
+
+        self.dispatcher = dispatcher
+
+        self.bot = bot
+
+        self.path = path
+
+        self.generated_secret = not secret
+
+        self.secret = secret or secrets.token_urlsafe(32)
+
+        self.max_in_flight = max_in_flight
+
+        self.feed = feed
+
+        self.received = 0
+
+        self.processed = 0
+
+        self.failed = 0
+
+        self.rejected = 0
+
+        self.in_flight = 0
+
+        self.peak_in_flight = 0
+
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+        self._tasks: Set[asyncio.Task] = set()
+
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+
+        app = web.Application()
+
+        app.router.add_post(self.path, self.handle)
+
+        app.router.add_get("/healthz", self.health)
+
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+
+            self.rejected += 1
+
+            return web.Response(status=401, text="Unauthorized")
+
+        try:
+
+            update = await request.json(loads=self.bot.session.json_loads)
+
+        except ValueError:
+
+            self.rejected += 1
+
+            return web.Response(status=400, text="Bad Request")
+
+        self.received += 1
+
+        await self._slots.acquire()
+
+        self.in_flight += 1
+
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+        task = asyncio.create_task(self._process(update), name=f"webhook_update_{update.get('update_id')}")
+
+        self._tasks.add(task)
+
+        task.add_done_callback(self._tasks.discard)
+
+        return web.json_response({})
+
+    async def _process(self, update: Dict[str, Any]):
+
+        try:
+
+            if self.feed is not None:
+
+                await self.feed(update)
+
+                self.processed += 1
+
+                return
+
+            result = await self.dispatcher.feed_raw_update(self.bot, update, dispatcher=self.dispatcher, bots=[self.bot])
+
+            if isinstance(result, TelegramMethod):
+
+                await self.dispatcher.silent_call_request(self.bot, result)
+
+            self.processed += 1
+
+        except Exception as e:
+
+            self.failed += 1
+
+            logger.error(f"Failed to process webhook update {update.get('update_id')}: {e}", exc_info=True)
+
+        finally:
+
+            self.in_flight -= 1
+
+            self._slots.release()
+
+    async def health(self, request: web.Request) -> web.Response:
+
+        return web.json_response(self.stats())
+
+    async def start(self, host: str = WEBHOOK_LISTEN_HOST, port: int = WEBHOOK_LISTEN_PORT):
+
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+
+        await self._runner.setup()
+
+        await web.TCPSite(self._runner, host, port).start()
+
+        logger.info(f"Webhook server listening on {host}:{port}{self.path} (max {self.max_in_flight} updates in flight).")
+
+    async def close(self, drain_seconds: float = WEBHOOK_DRAIN_SECONDS):
+
+        if self._runner is not None:
+
+            await self._runner.cleanup()
+
+            self._runner = None
+
+        if not self._tasks:
+
+            return
+
+        logger.info(f"Waiting up to {drain_seconds}s for {len(self._tasks)} webhook updates in flight.")
+
+        _, pending = await asyncio.wait(set(self._tasks), timeout=drain_seconds)
+
+        for task in pending:
+
+            task.cancel()
+
+        for task in pending:
+
+            with suppress(asyncio.CancelledError):
+
+                await task
+
+    async def serve(self, allowed_updates: Optional[List[str]] = None):
+
+        if not WEBHOOK_URL and self.generated_secret:
+
+            raise RuntimeError("WEBHOOK_SECRET must be set to serve webhook updates without WEBHOOK_URL.")
+
+        stop_event = asyncio.Event()
+
+        loop = asyncio.get_running_loop()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+
+            with suppress(NotImplementedError, RuntimeError):
+
+                loop.add_signal_handler(sig, stop_event.set)
+
+        workflow_data = {"dispatcher": self.dispatcher, "bots": [self.bot], **self.dispatcher.workflow_data}
+
+        await self.dispatcher.emit_startup(bot=self.bot, **workflow_data)
+
+        try:
+
+            await self.start()
+
+            if WEBHOOK_URL:
+
+                await self.bot.set_webhook(
+
+                    WEBHOOK_URL + self.path,
+
+                    secret_token=self.secret,
+
+                    allowed_updates=allowed_updates,
+
+                    max_connections=WEBHOOK_MAX_CONNECTIONS
+
+                )
+
+                logger.info(f"Webhook registered at {WEBHOOK_URL}{self.path}{' with a generated secret token' if self.generated_secret else ''}.")
+
+            else:
+
+                logger.warning("WEBHOOK_URL is not set: webhook was not registered with Telegram, only local POSTs will be served.")
+
+            await stop_event.wait()
+
+            logger.info("Stop signal received, shutting down webhook server.")
+
+        finally:
+
+            await self.close()
+
+            await self.dispatcher.emit_shutdown(bot=self.bot, **workflow_data)
+
+    def stats(self) -> Dict[str, Any]:
+
+        return {
+
+            "in_flight": self.in_flight,
+
+            "max_in_flight": self.max_in_flight,
+
+            "peak_in_flight": self.peak_in_flight,
+
+            "received": self.received,
+
+            "processed": self.processed,
+
+            "failed": self.failed,
+
+            "rejected": self.rejected
+
+        }